@@ -5,14 +5,24 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import jwt
-import hashlib
+import hmac
 import sqlite3
 import os
+import uuid
 from datetime import datetime, timedelta
 from functools import wraps
+from metrics import REGISTRY, instrument_app, stage_timer
+from sqlite_pool import SQLitePool
+from password_hasher import HasherOverloaded, HasherTimeout, PasswordHasher
+from token_revocation import TokenRevocationList
+from user_import import ImportFormatError, import_users, parse_users
+
+# 慢请求日志阈值（毫秒），超过时打印各阶段耗时；0为关闭
+SLOW_REQUEST_MS = float(os.environ.get('AUTH_SLOW_REQUEST_MS', 0))
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app, slow_request_ms=SLOW_REQUEST_MS)  # 请求统计与 /metrics
 
 # JWT 密钥（生产环境应使用环境变量）
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
@@ -20,50 +30,123 @@ JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 
 # 数据库文件路径
-DB_FILE = 'users.db'
+DB_FILE = os.environ.get('AUTH_DB_FILE', 'users.db')
+
+# 数据库连接池：有界的长连接池，请求时借出、结束时归还，WAL 模式（见 sqlite_pool.py）
+db_pool = SQLitePool(
+    DB_FILE,
+    busy_timeout_ms=int(os.environ.get('AUTH_DB_BUSY_TIMEOUT_MS', 5000)),
+    synchronous=os.environ.get('AUTH_DB_SYNCHRONOUS', 'NORMAL'),
+    wal=os.environ.get('AUTH_DB_WAL', '1') != '0',
+    pooled=os.environ.get('AUTH_DB_POOL', '1') != '0',
+    max_connections=int(os.environ.get('AUTH_DB_MAX_CONNECTIONS', 8))
+)
+
+# 固定的 SQL 文本，同一连接内只预编译一次
+SQL_USER_BY_USERNAME = 'SELECT id FROM users WHERE username = ?'
+SQL_USER_BY_EMAIL = 'SELECT id FROM users WHERE email = ?'
+SQL_INSERT_USER = 'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)'
+SQL_LOGIN = 'SELECT id, username, email, password_hash, must_change_password FROM users WHERE username = ?'
+SQL_UPDATE_PASSWORD = 'UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?'
+SQL_PASSWORD_BY_ID = 'SELECT password_hash FROM users WHERE id = ?'
+SQL_CHANGE_PASSWORD = ('UPDATE users SET password_hash = ?, must_change_password = 0, '
+                       'updated_at = CURRENT_TIMESTAMP WHERE id = ?')
+SQL_USER_BY_ID = 'SELECT id, username, email, created_at FROM users WHERE id = ?'
+
+# 密码哈希：算法与代价可配置，在有界线程池中计算（见 password_hasher.py）
+password_hasher = PasswordHasher(
+    algorithm=os.environ.get('AUTH_PASSWORD_ALGORITHM', 'pbkdf2_sha256'),
+    cost=int(os.environ['AUTH_PASSWORD_COST']) if os.environ.get('AUTH_PASSWORD_COST') else None,
+    max_workers=int(os.environ.get('AUTH_HASH_WORKERS', 0)) or None,
+    max_queue=int(os.environ.get('AUTH_HASH_QUEUE', 32)),
+    timeout=float(os.environ.get('AUTH_HASH_TIMEOUT_MS', 5000)) / 1000
+)
+
+# 批量导入时生成的随机初始密码使用较低代价（文件中提供的密码按正常代价哈希）；
+# 这些账户标记为必须修改密码，首次登录时立即按正常代价重新哈希
+ONE_TIME_PASSWORD_COSTS = {'pbkdf2_sha256': 5000, 'scrypt': 1024}
+ONE_TIME_PASSWORD_COST = (int(os.environ.get('AUTH_ONE_TIME_PASSWORD_COST', 0))
+                          or ONE_TIME_PASSWORD_COSTS[password_hasher.algorithm])
+
+# 必须修改初始密码的 token 只能访问这些接口
+PASSWORD_CHANGE_ENDPOINTS = {'change_password', 'get_current_user', 'logout'}
+
+# 管理员接口的令牌（请求头 X-Admin-Token），未设置时管理员接口不可用
+ADMIN_TOKEN = os.environ.get('AUTH_ADMIN_TOKEN', '')
+
+# 其他工作进程的登出记录最多延迟多久生效（秒）
+REVOCATION_REFRESH_SECONDS = float(os.environ.get('AUTH_REVOCATION_REFRESH_SECONDS', 2))
+
+# 已吊销 token 列表（登出），在 init_db 中批量加载
+revoked_tokens = None
+
 
 def init_db():
     """初始化用户数据库"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # 创建用户表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print(f"数据库初始化完成: {DB_FILE}")
+    with db_pool.transaction() as conn:
+        # 创建用户表
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                must_change_password INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # 旧数据库补充 must_change_password 列
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+        if 'must_change_password' not in columns:
+            conn.execute('ALTER TABLE users ADD COLUMN must_change_password INTEGER NOT NULL DEFAULT 0')
+
+    global revoked_tokens
+    revoked_tokens = TokenRevocationList(db_pool, refresh_interval=REVOCATION_REFRESH_SECONDS)
+    loaded = revoked_tokens.load()
+    print(f"数据库初始化完成: {db_pool.path}（已吊销token {loaded} 个）")
 
 
 def hash_password(password):
     """对密码进行哈希加密"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    with stage_timer('password_hash'):
+        return password_hasher.hash(password)
+
+
+def check_password(password, stored_hash):
+    """校验密码，返回 (是否匹配, 是否需要重新哈希)"""
+    with stage_timer('password_hash'):
+        return password_hasher.verify(password, stored_hash)
+
+
+def hashing_busy_response(status_code):
+    """哈希线程池过载（429）或超时（503）时的响应"""
+    response = jsonify({'message': '请求过多，请稍后重试'})
+    response.status_code = status_code
+    response.headers['Retry-After'] = '1'
+    return response
 
 
-def generate_token(user_id, username):
+def generate_token(user_id, username, must_change_password=False):
     """生成 JWT token"""
     payload = {
         'user_id': user_id,
         'username': username,
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        'jti': uuid.uuid4().hex
     }
-    return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+    if must_change_password:
+        payload['must_change_password'] = True
+    with stage_timer('jwt_encode'):
+        return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
 
 
 def verify_token(token):
     """验证 JWT token"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        with stage_timer('jwt_decode'):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
         return payload
     except jwt.ExpiredSignatureError:
         return None
@@ -92,6 +175,12 @@ def token_required(f):
         if not payload:
             return jsonify({'message': 'Token无效或已过期'}), 401
         
+        if revoked_tokens.is_revoked(payload.get('jti')):
+            return jsonify({'message': 'Token已失效，请重新登录'}), 401
+        
+        if payload.get('must_change_password') and f.__name__ not in PASSWORD_CHANGE_ENDPOINTS:
+            return jsonify({'message': '请先修改初始密码', 'must_change_password': True}), 403
+        
         request.current_user = payload
         return f(*args, **kwargs)
     
@@ -117,36 +206,28 @@ def register():
         if len(password) < 6:
             return jsonify({'message': '密码至少6个字符'}), 400
         
-        # 连接数据库
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        # 检查用户名、邮箱是否已存在
+        with stage_timer('sqlite'), db_pool.connection() as conn:
+            username_taken = conn.execute(SQL_USER_BY_USERNAME, (username,)).fetchone() is not None
+            email_taken = not username_taken and conn.execute(SQL_USER_BY_EMAIL, (email,)).fetchone() is not None
         
-        # 检查用户名是否已存在
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-        if cursor.fetchone():
-            conn.close()
+        if username_taken:
             return jsonify({'message': '用户名已存在'}), 400
-        
-        # 检查邮箱是否已存在
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        if cursor.fetchone():
-            conn.close()
+        if email_taken:
             return jsonify({'message': '邮箱已被注册'}), 400
         
-        # 创建新用户
+        # 创建新用户（哈希在事务外计算，不占用写锁）
         password_hash = hash_password(password)
-        cursor.execute(
-            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-            (username, email, password_hash)
-        )
-        user_id = cursor.lastrowid
+        try:
+            with stage_timer('sqlite'), db_pool.transaction() as conn:
+                user_id = conn.execute(SQL_INSERT_USER, (username, email, password_hash)).lastrowid
+        except sqlite3.IntegrityError:
+            # 并发注册同一用户名/邮箱时，检查之后的插入仍可能冲突
+            return jsonify({'message': '用户名或邮箱已存在'}), 400
         
         # 生成 token
         token = generate_token(user_id, username)
         
-        conn.commit()
-        conn.close()
-        
         return jsonify({
             'message': '注册成功',
             'token': token,
@@ -157,6 +238,10 @@ def register():
             }
         }), 201
         
+    except HasherOverloaded:
+        return hashing_busy_response(429)
+    except HasherTimeout:
+        return hashing_busy_response(503)
     except Exception as e:
         print(f"注册错误: {str(e)}")
         return jsonify({'message': '注册失败，请稍后重试'}), 500
@@ -174,29 +259,35 @@ def login():
         if not username or not password:
             return jsonify({'message': '用户名和密码都是必填项'}), 400
         
-        # 连接数据库
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
         # 查找用户
-        password_hash = hash_password(password)
-        cursor.execute(
-            'SELECT id, username, email FROM users WHERE username = ? AND password_hash = ?',
-            (username, password_hash)
-        )
-        user = cursor.fetchone()
-        conn.close()
+        with stage_timer('sqlite'), db_pool.connection() as conn:
+            user = conn.execute(SQL_LOGIN, (username,)).fetchone()
         
-        if not user:
+        # 用户不存在时也计算一次哈希，响应时间不泄露用户名是否存在
+        matched, needs_rehash = check_password(password, user[3] if user else None)
+        if not matched:
             return jsonify({'message': '用户名或密码错误'}), 401
         
+        user_id, username, email, _, must_change_password = user
+        
+        # 旧的无盐 SHA-256 哈希（或代价参数已调整）在登录成功时透明升级
+        if needs_rehash:
+            try:
+                new_hash = hash_password(password)
+                with stage_timer('sqlite'), db_pool.transaction() as conn:
+                    conn.execute(SQL_UPDATE_PASSWORD, (new_hash, user_id))
+            except (HasherOverloaded, HasherTimeout):
+                # 低代价的随机初始密码必须立即升级（返回 429/503 让客户端重试），其他情况下次登录再升级
+                if must_change_password:
+                    raise
+        
         # 生成 token
-        user_id, username, email = user
-        token = generate_token(user_id, username)
+        token = generate_token(user_id, username, must_change_password=bool(must_change_password))
         
         return jsonify({
-            'message': '登录成功',
+            'message': '登录成功' if not must_change_password else '登录成功，请先修改初始密码',
             'token': token,
+            'must_change_password': bool(must_change_password),
             'user': {
                 'id': user_id,
                 'username': username,
@@ -204,6 +295,10 @@ def login():
             }
         }), 200
         
+    except HasherOverloaded:
+        return hashing_busy_response(429)
+    except HasherTimeout:
+        return hashing_busy_response(503)
     except Exception as e:
         print(f"登录错误: {str(e)}")
         return jsonify({'message': '登录失败，请稍后重试'}), 500
@@ -216,16 +311,8 @@ def get_current_user():
     try:
         user_id = request.current_user['user_id']
         
-        # 连接数据库
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT id, username, email, created_at FROM users WHERE id = ?',
-            (user_id,)
-        )
-        user = cursor.fetchone()
-        conn.close()
+        with stage_timer('sqlite'), db_pool.connection() as conn:
+            user = conn.execute(SQL_USER_BY_ID, (user_id,)).fetchone()
         
         if not user:
             return jsonify({'message': '用户不存在'}), 404
@@ -243,11 +330,69 @@ def get_current_user():
         return jsonify({'message': '获取用户信息失败'}), 500
 
 
+@app.route('/auth/password', methods=['POST'])
+@token_required
+def change_password():
+    """修改密码（批量导入生成初始密码的账户首次登录后必须先调用），成功后吊销当前 token 并返回新 token"""
+    try:
+        data = request.get_json(silent=True) or {}
+        old_password = data.get('old_password')
+        new_password = data.get('new_password')
+        
+        if not old_password or not new_password:
+            return jsonify({'message': '原密码和新密码都是必填项'}), 400
+        
+        if len(new_password) < 6:
+            return jsonify({'message': '密码至少6个字符'}), 400
+        
+        if new_password == old_password:
+            return jsonify({'message': '新密码不能与原密码相同'}), 400
+        
+        user_id = request.current_user['user_id']
+        with stage_timer('sqlite'), db_pool.connection() as conn:
+            user = conn.execute(SQL_PASSWORD_BY_ID, (user_id,)).fetchone()
+        
+        matched, _ = check_password(old_password, user[0] if user else None)
+        if not matched:
+            return jsonify({'message': '原密码错误'}), 401
+        
+        new_hash = hash_password(new_password)
+        with stage_timer('sqlite'), db_pool.transaction() as conn:
+            conn.execute(SQL_CHANGE_PASSWORD, (new_hash, user_id))
+        
+        jti = request.current_user.get('jti')
+        if jti:
+            with stage_timer('sqlite'):
+                revoked_tokens.revoke(jti, request.current_user['exp'])
+        
+        return jsonify({
+            'message': '密码修改成功',
+            'token': generate_token(user_id, request.current_user['username'])
+        }), 200
+        
+    except HasherOverloaded:
+        return hashing_busy_response(429)
+    except HasherTimeout:
+        return hashing_busy_response(503)
+    except Exception as e:
+        print(f"修改密码错误: {str(e)}")
+        return jsonify({'message': '修改密码失败，请稍后重试'}), 500
+
+
 @app.route('/auth/logout', methods=['POST'])
 @token_required
 def logout():
-    """用户登出（客户端应清除 token）"""
-    return jsonify({'message': '登出成功'}), 200
+    """用户登出：吊销当前 token（客户端也应清除 token）"""
+    try:
+        jti = request.current_user.get('jti')
+        # 没有 jti 的旧 token 无法吊销，只能等待自然过期
+        if jti:
+            with stage_timer('sqlite'):
+                revoked_tokens.revoke(jti, request.current_user['exp'])
+        return jsonify({'message': '登出成功'}), 200
+    except Exception as e:
+        print(f"登出错误: {str(e)}")
+        return jsonify({'message': '登出失败，请稍后重试'}), 500
 
 
 @app.route('/auth/refresh', methods=['POST'])
@@ -270,6 +415,76 @@ def refresh_token():
         return jsonify({'message': '刷新token失败'}), 500
 
 
+def admin_required(f):
+    """装饰器：验证管理员令牌"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'message': '管理员接口未启用（需设置 AUTH_ADMIN_TOKEN）'}), 403
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({'message': '管理员令牌无效'}), 401
+        return f(*args, **kwargs)
+    
+    return decorated
+
+
+@app.route('/auth/admin/users/import', methods=['POST'])
+@admin_required
+def bulk_import_users():
+    """
+    批量导入用户
+    
+    请求体为 JSON（{"users": [...]} 或列表）或 CSV（Content-Type: text/csv）；
+    查询参数 dry_run=1 时只校验不写入。返回汇总和逐行报告（含自动生成的初始密码）。
+    """
+    try:
+        dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        if request.is_json:
+            body = request.get_json(silent=True)
+            if isinstance(body, dict):
+                dry_run = dry_run or bool(body.get('dry_run'))
+            users = parse_users(request.get_data(as_text=True), 'json')
+        else:
+            users = parse_users(request.get_data(as_text=True), 'csv')
+        
+        if not users:
+            return jsonify({'message': '没有要导入的用户'}), 400
+        
+        result = import_users(db_pool, password_hasher, users, dry_run=dry_run,
+                              one_time_cost=ONE_TIME_PASSWORD_COST)
+        return jsonify(result), 200
+        
+    except ImportFormatError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        print(f"批量导入错误: {str(e)}")
+        return jsonify({'message': '批量导入失败'}), 500
+
+
+def collect_auth_metrics():
+    """/metrics 导出时采集：数据库连接数、吊销列表大小、密码哈希线程池"""
+    stats = db_pool.stats()
+    hasher_stats = password_hasher.stats()
+    return [
+        ("password_hash_inflight", "gauge", "Password hashes running or queued",
+         [({}, hasher_stats['inflight'])]),
+        ("password_hash_rejected_total", "counter", "Password hashes rejected because the queue was full",
+         [({}, hasher_stats['rejected'])]),
+        ("password_hash_timeouts_total", "counter", "Password hashes that exceeded the timeout",
+         [({}, hasher_stats['timeouts'])]),
+        ("sqlite_open_connections", "gauge", "SQLite connections currently open in the pool",
+         [({}, stats['open_connections'])]),
+        ("sqlite_connections_opened_total", "counter", "SQLite connections opened since start",
+         [({}, stats['connections_opened'])]),
+        ("revoked_tokens", "gauge", "Unexpired revoked tokens held in memory",
+         [({}, len(revoked_tokens) if revoked_tokens is not None else None)]),
+    ]
+
+
+REGISTRY.register_collector(collect_auth_metrics)
+
+
 @app.route('/auth/health', methods=['GET'])
 def health_check():
     """健康检查"""
@@ -283,7 +498,9 @@ if __name__ == '__main__':
     # 启动服务
     port = int(os.environ.get('PORT', 5000))
     print(f"认证服务启动在端口 {port}")
-    app.run(host='0.0.0.0', port=port, debug=True)
+    print("（单进程开发服务器；生产环境使用 python serve.py auth 启动多进程服务）")
+    # 需要调试模式和自动重载时设置 FLASK_DEBUG=1
+    app.run(host='0.0.0.0', port=port)
 else:
     # 如果作为模块导入，也初始化数据库
     init_db()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+认证服务并发压测 - 登录/注册混合负载
+
+对比两种数据库配置：
+- baseline: 每个请求新建并关闭连接，默认回滚日志（synchronous=FULL），即连接池之前的行为
+- pooled:   有界长连接池（借出/归还），WAL + synchronous=NORMAL
+
+通过 Flask 测试客户端在不同并发数下压测 /auth/login 与 /auth/register，统计 p50/p95/p99 延迟、QPS 和错误数。
+登录/注册的耗时主要在密码哈希上；只比较数据库配置时可以用 AUTH_PASSWORD_COST 调低哈希代价，
+哈希线程池满载时被拒绝的请求（429）计为错误。
+
+用法:
+    python benchmark_auth.py
+    python benchmark_auth.py --users 1000 --concurrency 1,8,32 --requests 2000 --register-ratio 0.2
+    python benchmark_auth.py --configs pooled --output auth_bench.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmark_suite import git_commit, percentile
+from sqlite_pool import SQLitePool
+
+PASSWORD = 'benchmark-password'
+
+CONFIGS = {
+    "baseline": {"pooled": False, "wal": False, "synchronous": 'FULL'},
+    "pooled": {"pooled": True, "wal": True, "synchronous": 'NORMAL'},
+}
+
+
+def setup_database(auth_service, path: Path, config: dict, users: int) -> None:
+    """创建数据库并写入压测用户"""
+    auth_service.db_pool.close_all()
+    auth_service.db_pool = SQLitePool(str(path), **config)
+    auth_service.init_db()
+    password_hash = auth_service.password_hasher.hash(PASSWORD)
+    with auth_service.db_pool.transaction() as conn:
+        conn.executemany(
+            auth_service.SQL_INSERT_USER,
+            [(f"user{i:06d}", f"user{i:06d}@bench.local", password_hash) for i in range(users)]
+        )
+
+
+def run_load(app, users: int, concurrency: int, total_requests: int, register_ratio: float, seed: int) -> dict:
+    """并发执行登录/注册请求"""
+    latencies = {"login": [], "register": []}
+    errors = {"login": 0, "register": 0}
+    lock = threading.Lock()
+    per_thread = max(1, total_requests // concurrency)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = app.test_client()
+        local = {"login": [], "register": []}
+        local_errors = {"login": 0, "register": 0}
+        for i in range(per_thread):
+            if rng.random() < register_ratio:
+                kind = "register"
+                name = f"new{concurrency}_{index}_{i}_{seed}"
+                start = time.perf_counter()
+                response = client.post('/auth/register', json={
+                    "username": name, "email": f"{name}@bench.local", "password": PASSWORD
+                })
+                ok = response.status_code == 201
+            else:
+                kind = "login"
+                start = time.perf_counter()
+                response = client.post('/auth/login', json={
+                    "username": f"user{rng.randrange(users):06d}", "password": PASSWORD
+                })
+                ok = response.status_code == 200
+            local[kind].append((time.perf_counter() - start) * 1000)
+            if not ok:
+                local_errors[kind] += 1
+        with lock:
+            for kind in latencies:
+                latencies[kind].extend(local[kind])
+                errors[kind] += local_errors[kind]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = latencies["login"] + latencies["register"]
+    result = {
+        "requests": len(all_latencies),
+        "errors": errors["login"] + errors["register"],
+        "qps": round(len(all_latencies) / elapsed, 1),
+        "p50_ms": percentile(all_latencies, 50),
+        "p95_ms": percentile(all_latencies, 95),
+        "p99_ms": percentile(all_latencies, 99),
+    }
+    for kind in ("login", "register"):
+        result[kind] = {
+            "requests": len(latencies[kind]),
+            "errors": errors[kind],
+            "p50_ms": percentile(latencies[kind], 50),
+            "p99_ms": percentile(latencies[kind], 99),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="认证服务并发登录/注册压测")
+    parser.add_argument("--users", type=int, default=500, help="预先写入的用户数")
+    parser.add_argument("--concurrency", default="1,8,32", help="并发数列表，逗号分隔")
+    parser.add_argument("--requests", type=int, default=1000, help="每个并发级别的请求数")
+    parser.add_argument("--register-ratio", type=float, default=0.1, help="注册请求占比")
+    parser.add_argument("--configs", default="baseline,pooled", help="数据库配置列表（baseline,pooled）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    configs = [name for name in args.configs.split(',') if name]
+    unknown = [name for name in configs if name not in CONFIGS]
+    if unknown:
+        parser.error(f"未知配置: {', '.join(unknown)}，可选: {', '.join(CONFIGS)}")
+    concurrency_levels = [int(level) for level in args.concurrency.split(',') if level]
+
+    work_dir = Path(tempfile.mkdtemp(prefix="auth_bench_"))
+    # 导入时 auth_service 会初始化数据库，指向临时目录避免改动真实的 users.db
+    os.environ['AUTH_DB_FILE'] = str(work_dir / "import.db")
+    import auth_service
+
+    results = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        }
+    }
+    try:
+        for name in configs:
+            print(f"[{name}] {json.dumps(CONFIGS[name])}")
+            results[name] = {}
+            for concurrency in concurrency_levels:
+                # 每个并发级别使用新数据库（WAL 设置会写入数据库文件）
+                db_path = work_dir / f"{name}_{concurrency}.db"
+                setup_database(auth_service, db_path, CONFIGS[name], args.users)
+                result = run_load(auth_service.app, args.users, concurrency, args.requests,
+                                  args.register_ratio, args.seed)
+                result["sqlite_connections_opened"] = auth_service.db_pool.stats()["connections_opened"]
+                results[name][str(concurrency)] = result
+                print(f"  并发 {concurrency}: {result['qps']} QPS，p50 {result['p50_ms']}ms，"
+                      f"p99 {result['p99_ms']}ms，错误 {result['errors']}")
+            auth_service.db_pool.close_all()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if "baseline" in results and "pooled" in results:
+        print("\n" + "=" * 60)
+        print("pooled 相对 baseline")
+        print("=" * 60)
+        for concurrency in concurrency_levels:
+            base = results["baseline"][str(concurrency)]
+            pooled = results["pooled"][str(concurrency)]
+            speedup = pooled["qps"] / base["qps"] if base["qps"] else 0
+            print(f"  并发 {concurrency}: QPS {base['qps']} → {pooled['qps']} ({speedup:.2f}x)，"
+                  f"p99 {base['p99_ms']}ms → {pooled['p99_ms']}ms，"
+                  f"错误 {base['errors']} → {pooled['errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+离线性能基准测试 - 文档解析、入库、搜索
+
+1. 生成指定规模的合成语料（PDF + DOCX），不依赖真实知识库
+2. DocumentProcessor 解析与分块吞吐量（文件/秒、文本块/秒、MB/秒）
+3. VectorStore.add_documents 入库吞吐量（文本块/秒）
+4. 通过 Flask 测试客户端在不同并发数下压测 /api/knowledge/search，统计 p50/p95/p99 延迟和 QPS
+
+--stub-model 使用确定性的哈希embedding代替真实模型，无需网络即可运行；
+结果以JSON输出，可用 --compare 与之前某次提交的结果对比。
+
+用法:
+    python benchmark_suite.py --stub-model --output bench.json
+    python benchmark_suite.py --stub-model --pdfs 40 --docx 10 --concurrency 1,4,16 --modes vector,lexical
+    python benchmark_suite.py --stub-model --output new.json --compare bench.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 合成语料的词表：PDF 使用标准 Type1 字体，只能写入拉丁字符；DOCX 使用中文
+LATIN_WORDS = (
+    "course design objective bloom taxonomy boppps bridge pre-assessment participatory "
+    "post-assessment summary lesson plan assessment student learning outcome active "
+    "feedback rubric syllabus formative summative reflection workshop isw teaching"
+).split()
+CHINESE_SENTENCES = [
+    "课程设计需要明确教学目标与学习成果。", "BOPPPS教学模式包括导入、目标、前测、参与式学习、后测和总结。",
+    "布卢姆分类学把认知目标分为记忆、理解、应用、分析、评价和创造六个层次。",
+    "形成性评价贯穿教学过程，帮助教师及时调整教学策略。", "课程思政要求把价值引领融入知识传授。",
+    "参与式学习强调学生的主动投入和同伴互动。", "ISW教学技能工作坊通过微格教学提升教师的教学能力。",
+    "学情分析是教学设计的起点，需要了解学生的已有知识和学习需求。"
+]
+BENCH_QUERIES = [
+    "课程设计", "BOPPPS教学模式", "布卢姆分类学", "教学目标", "如何设计课程大纲",
+    "课程思政", "参与式学习", "ISW教学技能工作坊", "学情分析", "形成性评价"
+]
+
+
+# ---- 合成语料 ----
+
+def _pdf_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path: Path, pages: list) -> None:
+    """写入最简单的文本PDF（每页若干行，Helvetica字体）"""
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    page_ids = []
+    next_id = 4
+    for text in pages:
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)]
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        page_id, content_id = next_id, next_id + 1
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+        page_ids.append(page_id)
+        next_id += 2
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n{objects[obj_id]}\nendobj\n".encode('latin-1')
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += f"xref\n0 {size}\n0000000000 65535 f \n".encode()
+    for obj_id in range(1, size):
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode()
+    out += f"trailer << /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+def generate_corpus(directory: Path, pdfs: int, docx_files: int, pages: int, seed: int) -> dict:
+    """生成合成语料，返回规模信息"""
+    from docx import Document
+
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(pdfs):
+        page_texts = [
+            ". ".join(" ".join(rng.choice(LATIN_WORDS) for _ in range(12)) for _ in range(25))
+            for _ in range(pages)
+        ]
+        write_pdf(directory / f"synthetic_{i:04d}.pdf", page_texts)
+    for i in range(docx_files):
+        document = Document()
+        for _ in range(pages * 8):
+            document.add_paragraph("".join(rng.choice(CHINESE_SENTENCES) for _ in range(4)))
+        document.save(str(directory / f"synthetic_{i:04d}.docx"))
+
+    total_bytes = sum(path.stat().st_size for path in directory.iterdir())
+    return {"pdfs": pdfs, "docx": docx_files, "pages_per_file": pages, "bytes": total_bytes}
+
+
+# ---- 确定性embedding模型 ----
+
+class StubEmbeddingModel:
+    """
+    确定性的哈希embedding：字符二元组哈希到固定维度后单位化
+
+    相同文本得到相同向量，相近文本向量相近，计算量远小于真实模型，
+    用于在无网络环境下测量模型以外的开销。
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for i in range(max(len(text) - 1, 1)):
+                digest = hashlib.blake2b(text[i:i + 2].encode('utf-8'), digest_size=4).digest()
+                embeddings[row, int.from_bytes(digest, 'little') % self.dim] += 1.0
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        return embeddings
+
+
+# ---- 各项测试 ----
+
+def percentile(values: list, q: float) -> float:
+    return round(float(np.percentile(values, q)), 3) if values else 0.0
+
+
+def bench_extraction(corpus_dir: Path, workers: int, corpus_bytes: int) -> tuple:
+    from document_processor import DocumentProcessor
+
+    processor = DocumentProcessor(chunk_size=800, chunk_overlap=150, workers=workers)
+    files = processor.list_files(str(corpus_dir))
+    start = time.perf_counter()
+    documents = processor.process_files(files)
+    elapsed = time.perf_counter() - start
+    return documents, {
+        "workers": workers,
+        "files": len(files),
+        "chunks": len(documents),
+        "seconds": round(elapsed, 3),
+        "files_per_second": round(len(files) / elapsed, 2),
+        "chunks_per_second": round(len(documents) / elapsed, 1),
+        "mb_per_second": round(corpus_bytes / 1024 / 1024 / elapsed, 2)
+    }
+
+
+def create_store(persist_directory: str, args):
+    from vector_store import VectorStore
+
+    # 结果/查询缓存按参数决定是否启用；embedding磁盘缓存始终关闭，测量真实的encode开销
+    cache_size = 1024 if args.cache else 0
+    store = VectorStore(
+        persist_directory=persist_directory,
+        collection_name="benchmark",
+        query_cache_size=cache_size,
+        result_cache_size=cache_size,
+        embedding_backend=args.embedding_backend,
+        embedding_cache_size=0,
+        index_backend=args.index_backend
+    )
+    if args.stub_model:
+        store.embedding_model = StubEmbeddingModel()
+    return store
+
+
+def bench_ingest(store, documents: list) -> dict:
+    start = time.perf_counter()
+    store.add_documents(documents)
+    elapsed = time.perf_counter() - start
+    return {
+        "chunks": len(documents),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(documents) / elapsed, 1)
+    }
+
+
+def bench_search(store, queries: list, concurrency_levels: list, requests_per_level: int,
+                 top_k: int, mode: str) -> dict:
+    """通过 Flask 测试客户端并发请求搜索接口"""
+    import knowledge_service
+
+    knowledge_service.vector_store = store
+    knowledge_service.search_batcher = None
+    app = knowledge_service.app
+
+    # 预热（首次请求会初始化词法索引、Flask路由等）
+    app.test_client().post('/api/knowledge/search', json={"query": queries[0], "top_k": top_k, "mode": mode})
+
+    results = {}
+    for concurrency in concurrency_levels:
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        per_thread = max(1, requests_per_level // concurrency)
+
+        def worker(offset):
+            nonlocal errors
+            client = app.test_client()
+            local = []
+            local_errors = 0
+            for i in range(per_thread):
+                query = queries[(offset * per_thread + i) % len(queries)]
+                start = time.perf_counter()
+                response = client.post('/api/knowledge/search',
+                                       json={"query": query, "top_k": top_k, "mode": mode})
+                local.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    local_errors += 1
+            with lock:
+                latencies.extend(local)
+                errors += local_errors
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        results[str(concurrency)] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "qps": round(len(latencies) / elapsed, 1),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(max(latencies), 3) if latencies else 0.0
+        }
+        print(f"  [{mode}] 并发 {concurrency}: {results[str(concurrency)]['qps']} QPS，"
+              f"p50 {results[str(concurrency)]['p50_ms']}ms，p99 {results[str(concurrency)]['p99_ms']}ms")
+    return results
+
+
+# ---- 结果对比 ----
+
+def _flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(baseline: dict, current: dict) -> None:
+    """打印吞吐量和延迟指标相对基线的变化"""
+    base = _flatten({k: baseline.get(k, {}) for k in ('extraction', 'ingest', 'search')})
+    cur = _flatten({k: current.get(k, {}) for k in ('extraction', 'ingest', 'search')})
+    print("\n" + "=" * 60)
+    print(f"与基线对比（基线提交 {baseline.get('meta', {}).get('git_commit')}）")
+    print("=" * 60)
+    for name in sorted(cur):
+        if name not in base or not base[name]:
+            continue
+        if not any(name.endswith(suffix) for suffix in ('_per_second', 'qps', '_ms')):
+            continue
+        change = (cur[name] - base[name]) / base[name]
+        # 吞吐量越大越好，延迟越小越好
+        better = change > 0 if not name.endswith('_ms') else change < 0
+        marker = "+" if better else "-"
+        print(f"  {marker} {name}: {base[name]} → {cur[name]} ({change:+.1%})")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库服务离线性能基准测试")
+    parser.add_argument("--pdfs", type=int, default=20, help="合成PDF文件数")
+    parser.add_argument("--docx", type=int, default=5, help="合成DOCX文件数")
+    parser.add_argument("--pages", type=int, default=5, help="每个文件的页数")
+    parser.add_argument("--workers", type=int, default=1, help="解析进程数（0为全部CPU核心）")
+    parser.add_argument("--stub-model", action="store_true", help="使用确定性哈希embedding（无需网络）")
+    parser.add_argument("--embedding-backend", default="fp32", help="真实模型的推理后端（fp32 / int8）")
+    parser.add_argument("--index-backend", default="chroma", help="向量索引后端（chroma / numpy）")
+    parser.add_argument("--concurrency", default="1,4,16", help="搜索并发数列表，逗号分隔")
+    parser.add_argument("--requests", type=int, default=200, help="每个并发级别的请求数")
+    parser.add_argument("--modes", default="vector", help="检索模式列表，逗号分隔（vector,lexical,hybrid）")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--cache", action="store_true", help="启用查询/结果缓存（默认关闭，测量未命中路径）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（语料和索引）")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    parser.add_argument("--compare", help="基线结果JSON，输出对比")
+    args = parser.parse_args()
+
+    # 导入 knowledge_service 时不要在后台初始化真实的向量数据库
+    os.environ['KB_AUTO_INIT'] = '0'
+
+    work_dir = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+    corpus_dir = work_dir / "corpus"
+    results = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        }
+    }
+
+    try:
+        print(f"[1/4] 生成合成语料: {args.pdfs} 个PDF，{args.docx} 个DOCX，每个 {args.pages} 页...")
+        results["corpus"] = generate_corpus(corpus_dir, args.pdfs, args.docx, args.pages, args.seed)
+
+        print("[2/4] 测试文档解析与分块...")
+        documents, results["extraction"] = bench_extraction(
+            corpus_dir, args.workers, results["corpus"]["bytes"]
+        )
+        print(f"  {results['extraction']['chunks_per_second']} 文本块/秒，"
+              f"{results['extraction']['mb_per_second']} MB/秒")
+
+        print("[3/4] 测试向量化入库...")
+        store = create_store(str(work_dir / "db"), args)
+        results["ingest"] = bench_ingest(store, documents)
+        print(f"  {results['ingest']['chunks_per_second']} 文本块/秒")
+
+        print("[4/4] 测试搜索延迟...")
+        rng = random.Random(args.seed)
+        snippets = [doc['content'][:30] for doc in rng.sample(documents, min(100, len(documents)))]
+        queries = BENCH_QUERIES + snippets
+        concurrency_levels = [int(level) for level in args.concurrency.split(',') if level]
+        results["search"] = {
+            mode: bench_search(store, queries, concurrency_levels, args.requests, args.top_k, mode)
+            for mode in args.modes.split(',') if mode
+        }
+    finally:
+        if args.keep:
+            print(f"临时目录已保留: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+文本块去重 - 向量化之前去掉重复和近似重复的文本块
+
+知识库中同一份材料常有多个格式和版本（如同一讲义的 DOC 和 PDF），
+它们的文本块会被重复向量化、重复存储，检索时还会挤占 top-k 结果。
+
+1. 精确重复：规范化空白后的文本 SHA-1 相同
+2. 近似重复：字符 n-gram（shingle）的 MinHash 签名 + LSH 分桶找出候选，
+   签名估计的 Jaccard 相似度达到阈值即视为重复
+
+每组重复只保留最先出现的文本块（规范块），其余丢弃；规范块的元数据在入库结束后补充
+sources（全部不同的来源文件名，以 | 分隔）和 duplicate_count（= 不同来源文件数 − 1，即除规范块自己的文件外
+还有几个文件含有这段内容；同一文件内的重复块不计入）。
+
+去重状态只在一次入库内有效，只用于全量重建；增量同步不去重，
+但会把依赖已修改/删除文件的规范块的文件一并重新索引（见 IndexManifest 的 duplicates_of）。
+"""
+import hashlib
+import re
+import zlib
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+# sources 元数据中文件名的分隔符（ChromaDB 元数据不支持列表）
+SOURCES_SEPARATOR = "|"
+
+DEFAULT_THRESHOLD = 0.85
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_SIZE = 5
+
+# MinHash 使用的哈希族 (a * x + b) mod P，P 为梅森素数 2^61 - 1
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    """合并空白，忽略不同格式提取时产生的换行/空格差异"""
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class ChunkDeduplicator:
+    """一次入库内的文本块去重器（只在单个线程中使用）"""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = NUM_PERM,
+                 bands: int = BANDS, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        """
+        Args:
+            threshold: 近似重复的 Jaccard 相似度阈值，>= 1 时只去除精确重复
+            num_perm: MinHash 签名长度
+            bands: LSH 分段数（num_perm 需能被整除；段数越多召回越高，候选也越多）
+            shingle_size: 字符 n-gram 长度
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) 需能被 bands ({bands}) 整除")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a, b 取 [1, P) 内的随机数；a * x 在 uint64 上按 2^64 回绕，起到充分打乱的作用
+        self._a = rng.randint(1, (1 << 61) - 1, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=(num_perm, 1), dtype=np.uint64)
+
+        self._exact: Dict[str, str] = {}                 # 文本哈希 → 规范块ID
+        self._buckets: Dict[bytes, List[str]] = {}       # LSH 分段 → 规范块ID
+        self._signatures: Dict[str, np.ndarray] = {}     # 规范块ID → MinHash 签名
+        self.canonical_files: Dict[str, str] = {}        # 规范块ID → 文件路径
+        self.canonical_sources: Dict[str, str] = {}      # 规范块ID → 文件名
+        self.duplicate_sources: Dict[str, Set[str]] = {}  # 规范块ID → 重复块的来源文件名
+        self.kept = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.dropped_chars = 0
+
+    def check(self, doc_id: str, doc: Dict) -> Optional[str]:
+        """
+        检查文本块是否重复；不重复时登记为规范块
+
+        Returns:
+            重复时返回规范块ID，否则返回None
+        """
+        text = normalize(doc["content"])
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        canonical = self._exact.get(digest)
+        if canonical is not None:
+            self.exact_duplicates += 1
+            return self._record_duplicate(canonical, doc)
+
+        signature = None
+        if self.threshold < 1:
+            signature = self._signature(text)
+            canonical = self._find_similar(signature)
+            if canonical is not None:
+                self._exact[digest] = canonical
+                self.near_duplicates += 1
+                return self._record_duplicate(canonical, doc)
+
+        self._exact[digest] = doc_id
+        self.canonical_files[doc_id] = doc["metadata"].get("file_path", "")
+        self.canonical_sources[doc_id] = doc["metadata"]["source"]
+        if signature is not None:
+            self._signatures[doc_id] = signature
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, []).append(doc_id)
+        self.kept += 1
+        return None
+
+    def _record_duplicate(self, canonical: str, doc: Dict) -> str:
+        self.dropped_chars += len(doc["content"])
+        source = doc["metadata"]["source"]
+        if source != self.canonical_sources[canonical]:
+            self.duplicate_sources.setdefault(canonical, set()).add(source)
+        return canonical
+
+    # ---- MinHash / LSH ----
+
+    def _signature(self, text: str) -> np.ndarray:
+        k = self.shingle_size
+        shingles = {text[i:i + k] for i in range(max(len(text) - k + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (self._a * hashes[None, :] + self._b) % _MERSENNE_PRIME
+        return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [bytes([band]) + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    def _find_similar(self, signature: np.ndarray) -> Optional[str]:
+        """返回签名相似度最高且达到阈值的规范块"""
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        return best
+
+    # ---- 结果 ----
+
+    @property
+    def dropped(self) -> int:
+        return self.exact_duplicates + self.near_duplicates
+
+    def source_metadata(self, doc_id: str, metadata: Dict) -> Dict:
+        """规范块补充来源后的元数据"""
+        sources = [self.canonical_sources[doc_id]] + sorted(self.duplicate_sources.get(doc_id, ()))
+        updated = dict(metadata)
+        updated["sources"] = SOURCES_SEPARATOR.join(sources)
+        updated["duplicate_count"] = len(sources) - 1  # 不同来源文件数 − 1
+        return updated
+
+    def stats(self) -> Dict:
+        total = self.kept + self.dropped
+        return {
+            "chunks": total,
+            "kept": self.kept,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "dropped_ratio": round(self.dropped / total, 4) if total else 0.0,
+            "dropped_chars": self.dropped_chars
+        }
+
+
+def remove_sources(metadata: Dict, names: Set[str]) -> Optional[Dict]:
+    """
+    从规范块的 sources 中去掉已删除/重新索引的文件（增量同步用）
+
+    Returns:
+        更新后的元数据；sources 中没有这些文件时返回 None
+    """
+    sources = metadata.get("sources")
+    if not sources:
+        return None
+    current = sources.split(SOURCES_SEPARATOR)
+    remaining = [source for source in current if source not in names or source == metadata.get("source")]
+    if len(remaining) == len(current):
+        return None
+    # 只剩规范块自己的文件时也保留字段（ChromaDB 的 update 合并元数据，无法删除键）
+    updated = dict(metadata)
+    updated["sources"] = SOURCES_SEPARATOR.join(remaining)
+    updated["duplicate_count"] = len(remaining) - 1
+    return updated
+
+
+def split_sources(metadata: Dict) -> List[str]:
+    """搜索结果的全部来源文件名（未去重的文本块只有 source）"""
+    sources = metadata.get("sources")
+    return sources.split(SOURCES_SEPARATOR) if sources else [metadata.get("source", "")]
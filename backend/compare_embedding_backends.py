@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Embedding后端对比工具 - 评估int8量化相对fp32的速度收益和召回损失
+
+在自己的语料上：
+1. 分别用 fp32 和 int8 模型编码同一批文本块，统计encode吞吐量（块/秒）
+2. 用一组查询在两种向量空间中做精确top-k检索，统计与fp32结果的重合率（overlap@k）
+   - int8: 索引和查询都用int8（用int8重建索引后的效果）
+   - int8查询+fp32索引: 只在查询端切换后端、不重建索引时的效果
+
+用法:
+    python compare_embedding_backends.py                          # 从 ./chroma_db 取样
+    python compare_embedding_backends.py --source ../知识库目录    # 直接解析文档取样
+    python compare_embedding_backends.py --sample 2000 --top-k 10 --threads 4 --output result.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from embedding_backends import load_embedding_model
+from index_backends import INDEX_BACKENDS
+from vector_store import EMBEDDING_MODEL_NAME
+
+# test_api.py 中的典型查询，外加从语料中抽取的文本片段作为查询
+DEFAULT_QUERIES = [
+    "课程设计", "BOPPPS教学模式", "布卢姆分类学", "教学目标",
+    "如何设计课程大纲", "课程思政", "参与式学习", "ISW教学技能工作坊",
+    "学情分析", "形成性评价"
+]
+
+
+def load_corpus_from_store(persist_directory: str, collection_name: str, sample: int,
+                           index_backend: str = 'chroma') -> list:
+    """从已有向量数据库中读取文本块"""
+    from vector_store import VectorStore
+    store = VectorStore(persist_directory=persist_directory, collection_name=collection_name,
+                        index_backend=index_backend)
+    return [doc['content'] for doc in store.collection.get(limit=sample) if doc['content']]
+
+
+def load_corpus_from_directory(directory: str, sample: int, seed: int) -> list:
+    """直接解析知识库目录中的文档"""
+    from document_processor import DocumentProcessor
+    processor = DocumentProcessor(chunk_size=800, chunk_overlap=150, workers=0)
+    texts = [doc['content'] for doc in processor.process_directory(directory)]
+    random.Random(seed).shuffle(texts)
+    return texts[:sample]
+
+
+def encode(model, texts: list, batch_size: int) -> tuple:
+    """编码并返回 (单位化向量, 耗时秒数)"""
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    elapsed = time.perf_counter() - start
+    embeddings = embeddings.astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+    return embeddings, elapsed
+
+
+def top_k_indices(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """精确余弦相似度top-k（按相似度降序）"""
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def overlap_at_k(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """两组top-k结果的平均重合率"""
+    k = reference.shape[1]
+    overlaps = [len(set(ref) & set(cand)) / k for ref, cand in zip(reference, candidate)]
+    return float(np.mean(overlaps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比fp32与int8 embedding后端的速度和召回")
+    parser.add_argument("--source", help="知识库目录（不指定则从向量数据库取样）")
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--collection", default="teaching_knowledge_base")
+    parser.add_argument("--index-backend", choices=INDEX_BACKENDS, default="chroma",
+                        help="从哪个向量索引后端取样")
+    parser.add_argument("--sample", type=int, default=1000, help="参与评估的文本块数")
+    parser.add_argument("--queries", type=int, default=200, help="从语料中额外抽取的查询数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="PyTorch线程数（0为默认）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    print("加载语料...")
+    if args.source:
+        corpus = load_corpus_from_directory(args.source, args.sample, args.seed)
+    else:
+        corpus = load_corpus_from_store(args.persist_directory, args.collection, args.sample,
+                                        args.index_backend)
+    if not corpus:
+        print("错误: 语料为空，请先构建知识库或通过 --source 指定目录")
+        return 1
+
+    # 查询：典型查询 + 语料片段（取文本块开头的一句话，模拟针对具体内容的检索）
+    rng = random.Random(args.seed)
+    snippets = [text[:40] for text in rng.sample(corpus, min(args.queries, len(corpus)))]
+    queries = DEFAULT_QUERIES + snippets
+    print(f"语料 {len(corpus)} 个文本块，查询 {len(queries)} 条，top_k={args.top_k}")
+
+    threads = args.threads or None
+    results = {
+        "model": EMBEDDING_MODEL_NAME,
+        "corpus_size": len(corpus),
+        "query_count": len(queries),
+        "top_k": args.top_k,
+        "threads": threads or os.cpu_count(),
+        "backends": {}
+    }
+
+    spaces = {}
+    for backend in ('fp32', 'int8'):
+        print(f"\n[{backend}] 加载模型...")
+        start = time.perf_counter()
+        model = load_embedding_model(EMBEDDING_MODEL_NAME, backend=backend, num_threads=threads)
+        load_seconds = time.perf_counter() - start
+
+        encode(model, corpus[:args.batch_size], args.batch_size)  # 预热
+        corpus_embeddings, corpus_seconds = encode(model, corpus, args.batch_size)
+        query_embeddings, query_seconds = encode(model, queries, args.batch_size)
+        spaces[backend] = (corpus_embeddings, query_embeddings)
+
+        results["backends"][backend] = {
+            "load_seconds": round(load_seconds, 2),
+            "corpus_encode_seconds": round(corpus_seconds, 2),
+            "chunks_per_second": round(len(corpus) / corpus_seconds, 1),
+            "queries_per_second": round(len(queries) / query_seconds, 1)
+        }
+        print(f"[{backend}] {results['backends'][backend]['chunks_per_second']} 块/秒")
+        del model
+
+    fp32_corpus, fp32_queries = spaces['fp32']
+    int8_corpus, int8_queries = spaces['int8']
+    reference = top_k_indices(fp32_corpus, fp32_queries, args.top_k)
+
+    results["speedup"] = round(
+        results["backends"]["int8"]["chunks_per_second"] / results["backends"]["fp32"]["chunks_per_second"], 2
+    )
+    results["overlap_at_k"] = {
+        "int8": round(overlap_at_k(reference, top_k_indices(int8_corpus, int8_queries, args.top_k)), 4),
+        "int8_query_fp32_index": round(
+            overlap_at_k(reference, top_k_indices(fp32_corpus, int8_queries, args.top_k)), 4
+        )
+    }
+    results["mean_cosine_fp32_vs_int8"] = round(float(np.mean(np.sum(fp32_corpus * int8_corpus, axis=1))), 4)
+
+    print("\n" + "=" * 60)
+    print(f"int8 相对 fp32 加速: {results['speedup']}x")
+    print(f"overlap@{args.top_k}（int8索引+int8查询）: {results['overlap_at_k']['int8']:.2%}")
+    print(f"overlap@{args.top_k}（fp32索引+int8查询）: {results['overlap_at_k']['int8_query_fp32_index']:.2%}")
+    print(f"同一文本块两种向量的平均余弦相似度: {results['mean_cosine_fp32_vs_int8']}")
+    print("=" * 60)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+响应压缩 - 客户端接受 gzip 时压缩较大的 JSON/文本响应
+
+用法:
+    from compression import enable_compression
+
+    enable_compression(app, min_size=1024, level=5)
+
+小响应压缩后体积收益很小，还要额外花CPU，低于 min_size 字节的响应原样返回；
+流式响应（is_streamed）不读出缓冲，原样返回。
+压缩耗时记录在 stage_duration_seconds{stage="compress"}。
+"""
+import gzip
+
+from flask import request
+
+from metrics import stage_timer
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def _parse_quality(params: str) -> float:
+    """编码项参数中的 q 值（默认1）；格式错误时抛出 ValueError"""
+    for param in params.split(';'):
+        name, _, value = param.strip().partition('=')
+        if name.strip().lower() == 'q':
+            quality = float(value.strip())
+            if not 0 <= quality <= 1:
+                raise ValueError(f"q 超出范围: {value}")
+            return quality
+    return 1.0
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Accept-Encoding 是否接受 gzip
+
+    解析全部编码项：明确列出的 gzip（或 x-gzip）优先于 *，例如 "*;q=0, gzip" 接受 gzip；
+    q 值格式错误的编码项被忽略，不影响其他编码项
+    """
+    gzip_quality = None
+    wildcard_quality = None
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if coding not in ('gzip', 'x-gzip', '*'):
+            continue
+        try:
+            quality = _parse_quality(params)
+        except ValueError:
+            continue
+        if coding == '*':
+            wildcard_quality = quality
+        else:
+            gzip_quality = quality if gzip_quality is None else max(gzip_quality, quality)
+    if gzip_quality is not None:
+        return gzip_quality > 0
+    return wildcard_quality is not None and wildcard_quality > 0
+
+
+def enable_compression(app, min_size: int = 1024, level: int = 5) -> None:
+    """
+    注册 after_request，对可压缩的响应做 gzip 压缩
+
+    Args:
+        min_size: 小于该字节数的响应不压缩
+        level: gzip 压缩级别（1最快，9最小）
+    """
+    @app.after_request
+    def _compress_response(response):
+        # 流式响应（生成器）不能整体读出来压缩，原样返回
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not accepts_gzip(request.headers.get('Accept-Encoding', '')):
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        with stage_timer('compress'):
+            compressed = gzip.compress(data, compresslevel=level, mtime=0)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
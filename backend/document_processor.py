@@ -1,117 +1,466 @@
 """
 文档处理器 - 解析PDF和DOC文件
 """
+import heapq
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
-import PyPDF2
-import pdfplumber
+from typing import List, Dict, Iterator, Optional, Tuple
 from docx import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from metrics import observe_stage
+from page_chunker import PageChunker
+from pdf_extractor import (PAGE_SEPARATOR, PARALLEL_MIN_PAGES, count_pages, extract_pages, iter_pages,
+                           join_pages, page_ranges, split_pages)
+from text_cache import TextCache
+from text_splitter import RecursiveTextSplitter
+
+
+# 支持的文件格式
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.doc']
+
+# 超过该大小的PDF才读取页数、判断是否按页码范围并行提取（避免为每个小文件多打开一次）
+PARALLEL_PDF_MIN_BYTES = 2 * 1024 * 1024
+
+# 提取统计中保留的最慢页数
+SLOWEST_PAGES = 10
+
+
+class EmptyDocumentError(ValueError):
+    """文件中没有提取到任何文本（扫描件、加密或损坏的文件），按处理失败对待以便下次重试"""
+
+    def __init__(self, file_path):
+        super().__init__(f"未提取到文本: {Path(file_path).name}")
 
 
 class DocumentProcessor:
     """处理PDF和DOC文档，提取文本并分块"""
     
-    def __init__(self, chunk_size=1000, chunk_overlap=200):
+    def __init__(self, chunk_size=1000, chunk_overlap=200, workers=1, pdf_engine='auto', text_cache=None,
+                 length_unit='chars'):
+        """
+        Args:
+            chunk_size: 分块大小
+            chunk_overlap: 分块重叠大小
+            workers: 并行解析的进程数，1为单进程顺序处理，<=0 使用全部CPU核心；
+                     大于1时页数多的PDF按页码范围拆分到多个进程
+            pdf_engine: PDF提取引擎，auto（PyPDF2 + 按页回退 pdfplumber）/ pypdf2 / pdfplumber
+            text_cache: TextCache 实例，文件未变化时直接使用缓存的提取文本，None 为不缓存
+            length_unit: 分块长度单位，chars（字符数）/ tokens（tiktoken token 数）
+        """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.workers = workers
+        self.pdf_engine = pdf_engine
+        self.text_cache = text_cache
+        self.length_unit = length_unit
+        self.failed_files: List[Tuple[str, str]] = []
+        self.reset_extraction_stats()
+        self.text_splitter = RecursiveTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", "。", "！", "？", ".", "!", "?", " ", ""]
+            separators=["\n\n", "\n", "。", "！", "？", ".", "!", "?", " ", ""],
+            length_unit=length_unit
         )
+        # PDF逐页流式分块，文本块附带页码范围；缓冲区按字符计，按 token 分块时一个 token 约合多个字符
+        self.page_chunker = PageChunker(self.text_splitter, chunk_size * (4 if length_unit == 'tokens' else 1))
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """从PDF提取文本"""
-        text = ""
-        try:
-            # 优先使用pdfplumber（更准确）
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-        except Exception as e:
-            print(f"pdfplumber失败，尝试PyPDF2: {e}")
-            # 备用PyPDF2
-            try:
-                with open(pdf_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + "\n"
-            except Exception as e2:
-                print(f"PDF解析失败 {pdf_path}: {e2}")
-        
-        return text.strip()
+        text, pages = self._extract_pdf(pdf_path)
+        self.record_pages(pdf_path, pages)
+        return text
+    
+    def _extract_pdf(self, pdf_path: str) -> Tuple[str, List[Dict]]:
+        """逐页提取，返回 (文本, 不含文本的每页记录)；解析异常直接抛出"""
+        pages = extract_pages(pdf_path, engine=self.pdf_engine)
+        return join_pages(pages), _page_timings(pages)
     
     def extract_text_from_docx(self, docx_path: str) -> str:
-        """从DOCX提取文本"""
-        try:
-            doc = Document(docx_path)
-            text = "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
-            return text
-        except Exception as e:
-            print(f"DOCX解析失败 {docx_path}: {e}")
-            return ""
+        """从DOCX提取文本；解析异常直接抛出"""
+        doc = Document(docx_path)
+        return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
     
     def process_document(self, file_path: str) -> List[Dict]:
         """处理单个文档，返回分块后的文本和元数据"""
+        cache_key, text = self._lookup_text(str(file_path))
+        if text is not None:
+            return self._build_cached(file_path, text)
+        documents, pages = self._process_document(file_path, cache_key)
+        self.record_pages(str(file_path), pages)
+        if self.text_cache is not None:
+            self.text_cache.save()
+        return documents
+    
+    def _process_document(self, file_path: str, cache_key: Optional[str] = None
+                          ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        处理单个文档，返回 (文本块列表, PDF每页提取记录)；提供 cache_key 时把提取文本写入缓存
+        
+        解析异常不在这里捕获，由 _process_file_safely 按文件转换为错误信息
+        """
         file_path = Path(file_path)
         file_ext = file_path.suffix.lower()
         
         # 提取文本
         if file_ext == '.pdf':
-            text = self.extract_text_from_pdf(str(file_path))
+            return self._process_pdf(str(file_path), cache_key)
         elif file_ext in ['.docx', '.doc']:
             text = self.extract_text_from_docx(str(file_path))
         else:
-            print(f"不支持的文件格式: {file_ext}")
-            return []
+            raise ValueError(f"不支持的文件格式: {file_ext}")
+        
+        documents = self.build_documents(file_path, text)
+        # 空文本可能是临时性的读取失败，不缓存
+        if not documents:
+            raise EmptyDocumentError(file_path)
+        if cache_key and self.text_cache is not None:
+            self.text_cache.put(cache_key, text)
+        return documents, []
+    
+    def _process_pdf(self, pdf_path: str, cache_key: Optional[str] = None) -> Tuple[List[Dict], List[Dict]]:
+        """逐页提取并流式分块，同时把各页文本（以分页符分隔）流式写入缓存"""
+        timings: List[Dict] = []
+        has_text = False
+        
+        def pages(cache_file=None):
+            nonlocal has_text
+            for record in iter_pages(pdf_path, engine=self.pdf_engine):
+                text = record["text"].replace(PAGE_SEPARATOR, "\n")
+                timings.append(_page_timing(record))
+                if cache_file is not None:
+                    cache_file.write(text if record["page"] == 0 else PAGE_SEPARATOR + text)
+                has_text = has_text or bool(text)
+                yield record["page"], text
         
+        if cache_key and self.text_cache is not None:
+            # 解析异常时 writer 丢弃已写入的部分
+            with self.text_cache.writer(cache_key) as cache_file:
+                documents = self.build_page_documents(pdf_path, pages(cache_file))
+            # 空文本可能是临时性的读取失败，不缓存
+            if not has_text:
+                self.text_cache.discard(cache_key)
+        else:
+            documents = self.build_page_documents(pdf_path, pages())
+        if not documents:
+            raise EmptyDocumentError(pdf_path)
+        return documents, timings
+    
+    def _build_cached(self, file_path, text: str) -> List[Dict]:
+        """对缓存的提取文本分块；PDF文本按分页符拆回各页"""
+        if str(file_path).lower().endswith('.pdf'):
+            return self.build_page_documents(file_path, split_pages(text))
+        return self.build_documents(file_path, text)
+    
+    def build_documents(self, file_path, text: str) -> List[Dict]:
+        """对提取出的文本分块并构建元数据"""
         if not text:
             return []
-        
-        # 分块
         chunks = self.text_splitter.split_text(text)
+        return self._make_documents(file_path, ((chunk, None, None) for chunk in chunks))
+    
+    def build_page_documents(self, file_path, pages) -> List[Dict]:
+        """
+        对逐页产出的文本流式分块并构建元数据
         
-        # 构建元数据
-        documents = []
-        for i, chunk in enumerate(chunks):
-            documents.append({
-                "content": chunk,
-                "metadata": {
-                    "source": file_path.name,
-                    "file_path": str(file_path),
-                    "chunk_id": i,
-                    "total_chunks": len(chunks)
-                }
-            })
+        Args:
+            file_path: 源文件路径
+            pages: 按顺序的 (页码, 页文本)，页码从0开始，可以是生成器
         
+        Returns:
+            文本块列表，元数据中的 page_start/page_end 为从1开始的页码（可直接用于 #page=N 链接）
+        """
+        return self._make_documents(file_path, (
+            (chunk, page_start + 1, page_end + 1)
+            for chunk, page_start, page_end in self.page_chunker.iter_chunks(pages)
+        ))
+    
+    @staticmethod
+    def _make_documents(file_path, chunks) -> List[Dict]:
+        file_path = Path(file_path)
+        documents = []
+        for i, (chunk, page_start, page_end) in enumerate(chunks):
+            metadata = {
+                "source": file_path.name,
+                "file_path": str(file_path),
+                "chunk_id": i
+            }
+            # 没有页码的格式（DOCX）不写入页码字段（ChromaDB 元数据不支持 None）
+            if page_start is not None:
+                metadata["page_start"] = page_start
+                metadata["page_end"] = page_end
+            documents.append({"content": chunk, "metadata": metadata})
+        for document in documents:
+            document["metadata"]["total_chunks"] = len(documents)
         return documents
     
-    def process_directory(self, directory_path: str) -> List[Dict]:
-        """处理整个目录的文档"""
-        all_documents = []
+    @staticmethod
+    def list_files(directory_path: str) -> List[Path]:
+        """递归列出目录下所有支持的文件（按路径排序，保证输出顺序确定）"""
         directory = Path(directory_path)
+        return sorted(
+            file_path for file_path in directory.rglob('*')
+            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+    
+    # ---- 提取文本缓存 ----
+    
+    def _extractor_name(self, file_path: str) -> str:
+        if file_path.lower().endswith('.pdf'):
+            return f"pdf-{self.pdf_engine}"
+        return "docx"
+    
+    def _lookup_text(self, file_path: str) -> Tuple[Optional[str], Optional[str]]:
+        """查询提取文本缓存，返回 (缓存键, 文本)；未启用缓存或无法读取文件时都为None"""
+        if self.text_cache is None or Path(file_path).suffix.lower() not in SUPPORTED_EXTENSIONS:
+            return None, None
+        try:
+            cache_key, text = self.text_cache.lookup(file_path, self._extractor_name(file_path))
+        except OSError:
+            return None, None
+        if text is not None:
+            self.extraction_stats["cache_hits"] += 1
+        return cache_key, text
+    
+    # ---- PDF提取统计 ----
+    
+    def reset_extraction_stats(self) -> None:
+        self.extraction_stats = {
+            "pdf_files": 0,
+            "pages": 0,
+            "engine_pages": {},
+            "engine_seconds": {},
+            "slowest_pages": [],
+            "cache_hits": 0
+        }
+        self._slowest: List[Tuple[float, str, int, str]] = []
+    
+    def record_pages(self, file_path: str, pages: List[Dict]) -> None:
+        """汇总一个PDF的每页提取记录（在主进程中调用），同时记录到运行指标"""
+        if not pages:
+            return
+        stats = self.extraction_stats
+        stats["pdf_files"] += 1
+        stats["pages"] += len(pages)
+        name = Path(file_path).name
+        for record in pages:
+            engine = record["engine"]
+            stats["engine_pages"][engine] = stats["engine_pages"].get(engine, 0) + 1
+            stats["engine_seconds"][engine] = stats["engine_seconds"].get(engine, 0.0) + record["seconds"]
+            observe_stage(f"pdf_page_{engine}", record["seconds"])
+            item = (record["seconds"], name, record["page"], engine)
+            if len(self._slowest) < SLOWEST_PAGES:
+                heapq.heappush(self._slowest, item)
+            elif item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+        stats["slowest_pages"] = [
+            {"file": file_name, "page": page + 1, "engine": engine, "seconds": round(seconds, 3)}
+            for seconds, file_name, page, engine in sorted(self._slowest, reverse=True)
+        ]
+    
+    def format_extraction_stats(self) -> str:
+        stats = self.extraction_stats
+        engines = "，".join(
+            f"{engine} {count} 页/{stats['engine_seconds'][engine]:.1f}s"
+            for engine, count in sorted(stats["engine_pages"].items())
+        )
+        summary = f"PDF提取: {stats['pdf_files']} 个文件，{stats['pages']} 页（{engines}）"
+        if self.text_cache is not None:
+            summary += f"，{stats['cache_hits']} 个文件使用缓存文本"
+        return summary
+    
+    def _page_ranges(self, file_path: str) -> Optional[List[Tuple[int, int]]]:
+        """页数多的PDF返回页码范围列表，否则返回None"""
+        if not file_path.lower().endswith('.pdf'):
+            return None
+        try:
+            if os.path.getsize(file_path) < PARALLEL_PDF_MIN_BYTES:
+                return None
+            page_count = count_pages(file_path)
+        except Exception:
+            # 无法读取页数时按整个文件处理，由工作进程报告错误
+            return None
+        if page_count < PARALLEL_MIN_PAGES:
+            return None
+        return page_ranges(page_count)
+    
+    def _resolve_workers(self, workers: Optional[int]) -> int:
+        workers = self.workers if workers is None else workers
+        if workers is None or workers <= 0:
+            workers = os.cpu_count() or 1
+        return workers
+    
+    def iter_processed_files(self, file_paths: List, workers: Optional[int] = None
+                             ) -> Iterator[Tuple[str, List[Dict], Optional[str]]]:
+        """
+        逐个文件解析并分块，按输入顺序产出 (文件路径, 文本块列表, 错误信息)
         
-        # 支持的文件格式
-        supported_extensions = ['.pdf', '.docx', '.doc']
+        workers > 1 时使用进程池并行解析，页数多的PDF按页码范围拆分为多个任务，
+        提取结果在主进程中合并后分块；单个文件失败只影响该文件，不会中断整批处理。
+        """
+        file_paths = [str(file_path) for file_path in file_paths]
+        try:
+            yield from self._iter_processed_files(file_paths, self._resolve_workers(workers))
+        finally:
+            if self.text_cache is not None:
+                self.text_cache.save()
+    
+    def _iter_processed_files(self, file_paths: List[str], workers: int
+                              ) -> Iterator[Tuple[str, List[Dict], Optional[str]]]:
+        # 只有一个文件且不需要按页拆分时不值得启动进程池
+        if len(file_paths) == 1 and not self._page_ranges(file_paths[0]):
+            workers = 1
         
-        # 递归遍历目录
-        for file_path in directory.rglob('*'):
-            if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
-                print(f"处理文件: {file_path.name}")
-                docs = self.process_document(str(file_path))
-                all_documents.extend(docs)
-                print(f"  -> 生成 {len(docs)} 个文本块")
+        if workers <= 1:
+            for file_path in file_paths:
+                cache_key, text = self._lookup_text(file_path)
+                if text is not None:
+                    yield file_path, self._build_cached(file_path, text), None
+                else:
+                    yield self._record(_process_file_safely(self, file_path, cache_key))
+            return
         
+        # 限制同时在途的任务数，避免解析速度快于下游时结果堆积在内存中
+        max_in_flight = workers * 2
+        cache_directory = str(self.text_cache.directory) if self.text_cache is not None else None
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.chunk_size, self.chunk_overlap, self.pdf_engine, cache_directory, self.length_unit)
+        ) as executor:
+            pending = deque()
+            in_flight = 0
+            for file_path in file_paths:
+                cache_key, text = self._lookup_text(file_path)
+                if text is not None:
+                    # 命中缓存的文件在主进程中直接分块，但仍按输入顺序产出
+                    pending.append((file_path, cache_key, text))
+                else:
+                    ranges = self._page_ranges(file_path)
+                    if ranges and len(ranges) > 1:
+                        futures = [executor.submit(_extract_pages_in_worker, file_path, start, end)
+                                   for start, end in ranges]
+                    else:
+                        futures = [executor.submit(_process_file_in_worker, file_path, cache_key)]
+                    pending.append((file_path, cache_key, futures))
+                    in_flight += len(futures)
+                while pending and (in_flight >= max_in_flight or isinstance(pending[0][2], str)):
+                    if not isinstance(pending[0][2], str):
+                        in_flight -= len(pending[0][2])
+                    yield self._record(self._collect(*pending.popleft()))
+            while pending:
+                yield self._record(self._collect(*pending.popleft()))
+    
+    def _collect(self, file_path: str, cache_key: Optional[str], futures
+                 ) -> Tuple[str, List[Dict], Optional[str], List[Dict]]:
+        if isinstance(futures, str):
+            return file_path, self._build_cached(file_path, futures), None, []
+        if len(futures) == 1:
+            return _collect_result(file_path, futures[0])
+        # 按页码范围并行提取的PDF：合并各范围的页后在主进程中分块
+        try:
+            pages = sorted((record for future in futures for record in future.result()),
+                           key=lambda record: record["page"])
+            texts = [(record["page"], record["text"].replace(PAGE_SEPARATOR, "\n")) for record in pages]
+            documents = self.build_page_documents(file_path, texts)
+            if not documents:
+                raise EmptyDocumentError(file_path)
+            if cache_key and self.text_cache is not None:
+                self.text_cache.put(cache_key, PAGE_SEPARATOR.join(text for _, text in texts))
+            return file_path, documents, None, _page_timings(pages)
+        except Exception as e:
+            return file_path, [], f"{type(e).__name__}: {e}", []
+    
+    def _record(self, result: Tuple[str, List[Dict], Optional[str], List[Dict]]
+                ) -> Tuple[str, List[Dict], Optional[str]]:
+        """记录提取统计，去掉每页记录后产出 (文件路径, 文本块列表, 错误信息)"""
+        file_path, docs, error, pages = result
+        self.record_pages(file_path, pages)
+        return file_path, docs, error
+    
+    def process_files(self, file_paths: List, workers: Optional[int] = None) -> List[Dict]:
+        """处理文件列表，返回所有文本块（顺序与输入文件顺序一致）"""
+        all_documents = []
+        self.failed_files = []
+        self.reset_extraction_stats()
+        
+        for file_path, docs, error in self.iter_processed_files(file_paths, workers):
+            name = Path(file_path).name
+            if error:
+                print(f"处理失败: {name}: {error}")
+                self.failed_files.append((file_path, error))
+                continue
+            print(f"处理文件: {name}")
+            all_documents.extend(docs)
+            print(f"  -> 生成 {len(docs)} 个文本块")
+        
+        if self.failed_files:
+            print(f"共 {len(self.failed_files)} 个文件处理失败")
+        if self.extraction_stats["pages"]:
+            print(self.format_extraction_stats())
         return all_documents
+    
+    def process_directory(self, directory_path: str, workers: Optional[int] = None) -> List[Dict]:
+        """处理整个目录的文档"""
+        return self.process_files(self.list_files(directory_path), workers)
+
+
+# ---- 进程池工作函数（必须定义在模块顶层，才能被子进程导入）----
+
+_worker_processor: Optional[DocumentProcessor] = None
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int, pdf_engine: str = 'auto',
+                 text_cache_directory: Optional[str] = None, length_unit: str = 'chars') -> None:
+    """每个工作进程只创建一次 DocumentProcessor"""
+    global _worker_processor
+    # 工作进程只向缓存写入文本，路径索引由主进程维护
+    text_cache = TextCache(text_cache_directory) if text_cache_directory else None
+    _worker_processor = DocumentProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                          pdf_engine=pdf_engine, text_cache=text_cache,
+                                          length_unit=length_unit)
+
+
+def _process_file_in_worker(file_path: str, cache_key: Optional[str] = None
+                            ) -> Tuple[str, List[Dict], Optional[str], List[Dict]]:
+    return _process_file_safely(_worker_processor, file_path, cache_key)
+
+
+def _extract_pages_in_worker(file_path: str, start: int, end: int) -> List[Dict]:
+    return extract_pages(file_path, start, end, engine=_worker_processor.pdf_engine)
+
+
+def _page_timing(record: Dict) -> Dict:
+    """去掉文本，只保留页码、引擎和耗时（减少进程间传输的数据量）"""
+    return {"page": record["page"], "engine": record["engine"], "seconds": record["seconds"]}
+
+
+def _page_timings(pages: List[Dict]) -> List[Dict]:
+    return [_page_timing(record) for record in pages]
+
+
+def _process_file_safely(processor: DocumentProcessor, file_path: str, cache_key: Optional[str] = None
+                         ) -> Tuple[str, List[Dict], Optional[str], List[Dict]]:
+    """处理单个文件，异常转换为错误信息返回；最后一项为PDF每页提取记录"""
+    try:
+        docs, pages = processor._process_document(file_path, cache_key)
+        return file_path, docs, None, pages
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}", []
+
+
+def _collect_result(file_path: str, future) -> Tuple[str, List[Dict], Optional[str], List[Dict]]:
+    try:
+        return future.result()
+    except Exception as e:
+        # 工作进程崩溃等无法在进程内捕获的错误
+        return file_path, [], f"{type(e).__name__}: {e}", []
 
 
 if __name__ == "__main__":
     # 测试代码
-    processor = DocumentProcessor()
+    processor = DocumentProcessor(workers=0)
     knowledge_base_path = "../知识库（仅按格式分类）"
     
     print("开始处理知识库文档...")
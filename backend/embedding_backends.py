@@ -0,0 +1,41 @@
+"""
+Embedding推理后端 - 在CPU上选择全精度或int8动态量化模型
+
+- fp32: 原始 SentenceTransformer 模型
+- int8: 对 Transformer 的 Linear 层做 PyTorch 动态int8量化，CPU上encode通常快2-3倍，
+        召回率损失可用 compare_embedding_backends.py 在自己的语料上评估
+"""
+from typing import Optional
+
+EMBEDDING_BACKENDS = ('fp32', 'int8')
+
+
+def load_embedding_model(model_name: str, backend: str = 'fp32', num_threads: Optional[int] = None):
+    """
+    加载embedding模型
+
+    Args:
+        model_name: SentenceTransformer 模型名称
+        backend: 'fp32' 或 'int8'
+        num_threads: PyTorch 计算线程数，None 表示使用默认值（通常为物理核心数）
+
+    Returns:
+        具有 encode 方法的模型对象
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"不支持的embedding后端: {backend}，可选: {', '.join(EMBEDDING_BACKENDS)}")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    if backend == 'fp32':
+        return SentenceTransformer(model_name)
+
+    # 动态量化只支持CPU
+    model = SentenceTransformer(model_name, device='cpu')
+    model.eval()
+    torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
@@ -0,0 +1,221 @@
+"""
+磁盘embedding缓存 - 按内容寻址，跨重建复用
+
+键为 hash(模型名 + 推理后端 + 文本块内容)，与文件路径、chunk_id、分块参数无关：
+修改 chunk_size/chunk_overlap 或全量重建时，内容完全相同的文本块直接复用上次的向量，不再调用模型。
+
+存储（位于 chroma_db/embedding_cache/ 下）：
+- vectors.npy: float32 向量矩阵 (容量, 维度)，内存映射
+- keys.npy:    每个槽位的 128 位内容哈希 (容量, 2) uint64，全0表示空槽位，内存映射
+- ticks.npy:   每个槽位最近一次使用的序号，用于容量满时按LRU批量淘汰
+
+容量从较小值开始按需翻倍，最大为 max_entries。
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+INITIAL_CAPACITY = 4096
+
+# 容量满时一次淘汰的比例（批量淘汰，避免每次写入都做一次全表扫描）
+EVICT_FRACTION = 0.1
+
+
+class EmbeddingCache:
+    """内容寻址的磁盘embedding缓存"""
+
+    def __init__(self, directory: str, model_key: str, max_entries: int = 200000):
+        """
+        Args:
+            directory: 缓存目录
+            model_key: 模型标识（模型名 + 推理后端），不同模型的向量互不复用
+            max_entries: 最多缓存的向量数
+        """
+        self.directory = Path(directory)
+        self.model_key = model_key
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._ticks: Optional[np.memmap] = None
+        self._slots: Dict[bytes, int] = {}
+        self._free: List[int] = []
+        self._tick = 0
+        self.dim: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._open()
+
+    # ---- 文件 ----
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / "vectors.npy"
+
+    @property
+    def _keys_path(self) -> Path:
+        return self.directory / "keys.npy"
+
+    @property
+    def _ticks_path(self) -> Path:
+        return self.directory / "ticks.npy"
+
+    def _open(self) -> None:
+        """打开已有缓存文件并重建 哈希 → 槽位 索引"""
+        if not (self._vectors_path.exists() and self._keys_path.exists() and self._ticks_path.exists()):
+            return
+        try:
+            vectors = np.load(self._vectors_path, mmap_mode='r+')
+            keys = np.load(self._keys_path, mmap_mode='r+')
+            ticks = np.load(self._ticks_path, mmap_mode='r+')
+        except (OSError, ValueError) as e:
+            print(f"embedding缓存读取失败，将重新创建: {e}")
+            return
+        if not (len(vectors) == len(keys) == len(ticks)):
+            print("embedding缓存文件不一致，将重新创建")
+            return
+
+        self._vectors, self._keys, self._ticks = vectors, keys, ticks
+        self.dim = vectors.shape[1]
+        occupied = np.flatnonzero(keys.any(axis=1))
+        self._slots = {keys[slot].tobytes(): int(slot) for slot in occupied}
+        self._free = sorted(set(range(len(keys))) - set(occupied.tolist()), reverse=True)
+        self._tick = int(ticks.max()) if len(ticks) else 0
+
+    def _allocate(self, capacity: int, dim: int) -> None:
+        """创建或扩容缓存文件（扩容时复制已有数据到新文件后原子替换）"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        old_capacity = len(self._keys) if self._keys is not None else 0
+
+        arrays = []
+        for path, shape, dtype, old in (
+            (self._vectors_path, (capacity, dim), np.float32, self._vectors),
+            (self._keys_path, (capacity, 2), np.uint64, self._keys),
+            (self._ticks_path, (capacity,), np.int64, self._ticks),
+        ):
+            tmp_path = path.with_name(path.stem + '.tmp.npy')
+            array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+            if old is not None:
+                array[:old_capacity] = old
+            array.flush()
+            del array
+            arrays.append((tmp_path, path))
+        old = None
+
+        # 替换文件前释放旧的内存映射（Windows 下被映射的文件不能被替换）
+        self._vectors = self._keys = self._ticks = None
+        for tmp_path, path in arrays:
+            os.replace(tmp_path, path)
+
+        self._vectors = np.load(self._vectors_path, mmap_mode='r+')
+        self._keys = np.load(self._keys_path, mmap_mode='r+')
+        self._ticks = np.load(self._ticks_path, mmap_mode='r+')
+        self.dim = dim
+        self._free.extend(range(capacity - 1, old_capacity - 1, -1))
+
+    def _reset(self, dim: int) -> None:
+        """维度变化（换了模型）时丢弃全部缓存"""
+        self._vectors = self._keys = self._ticks = None
+        self._slots = {}
+        self._free = []
+        self._tick = 0
+        self._allocate(min(INITIAL_CAPACITY, self.max_entries), dim)
+
+    # ---- 读写 ----
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_key}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        批量查询缓存
+
+        Returns:
+            与texts顺序一致的列表，未命中为None
+        """
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                slot = self._slots.get(key)
+                # 槽位中的哈希与索引不一致说明已被其他进程覆盖，视为未命中
+                if slot is not None and self._keys[slot].tobytes() == key:
+                    self._tick += 1
+                    self._ticks[slot] = self._tick
+                    results.append(np.array(self._vectors[slot]))
+                    self.hits += 1
+                else:
+                    results.append(None)
+                    self.misses += 1
+        return results
+
+    def put_many(self, texts: List[str], embeddings) -> None:
+        """写入新计算的向量"""
+        if self.max_entries <= 0 or not texts:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None or self.dim != embeddings.shape[1]:
+                self._reset(embeddings.shape[1])
+            for text, embedding in zip(texts, embeddings):
+                key = self._key(text)
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._take_slot()
+                    self._slots[key] = slot
+                self._vectors[slot] = embedding
+                # 先写向量再写哈希，其他进程读到哈希时向量已经就绪
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint64)
+                self._tick += 1
+                self._ticks[slot] = self._tick
+
+    def _take_slot(self) -> int:
+        if not self._free:
+            capacity = len(self._keys)
+            if capacity < self.max_entries:
+                self._allocate(min(capacity * 2, self.max_entries), self.dim)
+            else:
+                self._evict(max(1, int(capacity * EVICT_FRACTION)))
+        return self._free.pop()
+
+    def _evict(self, count: int) -> None:
+        """淘汰最久未使用的 count 个槽位"""
+        ticks = np.asarray(self._ticks)
+        victims = np.argpartition(ticks, count - 1)[:count]
+        for slot in victims.tolist():
+            self._slots.pop(self._keys[slot].tobytes(), None)
+            self._keys[slot] = 0
+            self._free.append(slot)
+        self.evictions += count
+
+    def flush(self) -> None:
+        """把内存映射的修改写回磁盘"""
+        with self._lock:
+            for array in (self._vectors, self._keys, self._ticks):
+                if array is not None:
+                    array.flush()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._slots),
+                "capacity": len(self._keys) if self._keys is not None else 0,
+                "max_entries": self.max_entries,
+                "dim": self.dim,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions
+            }
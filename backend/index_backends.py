@@ -0,0 +1,536 @@
+"""
+向量索引后端 - VectorStore 背后可替换的存储与检索实现
+
+- chroma: ChromaDB PersistentClient（默认，原有实现）
+- numpy:  单位化向量存放在内存映射的 .npy 文件中，元数据存放在 gzip 压缩的 JSON 旁路文件中；
+          top-k 由一次矩阵乘法 + argpartition 精确计算，支持批量查询。
+          几万个384维文本块只有几十MB，比HNSW索引更小、更快；
+          多个工作进程以只读方式映射同一个文件，共享操作系统页缓存。
+
+每个后端管理多个具名索引（对应 Chroma 的集合），VectorStore 的影子集合与原子切换对两种后端都适用。
+"""
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+INDEX_BACKENDS = ('chroma', 'numpy')
+
+COLLECTION_METADATA = {"description": "教学知识库"}
+
+
+class VectorIndex:
+    """
+    单个具名索引的接口
+
+    search 返回与查询顺序一致的结果列表，每条结果为
+    {"id", "content", "metadata", "distance"}，distance 越小越相似；
+    get 返回 {"id", "content", "metadata"} 列表。
+    """
+
+    name: str
+
+    def add(self, ids: List[str], embeddings, texts: List[str], metadatas: List[Dict]) -> None:
+        """写入文档块（ID已存在时覆盖）"""
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict]) -> None:
+        """只替换元数据（向量和文本不变），不存在的ID忽略"""
+        raise NotImplementedError
+
+    def search(self, query_embeddings, n_results: int, where: Optional[Dict] = None) -> List[List[Dict]]:
+        raise NotImplementedError
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+            limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """把缓冲的写入持久化（入库完成后调用）"""
+
+
+class IndexBackend:
+    """具名索引的创建、打开、删除和列举"""
+
+    def open(self, name: str) -> VectorIndex:
+        """打开索引，不存在时创建"""
+        raise NotImplementedError
+
+    def create(self, name: str) -> VectorIndex:
+        raise NotImplementedError
+
+    def drop(self, name: str) -> None:
+        raise NotImplementedError
+
+    def list_names(self) -> List[str]:
+        raise NotImplementedError
+
+
+def create_index_backend(backend: str, persist_directory: str) -> IndexBackend:
+    """
+    创建索引后端
+
+    Args:
+        backend: 'chroma' 或 'numpy'
+        persist_directory: 持久化目录
+    """
+    if backend == 'chroma':
+        return ChromaBackend(persist_directory)
+    if backend == 'numpy':
+        return NumpyBackend(persist_directory)
+    raise ValueError(f"不支持的索引后端: {backend}，可选: {', '.join(INDEX_BACKENDS)}")
+
+
+# ---- ChromaDB ----
+
+class ChromaIndex(VectorIndex):
+    """ChromaDB 集合"""
+
+    def __init__(self, client, collection):
+        self._client = client
+        self._collection = collection
+        self.name = collection.name
+
+    def add(self, ids, embeddings, texts, metadatas) -> None:
+        self._collection.upsert(
+            embeddings=embeddings.tolist() if isinstance(embeddings, np.ndarray) else embeddings,
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids
+        )
+
+    def delete(self, ids) -> None:
+        self._collection.delete(ids=ids)
+
+    def update_metadatas(self, ids, metadatas) -> None:
+        if ids:
+            self._collection.update(ids=ids, metadatas=metadatas)
+
+    def search(self, query_embeddings, n_results, where=None) -> List[List[Dict]]:
+        query_kwargs = {
+            "query_embeddings": (query_embeddings.tolist() if isinstance(query_embeddings, np.ndarray)
+                                 else query_embeddings),
+            "n_results": n_results
+        }
+        if where:
+            query_kwargs["where"] = where
+        results = self._collection.query(**query_kwargs)
+
+        rows = []
+        for row in range(len(query_kwargs["query_embeddings"])):
+            documents = []
+            if results['documents'] and results['documents'][row]:
+                for i in range(len(results['documents'][row])):
+                    documents.append({
+                        "id": results['ids'][row][i],
+                        "content": results['documents'][row][i],
+                        "metadata": results['metadatas'][row][i],
+                        "distance": results['distances'][row][i] if results.get('distances') else None
+                    })
+            rows.append(documents)
+        return rows
+
+    def get(self, ids=None, where=None, limit=None, offset=0) -> List[Dict]:
+        get_kwargs = {"include": ['documents', 'metadatas']}
+        if ids is not None:
+            get_kwargs["ids"] = ids
+        if where:
+            get_kwargs["where"] = where
+        if limit is not None:
+            get_kwargs["limit"] = limit
+        if offset:
+            get_kwargs["offset"] = offset
+        results = self._collection.get(**get_kwargs)
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata}
+            for doc_id, content, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+        ]
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def clear(self) -> None:
+        self._client.delete_collection(name=self.name)
+        self._collection = self._client.create_collection(name=self.name, metadata=COLLECTION_METADATA)
+
+
+class ChromaBackend(IndexBackend):
+    """ChromaDB PersistentClient"""
+
+    def __init__(self, persist_directory: str):
+        # chromadb 导入很慢，在创建后端时（即首次使用时）才导入
+        import chromadb
+        self.client = chromadb.PersistentClient(path=persist_directory)
+
+    def open(self, name: str) -> ChromaIndex:
+        return ChromaIndex(self.client, self.client.get_or_create_collection(
+            name=name, metadata=COLLECTION_METADATA
+        ))
+
+    def create(self, name: str) -> ChromaIndex:
+        return ChromaIndex(self.client, self.client.create_collection(
+            name=name, metadata=COLLECTION_METADATA
+        ))
+
+    def drop(self, name: str) -> None:
+        self.client.delete_collection(name=name)
+
+    def list_names(self) -> List[str]:
+        return [collection.name for collection in self.client.list_collections()]
+
+
+# ---- NumPy ----
+
+def _match_where(metadata: Dict, where: Dict) -> bool:
+    """元数据过滤，支持 ChromaDB where 语法的常用子集：等值、$eq/$ne/$in/$nin/$gt/$gte/$lt/$lte、$and/$or"""
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == '$eq' and not value == operand:
+                    return False
+                if op == '$ne' and not value != operand:
+                    return False
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$nin' and value in operand:
+                    return False
+                if op in ('$gt', '$gte', '$lt', '$lte'):
+                    if value is None:
+                        return False
+                    if op == '$gt' and not value > operand:
+                        return False
+                    if op == '$gte' and not value >= operand:
+                        return False
+                    if op == '$lt' and not value < operand:
+                        return False
+                    if op == '$lte' and not value <= operand:
+                        return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class NumpyIndex(VectorIndex):
+    """
+    内存映射的精确检索索引
+
+    目录结构（{persist_directory}/numpy_index/{name}/）：
+    - vectors_<版本>.npy: 单位化的 float32 向量 (行数, 维度)
+    - meta.json.gz: 与向量逐行对应的 ids、documents、metadatas，以及当前向量文件名
+
+    写入在内存中的工作副本上进行，flush 时写入新版本的向量文件，再原子替换元数据文件，
+    已映射旧文件的读者不受影响（Windows 下被映射的文件也无需覆盖）；
+    其他进程在下次查询时发现元数据文件更新后重新映射。
+    """
+
+    # 查询时检查文件是否被其他进程更新的最小间隔（秒）
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, directory: Path, name: str):
+        self.directory = directory
+        self.name = name
+        self._lock = threading.RLock()
+
+        self._vectors: Optional[np.ndarray] = None  # 只读映射，或工作副本 _buffer 的前 n 行
+        self._buffer: Optional[np.ndarray] = None   # 可写工作副本（按需翻倍扩容）
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self._writable = False
+        self._dirty = False
+        self._loaded_version = None
+        self._checked_at = 0.0
+
+        self._load()
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.directory / "meta.json.gz"
+
+    def _file_version(self):
+        try:
+            return self._meta_path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self) -> None:
+        """映射磁盘上的最新版本"""
+        version = self._file_version()
+        if version is None:
+            self._vectors = None
+            self._ids, self._documents, self._metadatas = [], [], []
+        else:
+            with gzip.open(self._meta_path, 'rt', encoding='utf-8') as f:
+                meta = json.load(f)
+            self._ids = meta['ids']
+            self._documents = meta['documents']
+            self._metadatas = meta['metadatas']
+            self._vectors = (np.load(self.directory / meta['vectors_file'], mmap_mode='r')
+                             if self._ids else None)
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._buffer = None
+        self._writable = False
+        self._dirty = False
+        self._loaded_version = version
+        self._checked_at = time.monotonic()
+
+    def _refresh(self) -> None:
+        """其他进程写入新版本后重新映射（本进程有未落盘的写入时不刷新）"""
+        now = time.monotonic()
+        if self._dirty or now - self._checked_at < self.REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+        if self._file_version() != self._loaded_version:
+            self._load()
+
+    def _make_writable(self, dim: int) -> None:
+        """首次写入时把只读映射复制为内存中的工作副本"""
+        if self._writable:
+            return
+        if self._vectors is None:
+            self._buffer = np.zeros((0, dim), dtype=np.float32)
+        else:
+            self._buffer = np.array(self._vectors, dtype=np.float32)
+        self._vectors = self._buffer
+        self._ids = list(self._ids)
+        self._documents = list(self._documents)
+        self._metadatas = list(self._metadatas)
+        self._writable = True
+
+    def add(self, ids, embeddings, texts, metadatas) -> None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or not len(embeddings):
+            return
+        embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+        with self._lock:
+            self._make_writable(embeddings.shape[1])
+            if self._vectors.shape[1] != embeddings.shape[1]:
+                raise ValueError(f"向量维度不一致: 索引为 {self._vectors.shape[1]}，写入为 {embeddings.shape[1]}")
+
+            new_rows = []
+            for i, doc_id in enumerate(ids):
+                position = self._positions.get(doc_id)
+                if position is None:
+                    self._positions[doc_id] = len(self._ids) + len(new_rows)
+                    new_rows.append(i)
+                    continue
+                self._vectors[position] = embeddings[i]
+                self._documents[position] = texts[i]
+                self._metadatas[position] = metadatas[i]
+
+            if new_rows:
+                size = len(self._ids)
+                needed = size + len(new_rows)
+                if needed > len(self._buffer):
+                    # 翻倍扩容，避免逐批拼接导致的平方复杂度
+                    buffer = np.zeros((max(needed, len(self._buffer) * 2, 1024), self._buffer.shape[1]),
+                                      dtype=np.float32)
+                    buffer[:size] = self._buffer[:size]
+                    self._buffer = buffer
+                self._buffer[size:needed] = embeddings[new_rows]
+                self._vectors = self._buffer[:needed]
+                self._ids.extend(ids[i] for i in new_rows)
+                self._documents.extend(texts[i] for i in new_rows)
+                self._metadatas.extend(metadatas[i] for i in new_rows)
+            self._dirty = True
+
+    def delete(self, ids) -> None:
+        with self._lock:
+            positions = sorted({self._positions[doc_id] for doc_id in ids if doc_id in self._positions})
+            if not positions:
+                return
+            self._make_writable(self._vectors.shape[1] if self._vectors is not None else 0)
+            keep = np.ones(len(self._ids), dtype=bool)
+            keep[positions] = False
+            self._buffer = self._vectors[keep]
+            self._vectors = self._buffer
+            removed = set(positions)
+            self._ids = [doc_id for i, doc_id in enumerate(self._ids) if i not in removed]
+            self._documents = [doc for i, doc in enumerate(self._documents) if i not in removed]
+            self._metadatas = [meta for i, meta in enumerate(self._metadatas) if i not in removed]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._dirty = True
+
+    def update_metadatas(self, ids, metadatas) -> None:
+        with self._lock:
+            updates = [(self._positions[doc_id], metadata)
+                       for doc_id, metadata in zip(ids, metadatas) if doc_id in self._positions]
+            if not updates:
+                return
+            self._make_writable(self._vectors.shape[1])
+            for position, metadata in updates:
+                self._metadatas[position] = metadata
+            self._dirty = True
+
+    def search(self, query_embeddings, n_results, where=None) -> List[List[Dict]]:
+        # 与 ChromaDB 一致：n_results 必须为正数（为0时 argpartition 的 k - 1 为 -1，会取错结果）
+        if n_results <= 0:
+            raise ValueError(f"n_results 必须是正整数: {n_results}")
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12)
+
+        # 锁内只取快照，矩阵运算在锁外执行，并发查询互不阻塞
+        with self._lock:
+            self._refresh()
+            vectors, ids = self._vectors, self._ids
+            documents, metadatas = self._documents, self._metadatas
+        if vectors is None or not len(vectors):
+            return [[] for _ in range(len(queries))]
+
+        if where:
+            rows = np.array([i for i in range(len(vectors)) if _match_where(metadatas[i], where)],
+                            dtype=np.int64)
+            if not len(rows):
+                return [[] for _ in range(len(queries))]
+            candidates = vectors[rows]
+        else:
+            rows = None
+            candidates = vectors
+
+        # 单位化向量：余弦相似度 = 内积；返回平方欧氏距离 2 - 2cos，越小越相似
+        scores = queries @ candidates.T
+        k = min(n_results, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        results = []
+        for query_top, query_scores in zip(top, top_scores):
+            row_results = []
+            for position, score in zip(query_top.tolist(), query_scores.tolist()):
+                if rows is not None:
+                    position = int(rows[position])
+                row_results.append({
+                    "id": ids[position],
+                    "content": documents[position],
+                    "metadata": metadatas[position],
+                    "distance": max(0.0, 2.0 - 2.0 * score)
+                })
+            results.append(row_results)
+        return results
+
+    def get(self, ids=None, where=None, limit=None, offset=0) -> List[Dict]:
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                positions = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+            else:
+                positions = range(len(self._ids))
+            results = []
+            for position in positions:
+                if where and not _match_where(self._metadatas[position], where):
+                    continue
+                results.append({
+                    "id": self._ids[position],
+                    "content": self._documents[position],
+                    "metadata": self._metadatas[position]
+                })
+            end = offset + limit if limit is not None else None
+            return results[offset:end]
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            dim = self._vectors.shape[1] if self._vectors is not None else 0
+            self._buffer = np.zeros((0, dim), dtype=np.float32)
+            self._vectors = self._buffer
+            self._ids, self._documents, self._metadatas = [], [], []
+            self._positions = {}
+            self._writable = True
+            self._dirty = True
+            self.flush()
+
+    def flush(self) -> None:
+        """写入新版本的向量文件，再原子替换元数据文件（读者以元数据文件为版本标记）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            vectors_file = f"vectors_{time.time_ns()}.npy"
+            np.save(self.directory / vectors_file, np.ascontiguousarray(self._vectors, dtype=np.float32))
+            meta_tmp = self._meta_path.with_name("meta.json.gz.tmp")
+            with gzip.open(meta_tmp, 'wt', encoding='utf-8') as f:
+                json.dump({
+                    "vectors_file": vectors_file,
+                    "ids": self._ids,
+                    "documents": self._documents,
+                    "metadatas": self._metadatas
+                }, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(meta_tmp, self._meta_path)
+            self._dirty = False
+            self._loaded_version = self._file_version()
+
+            # 旧版本向量文件可能仍被其他进程映射，删除失败时留到下次再清理
+            for path in self.directory.glob("vectors_*.npy"):
+                if path.name != vectors_file:
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+
+
+class NumpyBackend(IndexBackend):
+    """内存映射 NumPy 精确检索后端，每个具名索引一个子目录"""
+
+    def __init__(self, persist_directory: str):
+        self.root = Path(persist_directory) / "numpy_index"
+        self._indexes: Dict[str, NumpyIndex] = {}
+        self._lock = threading.Lock()
+
+    def open(self, name: str) -> NumpyIndex:
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = NumpyIndex(self.root / name, name)
+                self._indexes[name] = index
+            return index
+
+    def create(self, name: str) -> NumpyIndex:
+        with self._lock:
+            if name in self._indexes or (self.root / name).exists():
+                raise ValueError(f"索引已存在: {name}")
+            (self.root / name).mkdir(parents=True)
+            index = NumpyIndex(self.root / name, name)
+            self._indexes[name] = index
+            return index
+
+    def drop(self, name: str) -> None:
+        with self._lock:
+            self._indexes.pop(name, None)
+            shutil.rmtree(self.root / name, ignore_errors=True)
+
+    def list_names(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
@@ -0,0 +1,335 @@
+"""
+知识库文件清单 - 支持增量索引
+
+记录每个已索引文件的路径、大小、修改时间、内容哈希和文本块数量。
+增量同步时只重新解析/向量化新增或修改过的文件，并删除已移除文件
+（或变短文件多出的）文本块ID（{source}_{chunk_id}）。
+
+全量重建去重时，文件条目的 duplicates_of 记录该文件被丢弃的重复块所对应规范块的文件；
+这些文件修改或删除后，依赖它们的文件也会一起重新索引，避免内容从索引中消失。
+反过来，带有 duplicates_of 的文件修改或删除后，从那些规范块的 sources 中去掉该文件。
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from chunk_dedup import remove_sources
+from ingest_pipeline import IngestPipeline
+
+# 支持的文件格式（与 DocumentProcessor.process_directory 保持一致）
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.doc']
+
+MANIFEST_VERSION = 1
+
+
+def compute_file_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256哈希"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def chunk_ids(source: str, start: int, end: int) -> List[str]:
+    """生成文本块ID列表，与 VectorStore.add_documents 的ID格式一致"""
+    return [f"{source}_{i}" for i in range(start, end)]
+
+
+class IndexManifest:
+    """知识库文件清单"""
+
+    def __init__(self, manifest_path: str, chunk_size: int = None, chunk_overlap: int = None,
+                 length_unit: str = 'chars'):
+        """
+        Args:
+            manifest_path: 清单文件路径（JSON）
+            chunk_size: 当前分块大小，与清单记录不一致时需要全量重建
+            chunk_overlap: 当前分块重叠大小
+            length_unit: 当前分块长度单位（chars / tokens）
+        """
+        self.manifest_path = Path(manifest_path)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_unit = length_unit
+        self.files: Dict[str, Dict] = {}
+        self.settings: Dict = {}
+        self.loaded = False
+
+    @classmethod
+    def for_vector_store(cls, vector_store, chunk_size: int = None, chunk_overlap: int = None,
+                         length_unit: str = 'chars'):
+        """清单文件与向量数据库放在同一目录，按集合名称区分"""
+        manifest_path = vector_store.state_directory / f"{vector_store.collection_name}_manifest.json"
+        manifest = cls(str(manifest_path), chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                       length_unit=length_unit)
+        manifest.load()
+        return manifest
+
+    def load(self) -> bool:
+        """加载清单，不存在或格式不兼容时返回False"""
+        self.files = {}
+        self.settings = {}
+        self.loaded = False
+        if not self.manifest_path.exists():
+            return False
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"清单文件读取失败，将执行全量重建: {e}")
+            return False
+        if data.get('version') != MANIFEST_VERSION:
+            return False
+        self.files = data.get('files', {})
+        self.settings = data.get('settings', {})
+        self.loaded = True
+        return True
+
+    def save(self) -> None:
+        """原子写入清单文件"""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": MANIFEST_VERSION,
+            "updated_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "settings": {
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "length_unit": self.length_unit
+            },
+            "files": self.files
+        }
+        tmp_path = self.manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_compatible(self) -> bool:
+        """清单存在且分块参数一致时才能增量同步"""
+        return (self.loaded
+                and self.settings.get('chunk_size') == self.chunk_size
+                and self.settings.get('chunk_overlap') == self.chunk_overlap
+                and self.settings.get('length_unit', 'chars') == self.length_unit)
+
+    @staticmethod
+    def list_files(directory: str) -> Dict[str, Path]:
+        """列出目录下所有支持的文件，返回 {相对路径: 绝对路径}"""
+        directory = Path(directory)
+        files = {}
+        for file_path in sorted(directory.rglob('*')):
+            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS:
+                files[file_path.relative_to(directory).as_posix()] = file_path
+        return files
+
+    @staticmethod
+    def describe_file(file_path: Path, file_hash: str = None) -> Dict:
+        """生成文件清单条目（不含chunk_count）"""
+        stat = file_path.stat()
+        return {
+            "source": file_path.name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_hash or compute_file_hash(str(file_path))
+        }
+
+    def diff(self, directory: str) -> Dict[str, List[str]]:
+        """
+        对比目录与清单
+
+        大小和修改时间都未变化的文件直接视为未修改；否则再比较内容哈希，
+        仅修改时间变化（内容相同）的文件只更新清单，不重新索引。
+
+        Returns:
+            {"added": [...], "changed": [...], "removed": [...], "unchanged": [...]}
+            列表元素为相对路径
+        """
+        current = self.list_files(directory)
+        result = {"added": [], "changed": [], "removed": [], "unchanged": []}
+
+        for rel_path, file_path in current.items():
+            entry = self.files.get(rel_path)
+            if entry is None:
+                result["added"].append(rel_path)
+                continue
+
+            stat = file_path.stat()
+            if stat.st_size == entry.get('size') and stat.st_mtime == entry.get('mtime'):
+                result["unchanged"].append(rel_path)
+                continue
+
+            file_hash = compute_file_hash(str(file_path))
+            if file_hash == entry.get('sha256'):
+                # 内容未变，仅刷新元信息
+                entry.update(self.describe_file(file_path, file_hash))
+                result["unchanged"].append(rel_path)
+            else:
+                result["changed"].append(rel_path)
+
+        result["removed"] = sorted(set(self.files) - set(current))
+        return result
+
+    def record(self, rel_path: str, file_path: Path, chunk_count: int) -> None:
+        """记录已索引文件"""
+        entry = self.describe_file(file_path)
+        entry["chunk_count"] = chunk_count
+        self.files[rel_path] = entry
+
+    def remove(self, rel_path: str) -> Optional[Dict]:
+        """移除文件记录"""
+        return self.files.pop(rel_path, None)
+
+    def record_full_build(self, directory: str, file_chunks: Dict[str, int],
+                          duplicates_of: Optional[Dict[str, List[str]]] = None,
+                          failed_files: Optional[List[Tuple[str, str]]] = None) -> None:
+        """
+        全量构建后重新生成清单
+
+        Args:
+            directory: 知识库目录
+            file_chunks: {文件路径: 文本块数}，来自 IngestPipeline.run 的统计
+            duplicates_of: {文件路径: [规范块所在文件路径]}，来自 IngestPipeline.run 的去重统计
+            failed_files: [(文件路径, 错误信息)]，来自 IngestPipeline.run 的统计；
+                          这些文件不写入清单，下次增量同步时作为新增文件重试
+        """
+        self.files = {}
+        current = self.list_files(directory)
+        rel_paths = {str(file_path): rel_path for rel_path, file_path in current.items()}
+        failed = {str(file_path) for file_path, _ in failed_files or ()}
+        for rel_path, file_path in current.items():
+            if str(file_path) in failed:
+                continue
+            self.record(rel_path, file_path, file_chunks.get(str(file_path), 0))
+            canonical_files = (duplicates_of or {}).get(str(file_path))
+            if canonical_files:
+                self.files[rel_path]["duplicates_of"] = sorted(
+                    rel_paths[path] for path in canonical_files if path in rel_paths
+                )
+        self.save()
+
+    def canonical_sources_of(self, rel_paths: List[str]) -> Dict[str, Set[str]]:
+        """
+        给定文件的重复块被合并到了哪些文件的规范块中
+
+        Returns:
+            {规范块所在文件: {要从其 sources 中去掉的文件名}}
+        """
+        result: Dict[str, Set[str]] = {}
+        for rel_path in rel_paths:
+            entry = self.files.get(rel_path)
+            if not entry:
+                continue
+            for canonical_file in entry.get("duplicates_of", ()):
+                result.setdefault(canonical_file, set()).add(entry["source"])
+        return result
+
+    def dependents(self, rel_paths: List[str]) -> List[str]:
+        """重复块依赖于给定文件（规范块在其中）的其他文件"""
+        targets = set(rel_paths)
+        return sorted(rel_path for rel_path, entry in self.files.items()
+                      if rel_path not in targets and targets.intersection(entry.get("duplicates_of", ())))
+
+
+def sync_knowledge_base(vector_store, processor, directory: str, manifest: IndexManifest,
+                        progress=None) -> Dict:
+    """
+    增量同步知识库
+
+    Args:
+        vector_store: VectorStore 实例
+        processor: DocumentProcessor 实例
+        directory: 知识库目录
+        manifest: 已加载的 IndexManifest（分块参数需与 processor 一致）
+        progress: 进度记录对象（如 RebuildJob），可选
+
+    Returns:
+        同步结果统计
+    """
+    start_time = time.time()
+    diff = manifest.diff(directory)
+    print(f"增量同步: 新增 {len(diff['added'])}，修改 {len(diff['changed'])}，"
+          f"删除 {len(diff['removed'])}，未变化 {len(diff['unchanged'])}")
+
+    # 全量重建去重时丢弃了与这些文件重复的文本块，依赖它们的文件需要重新索引（增量同步不去重）
+    dependents = manifest.dependents(diff['changed'] + diff['removed'])
+    if dependents:
+        print(f"  另有 {len(dependents)} 个文件的重复文本块依赖已修改/删除的文件，一并重新索引")
+        diff['unchanged'] = [rel_path for rel_path in diff['unchanged'] if rel_path not in dependents]
+        diff['changed'] = diff['changed'] + dependents
+
+    # 修改/删除的文件原先合并到其他文件规范块中的来源，同步后从 sources 中去掉
+    # （重新索引的文件不去重，会写入自己的文本块；规范块所在文件本身也重新索引时无需处理）
+    stale_sources = {rel_path: names for rel_path, names
+                     in manifest.canonical_sources_of(diff['changed'] + diff['removed']).items()
+                     if rel_path in diff['unchanged']}
+
+    # 已删除文件：先删除全部文本块（同名文件移动目录时，新文本块会在之后写入）
+    removed_ids = []
+    for rel_path in diff['removed']:
+        entry = manifest.remove(rel_path)
+        removed_ids.extend(chunk_ids(entry['source'], 0, entry.get('chunk_count', 0)))
+    vector_store.delete_documents(removed_ids)
+
+    # 新增/修改文件：流式解析并覆盖写入，文件变短时删除多出的文本块
+    directory_path = Path(directory)
+    rel_paths = {str(directory_path / rel_path): rel_path
+                 for rel_path in diff['added'] + diff['changed']}
+    stale_ids = []
+
+    def on_file_done(file_path: str, chunk_count: int, error: Optional[str]) -> None:
+        if error:
+            # 失败的文件保留旧记录，下次同步时重试
+            return
+        rel_path = rel_paths[file_path]
+        old_entry = manifest.files.get(rel_path)
+        if old_entry:
+            stale_ids.extend(chunk_ids(old_entry['source'], chunk_count, old_entry.get('chunk_count', 0)))
+        manifest.record(rel_path, Path(file_path), chunk_count)
+
+    if progress:
+        progress.set_total_files(len(rel_paths))
+    pipeline = IngestPipeline(vector_store, on_file_done=on_file_done, progress=progress)
+    pipeline_stats = pipeline.run(processor.iter_processed_files(list(rel_paths)))
+
+    vector_store.delete_documents(stale_ids)
+    sources_updated = _remove_stale_sources(vector_store, manifest, stale_sources)
+    manifest.save()
+    # 其他进程（serve.py 的工作进程）轮询到版本变化后重新打开集合、清空结果缓存
+    vector_store.bump_data_version()
+
+    return {
+        "added": len(diff['added']),
+        "changed": len(diff['changed']),
+        "removed": len(diff['removed']),
+        "failed": len(pipeline_stats['failed_files']),
+        "unchanged": len(diff['unchanged']),
+        "sources_updated": sources_updated,
+        "chunks_added": pipeline_stats['chunks'],
+        "chunks_deleted": len(removed_ids) + len(stale_ids),
+        "elapsed_seconds": round(time.time() - start_time, 2)
+    }
+
+
+def _remove_stale_sources(vector_store, manifest: IndexManifest, stale_sources: Dict[str, Set[str]],
+                          batch_size: int = 500) -> int:
+    """从规范块的 sources 元数据中去掉已修改/删除的文件，返回更新的文本块数"""
+    updated = 0
+    for rel_path, names in stale_sources.items():
+        entry = manifest.files.get(rel_path)
+        if not entry:
+            continue
+        ids = chunk_ids(entry['source'], 0, entry.get('chunk_count', 0))
+        for offset in range(0, len(ids), batch_size):
+            documents = vector_store.collection.get(ids=ids[offset:offset + batch_size])
+            changes = [(doc['id'], remove_sources(doc['metadata'], names)) for doc in documents]
+            changes = [(doc_id, metadata) for doc_id, metadata in changes if metadata is not None]
+            if changes:
+                vector_store.update_metadatas([doc_id for doc_id, _ in changes],
+                                              [metadata for _, metadata in changes])
+                updated += len(changes)
+    if updated:
+        vector_store.flush()
+        print(f"  已更新 {updated} 个文本块的来源列表")
+    return updated
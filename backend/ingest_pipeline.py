@@ -0,0 +1,281 @@
+"""
+流式入库流水线 - 解析 → 分块 → 向量化 → 写入
+
+三个阶段通过有界队列连接：
+- 解析线程：驱动 DocumentProcessor.iter_processed_files（可使用进程池），
+  把文本块逐个攒成批次放入队列
+- 向量化（调用线程）：对每个批次调用 VectorStore.embed_texts
+- 写入线程：调用 VectorStore.write_embeddings 写入数据库
+
+提供 ChunkDeduplicator 时，解析线程在攒批之前丢弃重复/近似重复的文本块，
+入库结束后给保留下来的规范块补充全部来源文件名。
+
+解析与向量化可以重叠执行，内存占用只与队列长度和批次大小有关，与知识库规模无关。
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 队列中的消息类型
+_BATCH = 'batch'
+_FILE_DONE = 'file_done'
+_END = 'end'
+
+
+class IngestPipeline:
+    """流式入库流水线"""
+
+    def __init__(self, vector_store, batch_size: int = 32, queue_size: int = 4,
+                 on_file_done: Optional[Callable[[str, int, Optional[str]], None]] = None,
+                 collection=None, progress=None, deduplicator=None):
+        """
+        Args:
+            vector_store: VectorStore 实例
+            batch_size: 每次向量化的文本块数量
+            queue_size: 阶段之间队列的最大批次数
+            on_file_done: 文件的全部文本块写入完成后回调 (文件路径, 文本块数, 错误信息)，
+                          在写入线程中按文件顺序调用
+            collection: 写入的目标集合，默认为当前生效的集合（全量重建时传入影子集合）
+            progress: 进度记录对象（如 RebuildJob），需提供 chunks_written(n) 和 file_done(error)
+            deduplicator: ChunkDeduplicator，None 为不去重（只用于全量重建）
+        """
+        self.vector_store = vector_store
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.on_file_done = on_file_done
+        self.collection = collection
+        self.progress = progress
+        self.deduplicator = deduplicator
+
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def run(self, file_results: Iterable[Tuple[str, List[Dict], Optional[str]]]) -> Dict:
+        """
+        执行流水线
+
+        Args:
+            file_results: (文件路径, 文本块列表, 错误信息) 的迭代器，
+                          通常来自 DocumentProcessor.iter_processed_files
+
+        Returns:
+            统计信息，包含每个文件的文本块数 file_chunks（含被去重丢弃的文本块，与ID范围一致），
+            去重时还包含 dedup 统计和 duplicates_of（文件 → 其重复块所对应规范块的文件列表）
+        """
+        start_time = time.time()
+        self._stop.clear()
+        self._errors = []
+        stats = {
+            "files": 0,
+            "failed_files": [],
+            "chunks": 0,
+            "file_chunks": {},
+            "embed_seconds": 0.0,
+            "write_seconds": 0.0,
+            "duplicates_of": {}
+        }
+
+        parse_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        parser = threading.Thread(
+            target=self._guard, args=(self._parse_stage, file_results, parse_queue, stats),
+            name="ingest-parse", daemon=True
+        )
+        writer = threading.Thread(
+            target=self._guard, args=(self._write_stage, write_queue, stats),
+            name="ingest-write", daemon=True
+        )
+        parser.start()
+        writer.start()
+
+        try:
+            self._embed_stage(parse_queue, write_queue, stats)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._put(write_queue, (_END,), force=True)
+            parser.join()
+            writer.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        if self.deduplicator is not None:
+            self._apply_sources()
+            stats["dedup"] = self._dedup_stats(stats)
+
+        # 词法索引和embedding缓存随写入在内存中更新，流水线结束时统一落盘
+        self.vector_store.flush(self.collection)
+
+        stats["elapsed_seconds"] = round(time.time() - start_time, 2)
+        stats["embed_seconds"] = round(stats["embed_seconds"], 2)
+        stats["write_seconds"] = round(stats["write_seconds"], 2)
+        print(f"流水线完成: {stats['files']} 个文件，{stats['chunks']} 个文本块，"
+              f"耗时 {stats['elapsed_seconds']} 秒")
+        if "dedup" in stats:
+            dedup = stats["dedup"]
+            print(f"去重: 丢弃 {dedup['exact_duplicates']} 个重复、{dedup['near_duplicates']} 个近似重复文本块"
+                  f"（{dedup['dropped_ratio']:.1%}），约节省向量化 {dedup['embed_seconds_saved']} 秒、"
+                  f"索引 {dedup['index_bytes_saved'] / 1024 / 1024:.1f} MB")
+        return stats
+
+    # ---- 各阶段 ----
+
+    def _parse_stage(self, file_results, out_queue: queue.Queue, stats: Dict) -> None:
+        batch: List[Dict] = []
+        try:
+            for file_path, docs, error in file_results:
+                if self._stop.is_set():
+                    break
+                name = Path(file_path).name
+                if error:
+                    print(f"处理失败: {name}: {error}")
+                else:
+                    print(f"处理文件: {name}")
+                    print(f"  -> 生成 {len(docs)} 个文本块")
+                for doc in self._deduplicate(file_path, docs, stats):
+                    batch.append(doc)
+                    if len(batch) >= self.batch_size:
+                        self._put(out_queue, (_BATCH, batch))
+                        batch = []
+                # 文件完成标记跟在它的最后一批之后，保证回调时文本块已全部写入
+                if batch:
+                    self._put(out_queue, (_BATCH, batch))
+                    batch = []
+                self._put(out_queue, (_FILE_DONE, file_path, len(docs), error))
+        finally:
+            # 提前停止时关闭生成器，释放进程池
+            close = getattr(file_results, 'close', None)
+            if close:
+                close()
+            self._put(out_queue, (_END,), force=True)
+
+    def _deduplicate(self, file_path: str, docs: List[Dict], stats: Dict) -> List[Dict]:
+        """丢弃重复文本块，记录本文件依赖的规范块所在文件"""
+        if self.deduplicator is None:
+            return docs
+        kept = []
+        canonical_files = set()
+        for doc in docs:
+            canonical = self.deduplicator.check(self.vector_store.make_id(doc["metadata"]), doc)
+            if canonical is None:
+                kept.append(doc)
+                continue
+            canonical_file = self.deduplicator.canonical_files[canonical]
+            if canonical_file != file_path:
+                canonical_files.add(canonical_file)
+        if canonical_files:
+            stats["duplicates_of"][file_path] = sorted(canonical_files)
+        if len(kept) < len(docs):
+            print(f"  -> 去重后保留 {len(kept)} 个文本块")
+        return kept
+
+    def _apply_sources(self, batch_size: int = 500) -> None:
+        """给有重复来源的规范块补充 sources 元数据"""
+        dedup = self.deduplicator
+        ids = list(dedup.duplicate_sources)
+        collection = self.collection if self.collection is not None else self.vector_store.collection
+        for i in range(0, len(ids), batch_size):
+            documents = collection.get(ids=ids[i:i + batch_size])
+            self.vector_store.update_metadatas(
+                [doc["id"] for doc in documents],
+                [dedup.source_metadata(doc["id"], doc["metadata"]) for doc in documents],
+                collection=self.collection
+            )
+
+    def _dedup_stats(self, stats: Dict) -> Dict:
+        """去重统计，按本次实际的平均耗时和大小估算节省的向量化时间与索引空间"""
+        result = self.deduplicator.stats()
+        dropped = result["exact_duplicates"] + result["near_duplicates"]
+        written = max(stats["chunks"], 1)
+        dimension = stats.get("embedding_dimension", 0)
+        result["embed_seconds_saved"] = round(stats["embed_seconds"] / written * dropped, 2)
+        # 每个文本块: float32 向量 + UTF-8 文本（中文约3字节/字）
+        result["index_bytes_saved"] = dropped * dimension * 4 + result["dropped_chars"] * 3
+        return result
+
+    def _embed_stage(self, in_queue: queue.Queue, out_queue: queue.Queue, stats: Dict) -> None:
+        while True:
+            item = self._get(in_queue)
+            if item is None or item[0] == _END:
+                return
+            if item[0] == _BATCH:
+                batch = item[1]
+                embed_start = time.time()
+                embeddings = self.vector_store.embed_texts([doc["content"] for doc in batch])
+                stats["embed_seconds"] += time.time() - embed_start
+                if len(embeddings) and "embedding_dimension" not in stats:
+                    stats["embedding_dimension"] = len(embeddings[0])
+                item = (_BATCH, batch, embeddings)
+            self._put(out_queue, item)
+
+    def _write_stage(self, in_queue: queue.Queue, stats: Dict) -> None:
+        while True:
+            item = self._get(in_queue)
+            if item is None or item[0] == _END:
+                return
+            if item[0] == _BATCH:
+                _, batch, embeddings = item
+                write_start = time.time()
+                self.vector_store.write_embeddings(
+                    [self.vector_store.make_id(doc["metadata"]) for doc in batch],
+                    embeddings,
+                    [doc["content"] for doc in batch],
+                    [doc["metadata"] for doc in batch],
+                    collection=self.collection
+                )
+                stats["write_seconds"] += time.time() - write_start
+                stats["chunks"] += len(batch)
+                if self.progress:
+                    self.progress.chunks_written(len(batch))
+                print(f"已写入 {stats['chunks']} 个文本块")
+            elif item[0] == _FILE_DONE:
+                _, file_path, chunk_count, error = item
+                if error:
+                    stats["failed_files"].append((file_path, error))
+                else:
+                    stats["files"] += 1
+                    stats["file_chunks"][file_path] = chunk_count
+                if self.on_file_done:
+                    self.on_file_done(file_path, chunk_count, error)
+                if self.progress:
+                    self.progress.file_done(error)
+
+    # ---- 工具方法 ----
+
+    def _guard(self, target, *args) -> None:
+        """线程异常时记录并通知其他阶段停止"""
+        try:
+            target(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, q: queue.Queue, item, force: bool = False) -> None:
+        """放入队列；停止后丢弃普通消息，结束标记则保证送达"""
+        while True:
+            if self._stop.is_set() and not force:
+                return
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if force and self._stop.is_set():
+                    # 下游已停止消费，腾出空间放入结束标记
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _get(self, q: queue.Queue):
+        """从队列取消息；停止后返回None"""
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return None
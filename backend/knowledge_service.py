@@ -10,65 +10,341 @@
 - 获取统计信息
 - 重建索引
 """
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import threading
 from pathlib import Path
-from vector_store import VectorStore
+from vector_store import INDEX_WRITE_LOCK_FILE, SEARCH_MODES, VectorStore
 from document_processor import DocumentProcessor
+from index_manifest import IndexManifest, sync_knowledge_base
+from ingest_pipeline import IngestPipeline
+from search_batcher import SearchBatcher
+from rebuild_job import IndexWriteLock, RebuildInProgress, RebuildManager
+from metrics import REGISTRY, instrument_app, stage_timer
+from text_cache import TextCache
+from chunk_dedup import ChunkDeduplicator
+from compression import enable_compression
+from search_response import (SnippetBuilder, decode_cursor, encode_cursor, format_results,
+                             parse_fields)
+
+# 分块参数（修改后增量同步会自动退化为全量重建）
+PERSIST_DIRECTORY = "./chroma_db"
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+# 分块长度单位：chars（字符数）/ tokens（tiktoken token 数）
+CHUNK_LENGTH_UNIT = os.environ.get('KB_CHUNK_LENGTH_UNIT', 'chars')
+
+# 查询向量/搜索结果缓存（条目数为0时禁用）
+QUERY_CACHE_SIZE = int(os.environ.get('KB_QUERY_CACHE_SIZE', 1024))
+RESULT_CACHE_SIZE = int(os.environ.get('KB_RESULT_CACHE_SIZE', 512))
+RESULT_CACHE_TTL = float(os.environ.get('KB_RESULT_CACHE_TTL', 300))
+
+# 向量索引后端：chroma（默认）/ numpy（内存映射精确检索，多进程共享页缓存）
+INDEX_BACKEND = os.environ.get('KB_INDEX_BACKEND', 'chroma')
+
+# 文本块向量的磁盘缓存条目数（按内容寻址，跨重建复用；0为禁用）
+EMBEDDING_CACHE_SIZE = int(os.environ.get('KB_EMBEDDING_CACHE_SIZE', 200000))
+
+# 并发搜索请求合并（微批处理）：时间窗口为0时关闭
+BATCH_WINDOW_MS = float(os.environ.get('KB_BATCH_WINDOW_MS', 0))
+BATCH_MAX_SIZE = int(os.environ.get('KB_BATCH_MAX_SIZE', 16))
+
+# 默认检索模式：vector（向量）/ lexical（词法倒排索引，精确术语）/ hybrid（两者融合）
+DEFAULT_SEARCH_MODE = os.environ.get('KB_SEARCH_MODE', 'vector')
+
+# 批量搜索单次最多包含的查询数
+MAX_BATCH_QUERIES = int(os.environ.get('KB_MAX_BATCH_QUERIES', 32))
+
+# 并行解析文档的进程数（1为顺序处理，0为使用全部CPU核心）
+PARSE_WORKERS = int(os.environ.get('KB_PARSE_WORKERS', 1))
+
+# PDF提取引擎（auto: PyPDF2 + 按页回退 pdfplumber；pypdf2；pdfplumber）
+PDF_ENGINE = os.environ.get('KB_PDF_ENGINE', 'auto')
+
+# 全量重建时去除重复/近似重复的文本块（0为关闭），近似重复的相似度阈值（>=1 只去除完全相同的文本块）
+DEDUP = os.environ.get('KB_DEDUP', '1') != '0'
+DEDUP_THRESHOLD = float(os.environ.get('KB_DEDUP_THRESHOLD', 0.85))
+
+# 提取文本缓存目录（文件未变化时跳过解析，空字符串为禁用）
+TEXT_CACHE_DIR = os.environ.get('KB_TEXT_CACHE_DIR', './chroma_db/text_cache')
+
+# embedding推理后端（fp32 / int8）和PyTorch线程数（0为默认）
+EMBEDDING_BACKEND = os.environ.get('KB_EMBEDDING_BACKEND', 'fp32')
+EMBEDDING_THREADS = int(os.environ.get('KB_EMBEDDING_THREADS', 0)) or None
+
+# 启动时预热一次encode；作为模块被WSGI服务器导入时是否自动在后台初始化
+WARMUP = os.environ.get('KB_WARMUP', '1') != '0'
+AUTO_INIT = os.environ.get('KB_AUTO_INIT', '1') != '0'
+
+# 慢请求日志阈值（毫秒），超过时打印各阶段耗时；0为关闭
+SLOW_REQUEST_MS = float(os.environ.get('KB_SLOW_REQUEST_MS', 0))
+
+# 客户端接受 gzip 时压缩不小于该字节数的响应；0为关闭压缩
+GZIP_MIN_BYTES = int(os.environ.get('KB_GZIP_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('KB_GZIP_LEVEL', 5))
+
+# 分页时 offset + top_k 的上限；分页请求一次检索这么多条（命中结果缓存后翻页不再检索，各页顺序一致）
+MAX_RESULT_WINDOW = int(os.environ.get('KB_MAX_RESULT_WINDOW', 100))
+
+# 检查集合指针和数据版本的间隔（秒）：重建脚本或其他进程切换集合、增量同步后重新打开，并删除超时的旧集合；0为不检查
+RELOAD_POLL = float(os.environ.get('KB_RELOAD_POLL', 5))
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
+instrument_app(app, slow_request_ms=SLOW_REQUEST_MS)  # 请求统计与 /metrics（需在其他 before_request 之前注册）
+if GZIP_MIN_BYTES > 0:
+    enable_compression(app, min_size=GZIP_MIN_BYTES, level=GZIP_LEVEL)
+# 中文直接输出 UTF-8（\uXXXX 转义的体积是两倍），不排序键，序列化更快
+app.json.ensure_ascii = False
+app.json.sort_keys = False
+
+# 启动状态：not_started → loading → ready / failed
+startup_state = {"stage": "not_started", "error": None, "timings": {}}
 
 # 初始化向量数据库
 vector_store = None
+search_batcher = None
 
-def init_vector_store():
-    """初始化向量数据库"""
-    global vector_store
+def init_vector_store(build_if_empty=True):
+    """初始化向量数据库：加载模型、打开集合并预热，索引为空时（build_if_empty）在后台构建"""
+    global vector_store, search_batcher
     if vector_store is None:
         print("初始化向量数据库...")
-        vector_store = VectorStore(
-            persist_directory="./chroma_db",
-            collection_name="teaching_knowledge_base"
+        startup_state['stage'] = 'loading'
+        store = VectorStore(
+            persist_directory=PERSIST_DIRECTORY,
+            collection_name="teaching_knowledge_base",
+            query_cache_size=QUERY_CACHE_SIZE,
+            result_cache_size=RESULT_CACHE_SIZE,
+            result_cache_ttl=RESULT_CACHE_TTL,
+            embedding_backend=EMBEDDING_BACKEND,
+            num_threads=EMBEDDING_THREADS,
+            embedding_cache_size=EMBEDDING_CACHE_SIZE,
+            index_backend=INDEX_BACKEND
         )
+        vector_store = store
+        
+        if BATCH_WINDOW_MS > 0:
+            search_batcher = SearchBatcher(
+                vector_store, window_ms=BATCH_WINDOW_MS, max_batch_size=BATCH_MAX_SIZE
+            )
+            print(f"已启用搜索请求合并: 窗口 {BATCH_WINDOW_MS}ms，最大批次 {BATCH_MAX_SIZE}")
         
-        # 检查是否需要构建索引
+        startup_state['timings'].update(vector_store.load(warmup=WARMUP))
+        
+        # 检查是否需要构建索引（在后台执行，不阻塞服务启动）
         stats = vector_store.get_collection_stats()
-        if stats['document_count'] == 0:
-            print("知识库为空，开始构建索引...")
-            build_knowledge_base()
+        if stats['document_count'] == 0 and build_if_empty:
+            print("知识库为空，在后台构建索引...")
+            try:
+                rebuild_manager.start()
+            except RebuildInProgress:
+                print("其他进程正在构建索引，完成后自动加载")
+        elif stats['document_count'] == 0:
+            print("知识库为空，请运行 rebuild_knowledge_base.py 或调用 /api/knowledge/rebuild 构建索引")
         else:
             print(f"知识库已就绪，包含 {stats['document_count']} 个文档块")
+        startup_state['stage'] = 'ready'
+
+
+def watch_index(interval):
+    """
+    定期检查集合指针和数据版本：其他进程切换集合或增量同步后重新打开集合、清空结果缓存，
+    并删除切换下来已超时的旧集合
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            if vector_store.reload_collection():
+                print(f"索引已被其他进程更新，已重新打开集合: {vector_store.active_collection_name}")
+            vector_store.drop_retired_collections()
+        except Exception as e:
+            print(f"检查集合更新失败: {e}")
+
+
+def start_index_watcher():
+    if RELOAD_POLL <= 0:
+        return None
+    thread = threading.Thread(target=watch_index, args=(RELOAD_POLL,), name="kb-index-watcher", daemon=True)
+    thread.start()
+    return thread
 
 
-def build_knowledge_base():
-    """构建知识库索引"""
+def start_background_init():
+    """在后台线程中初始化，HTTP端口可以立即开放；就绪状态通过 /ready 查询"""
+    def run():
+        try:
+            init_vector_store()
+        except Exception as e:
+            print(f"向量数据库初始化失败: {e}")
+            startup_state['stage'] = 'failed'
+            startup_state['error'] = str(e)
+            return
+        start_index_watcher()
+    
+    thread = threading.Thread(target=run, name="kb-init", daemon=True)
+    thread.start()
+    return thread
+
+
+def build_knowledge_base(incremental=False, job=None):
+    """
+    构建知识库索引
+    
+    全量构建写入影子集合，完成后原子切换，构建期间搜索继续使用旧索引；
+    增量同步直接在当前集合上覆盖写入。
+    
+    Args:
+        incremental: 为True时根据文件清单只处理新增/修改/删除的文件
+        job: RebuildJob，用于上报进度（可选）
+    
+    Returns:
+        构建结果统计
+    """
     global vector_store
     
+    # 已持有跨进程写入锁；其他进程可能写入过 embedding 缓存，从磁盘重新打开
+    vector_store.reopen_embedding_cache()
+    
     # 知识库路径（在项目根目录中）
     knowledge_base_path = Path(__file__).parent.parent.parent / "知识库（仅按格式分类）"
     
     if not knowledge_base_path.exists():
         print(f"警告: 知识库路径不存在 {knowledge_base_path}")
-        return
+        return None
     
-    # 处理文档
-    processor = DocumentProcessor(chunk_size=800, chunk_overlap=150)
-    documents = processor.process_directory(str(knowledge_base_path))
+    processor = DocumentProcessor(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, workers=PARSE_WORKERS,
+        pdf_engine=PDF_ENGINE, text_cache=TextCache(TEXT_CACHE_DIR) if TEXT_CACHE_DIR else None,
+        length_unit=CHUNK_LENGTH_UNIT
+    )
+    manifest = IndexManifest.for_vector_store(
+        vector_store, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_unit=CHUNK_LENGTH_UNIT
+    )
     
-    if documents:
-        print(f"处理了 {len(documents)} 个文档块，开始向量化...")
-        vector_store.add_documents(documents)
-        print("知识库索引构建完成！")
-    else:
+    if incremental:
+        if manifest.is_compatible():
+            return sync_knowledge_base(vector_store, processor, str(knowledge_base_path), manifest,
+                                       progress=job)
+        print("文件清单不存在或分块参数已变化，执行全量重建...")
+    
+    # 流式处理文档：解析与向量化重叠执行
+    files = processor.list_files(str(knowledge_base_path))
+    if not files:
         print("未找到可处理的文档")
+        return None
+    if job:
+        job.set_total_files(len(files))
+    
+    shadow_name, shadow = vector_store.create_shadow_collection()
+    try:
+        deduplicator = ChunkDeduplicator(threshold=DEDUP_THRESHOLD) if DEDUP else None
+        pipeline_stats = IngestPipeline(vector_store, collection=shadow, progress=job,
+                                        deduplicator=deduplicator).run(
+            processor.iter_processed_files(files)
+        )
+    except Exception:
+        vector_store.drop_shadow_collection(shadow_name)
+        raise
+    
+    vector_store.swap_collection(shadow_name, shadow)
+    manifest.record_full_build(str(knowledge_base_path), pipeline_stats['file_chunks'],
+                               pipeline_stats['duplicates_of'],
+                               pipeline_stats['failed_files'])
+    print(processor.format_extraction_stats())
+    print(f"知识库索引构建完成！共 {pipeline_stats['chunks']} 个文档块")
+    return {
+        "files": pipeline_stats['files'],
+        "failed": len(pipeline_stats['failed_files']),
+        "chunks": pipeline_stats['chunks'],
+        "collection": shadow_name,
+        "elapsed_seconds": pipeline_stats['elapsed_seconds'],
+        "embedding_cache": vector_store.get_cache_stats()['embedding_cache'],
+        "pdf_extraction": processor.extraction_stats,
+        "dedup": pipeline_stats.get('dedup')
+    }
+
+
+# 同一时间只允许一个重建任务（多个工作进程、重建脚本之间通过索引目录下的文件锁互斥）
+rebuild_manager = RebuildManager(
+    lambda job: build_knowledge_base(incremental=job.incremental, job=job),
+    write_lock=IndexWriteLock(os.path.join(PERSIST_DIRECTORY, INDEX_WRITE_LOCK_FILE))
+)
+
+
+@app.before_request
+def require_vector_store():
+    """初始化线程创建 VectorStore 之前，知识库接口返回503"""
+    if vector_store is None and request.path.startswith('/api/knowledge/'):
+        return jsonify({"error": "知识库服务正在启动，请稍后重试"}), 503
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """健康检查"""
-    return jsonify({"status": "ok", "service": "knowledge_service"})
+    """健康检查（存活探针：进程可响应即返回ok）"""
+    return jsonify({
+        "status": "ok",
+        "service": "knowledge_service",
+        "vector_store": startup_state['stage']
+    })
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """就绪探针：模型已加载、集合已打开（并已预热）时返回200，否则返回503"""
+    ready = (startup_state['stage'] == 'ready'
+             and vector_store is not None and vector_store.is_ready)
+    job = rebuild_manager.current()
+    body = {
+        "status": "ready" if ready else startup_state['stage'],
+        "service": "knowledge_service",
+        "startup_timings": startup_state['timings'],
+        "index_building": job is not None and job.is_active
+    }
+    if startup_state['error']:
+        body["error"] = startup_state['error']
+    return jsonify(body), 200 if ready else 503
+
+
+def parse_top_k(value):
+    """
+    校验 top_k：1 到 MAX_RESULT_WINDOW 之间的整数
+    
+    Raises:
+        ValueError: 不是整数或超出范围
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("top_k参数必须是正整数")
+    try:
+        top_k = int(value)
+    except ValueError:
+        raise ValueError("top_k参数必须是正整数")
+    if not 1 <= top_k <= MAX_RESULT_WINDOW:
+        raise ValueError(f"top_k参数必须在 1 到 {MAX_RESULT_WINDOW} 之间")
+    return top_k
+
+
+def parse_response_options(data, query):
+    """
+    解析结果裁剪参数 fields、snippet_chars
+    
+    Returns:
+        (字段元组, SnippetBuilder 或 None)
+    
+    Raises:
+        ValueError: 参数无效
+    """
+    fields = parse_fields(data.get('fields'))
+    snippet_chars = data.get('snippet_chars')
+    if snippet_chars is None:
+        return fields, None
+    if isinstance(snippet_chars, bool) or not isinstance(snippet_chars, int) or snippet_chars <= 0:
+        raise ValueError("snippet_chars参数必须是正整数")
+    return fields, SnippetBuilder(query, snippet_chars)
 
 
 @app.route('/api/knowledge/search', methods=['POST'])
@@ -79,47 +355,154 @@ def search_knowledge():
     请求体:
     {
         "query": "搜索关键词",
-        "top_k": 3  // 可选，默认3
+        "top_k": 3,  // 可选，默认3（分页时为每页条数）
+        "filters": {"source": "xxx.pdf"},  // 可选，元数据过滤条件
+        "mode": "hybrid",  // 可选，vector / lexical / hybrid，默认 vector
+        "fields": ["source", "content", "page_start"],  // 可选，只返回这些字段，默认全部
+        "snippet_chars": 120,  // 可选，content 只返回与查询最匹配的一段（最多这么多字符）
+        "offset": 0,  // 可选，分页起点；传入 offset 或 cursor 时响应包含 next_cursor
+        "cursor": "..."  // 可选，上一页响应中的 next_cursor
     }
     """
     try:
         data = request.json
         query = data.get('query', '')
         top_k = data.get('top_k', 3)
+        filters = data.get('filters') or None
+        mode = data.get('mode') or DEFAULT_SEARCH_MODE
         
         if not query:
             return jsonify({"error": "query参数不能为空"}), 400
+        if mode not in SEARCH_MODES:
+            return jsonify({"error": f"mode参数必须是 {', '.join(SEARCH_MODES)} 之一"}), 400
         
-        # 搜索
-        results = vector_store.search(query, top_k=top_k)
-        
-        # 格式化返回
-        formatted_results = []
-        for result in results:
-            # 距离越小越相似，直接返回距离值（负数表示更相似）
-            # 或者可以转换为相似度分数（可选）
-            distance = result.get('distance', 0)
-            formatted_results.append({
-                "content": result['content'],
-                "source": result['metadata']['source'],
-                "file_path": result['metadata'].get('file_path', ''),
-                "chunk_id": result['metadata'].get('chunk_id', 0),
-                "distance": distance,  # 保留原始距离
-                "similarity": max(0, 1 / (1 + abs(distance))) if distance is not None else 1.0  # 转换为0-1分数
-            })
+        try:
+            fields, snippet = parse_response_options(data, query)
+            paginate = data.get('cursor') is not None or data.get('offset') is not None
+            offset = 0
+            if data.get('cursor') is not None:
+                offset, top_k = decode_cursor(str(data['cursor']), query, mode, filters)
+            elif data.get('offset') is not None:
+                offset = int(data['offset'])
+                if offset < 0:
+                    raise ValueError("offset参数不能为负数")
+            top_k = parse_top_k(top_k)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        if paginate and offset + top_k > MAX_RESULT_WINDOW:
+            return jsonify({"error": f"offset + top_k 不能超过 {MAX_RESULT_WINDOW}"}), 400
         
-        return jsonify({
-            "success": True,
-            "query": query,
-            "results": formatted_results,
-            "count": len(formatted_results)
-        })
+        # 分页时每页都检索整个窗口：结果缓存的键相同，翻页直接命中缓存，
+        # 且近似索引（HNSW）不会因为 top_k 不同而在页之间重复或遗漏结果
+        search_k = MAX_RESULT_WINDOW if paginate else top_k
+        
+        # 搜索（启用合并时与并发请求一起批量执行）
+        queue_wait_ms = None
+        if search_batcher is not None:
+            results, queue_wait_ms = search_batcher.search(query, top_k=search_k, where=filters, mode=mode)
+        else:
+            results = vector_store.search(query, top_k=search_k, where=filters, mode=mode)
+        
+        body = {"success": True, "query": query, "mode": mode}
+        if paginate:
+            has_more = len(results) > offset + top_k
+            results = results[offset:offset + top_k]
+            body["offset"] = offset
+            body["next_cursor"] = encode_cursor(offset + top_k, top_k, query, mode, filters) if has_more else None
+        
+        # 格式化返回（只计算选中的字段）
+        with stage_timer('format'):
+            formatted_results = format_results(results, fields, snippet)
+        
+        with stage_timer('serialize'):
+            body["results"] = formatted_results
+            body["count"] = len(formatted_results)
+            response = jsonify(body)
+        if queue_wait_ms is not None:
+            response.headers['X-Queue-Wait-Ms'] = f"{queue_wait_ms:.3f}"
+        return response
     
     except Exception as e:
         print(f"搜索错误: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/knowledge/search/batch', methods=['POST'])
+def search_knowledge_batch():
+    """
+    批量搜索知识库（一次encode、一次向量查询）
+    
+    请求体:
+    {
+        "queries": [
+            {"query": "课程设计", "top_k": 3},  // top_k 可选，默认3
+            "布卢姆分类学"                      // 也可以直接传字符串
+        ],
+        "filters": {"source": "xxx.pdf"},  // 可选，对所有查询生效
+        "mode": "lexical",  // 可选，vector / lexical / hybrid，对所有查询生效
+        "fields": ["source", "content"],  // 可选，对所有查询生效
+        "snippet_chars": 120  // 可选，对所有查询生效，按各自的查询截取片段
+    }
+    
+    返回的 results 与 queries 顺序一致
+    """
+    try:
+        data = request.json
+        items = data.get('queries') or []
+        filters = data.get('filters') or None
+        mode = data.get('mode') or DEFAULT_SEARCH_MODE
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "queries参数必须是非空列表"}), 400
+        if mode not in SEARCH_MODES:
+            return jsonify({"error": f"mode参数必须是 {', '.join(SEARCH_MODES)} 之一"}), 400
+        if len(items) > MAX_BATCH_QUERIES:
+            return jsonify({"error": f"单次最多 {MAX_BATCH_QUERIES} 个查询"}), 400
+        try:
+            fields, snippet = parse_response_options(data, '')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        queries, top_ks = [], []
+        for index, item in enumerate(items):
+            if isinstance(item, str):
+                item = {"query": item}
+            query = item.get('query', '') if isinstance(item, dict) else ''
+            if not query:
+                return jsonify({"error": f"第 {index} 个查询的query参数不能为空", "index": index}), 400
+            try:
+                top_ks.append(parse_top_k(item.get('top_k', 3)))
+            except ValueError as e:
+                return jsonify({"error": f"第 {index} 个查询: {e}", "index": index}), 400
+            queries.append(query)
+        
+        # 搜索
+        batch_results = vector_store.search_many(queries, top_k=top_ks, where=filters, mode=mode)
+        
+        formatted = []
+        with stage_timer('format'):
+            for query, results in zip(queries, batch_results):
+                query_snippet = SnippetBuilder(query, snippet.max_chars) if snippet is not None else None
+                formatted_results = format_results(results, fields, query_snippet)
+                formatted.append({
+                    "query": query,
+                    "results": formatted_results,
+                    "count": len(formatted_results)
+                })
+        
+        with stage_timer('serialize'):
+            return jsonify({
+                "success": True,
+                "mode": mode,
+                "results": formatted,
+                "count": len(formatted)
+            })
+    
+    except Exception as e:
+        print(f"批量搜索错误: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/knowledge/stats', methods=['GET'])
 def get_stats():
     """获取知识库统计信息"""
@@ -127,7 +510,9 @@ def get_stats():
         stats = vector_store.get_collection_stats()
         return jsonify({
             "success": True,
-            "stats": stats
+            "stats": stats,
+            "cache": vector_store.get_cache_stats(),
+            "batcher": search_batcher.stats() if search_batcher is not None else None
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -135,33 +520,106 @@ def get_stats():
 
 @app.route('/api/knowledge/rebuild', methods=['POST'])
 def rebuild_index():
-    """重建知识库索引"""
+    """
+    后台重建知识库索引，立即返回任务信息（202）
+    
+    请求体（可选）:
+    {
+        "incremental": true  // 只同步变化的文件，默认false（全量重建）
+    }
+    
+    全量重建写入影子集合，完成后原子切换，重建期间搜索不受影响。
+    已有重建任务执行中时返回409。进度通过 GET /api/knowledge/rebuild/status 查询。
+    """
     try:
-        # 清空现有数据
-        vector_store.clear_collection()
-        
-        # 重新构建
-        build_knowledge_base()
+        data = request.get_json(silent=True) or {}
+        incremental = bool(data.get('incremental', False))
         
-        stats = vector_store.get_collection_stats()
+        job = rebuild_manager.start(incremental=incremental)
         return jsonify({
             "success": True,
-            "message": "知识库重建完成",
-            "stats": stats
-        })
+            "message": "知识库增量同步任务已开始" if incremental else "知识库重建任务已开始",
+            "job": job.to_dict()
+        }), 202
+    except RebuildInProgress as e:
+        return jsonify({
+            "error": "已有重建任务正在执行" if e.job else "其他进程正在重建索引",
+            "job": e.job.to_dict() if e.job else None
+        }), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/knowledge/rebuild/status', methods=['GET'])
+def rebuild_status():
+    """查询当前或最近一次重建任务的状态（state、已处理文件数、已向量化文本块数、预计剩余时间）"""
+    job = rebuild_manager.current()
+    if job is None:
+        return jsonify({"success": True, "job": None})
+    
+    response = {"success": True, "job": job.to_dict()}
+    if not job.is_active:
+        response["stats"] = vector_store.get_collection_stats()
+    return jsonify(response)
+
+
+def collect_knowledge_metrics():
+    """/metrics 导出时采集：缓存命中率、索引大小、合并批次、重建任务"""
+    if vector_store is None:
+        return []
+    families = []
+    cache_stats = vector_store.get_cache_stats()
+    caches = {name: stats for name, stats in cache_stats.items() if isinstance(stats, dict)}
+    families.append(("cache_hits_total", "counter", "Cache hits by cache",
+                     [({"cache": name}, stats['hits']) for name, stats in caches.items()]))
+    families.append(("cache_misses_total", "counter", "Cache misses by cache",
+                     [({"cache": name}, stats['misses']) for name, stats in caches.items()]))
+    families.append(("cache_hit_ratio", "gauge", "Cache hit ratio by cache",
+                     [({"cache": name}, stats['hit_rate']) for name, stats in caches.items()]))
+    families.append(("cache_entries", "gauge", "Cache entries by cache",
+                     [({"cache": name}, stats['size']) for name, stats in caches.items()]))
+    families.append(("collection_version", "gauge", "Collection write version",
+                     [({}, cache_stats['collection_version'])]))
+    # 集合尚未打开时不触发加载
+    if vector_store.is_ready:
+        families.append(("index_documents", "gauge", "Chunks in the active collection",
+                         [({"backend": vector_store.index_backend}, vector_store.collection.count())]))
+    if search_batcher is not None:
+        batcher_stats = search_batcher.stats()
+        families.append(("search_batcher_avg_batch_size", "gauge", "Average coalesced batch size",
+                         [({}, batcher_stats['avg_batch_size'])]))
+    job = rebuild_manager.current()
+    families.append(("rebuild_in_progress", "gauge", "Whether an index rebuild is running",
+                     [({}, 1 if job is not None and job.is_active else 0)]))
+    families.append(("service_ready", "gauge", "Whether the model is loaded and the collection is open",
+                     [({}, 1 if startup_state['stage'] == 'ready' else 0)]))
+    return families
+
+
+REGISTRY.register_collector(collect_knowledge_metrics)
+
+startup_state['timings']['service_import'] = round(time.perf_counter() - _import_started, 3)
+
+
 if __name__ == '__main__':
-    # 启动时初始化
-    init_vector_store()
+    # 启动时在后台初始化，端口立即开放
+    start_background_init()
     
     # 启动服务
     print("\n知识库服务启动在 http://localhost:5001")
     print("API端点:")
+    print("  - GET  /health                存活检查")
+    print("  - GET  /ready                 就绪检查（模型加载、预热完成后返回200）")
+    print("  - GET  /metrics               运行指标（Prometheus文本格式）")
     print("  - POST /api/knowledge/search  搜索知识库")
+    print("  - POST /api/knowledge/search/batch 批量搜索知识库")
     print("  - GET  /api/knowledge/stats   获取统计信息")
-    print("  - POST /api/knowledge/rebuild 重建索引")
+    print("  - POST /api/knowledge/rebuild 后台重建索引（{\"incremental\": true} 增量同步）")
+    print("  - GET  /api/knowledge/rebuild/status 重建任务状态")
+    print("（单进程开发服务器；生产环境使用 python serve.py knowledge 启动多进程服务）")
     
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # 调试模式的自动重载会在子进程中再加载一次模型，需要时设置 FLASK_DEBUG=1 开启
+    app.run(host='0.0.0.0', port=5001)
+elif AUTO_INIT:
+    # 被WSGI服务器导入时同样在后台初始化
+    start_background_init()
@@ -0,0 +1,176 @@
+"""
+词法倒排索引 - 精确术语检索（BM25）
+
+中文按字符二元组（bigram）切分，英文/数字按单词切分并转小写，
+例如 "BOPPPS教学模式" → ["boppps", "教学", "学模", "模式"]。
+"BOPPPS"、"布卢姆分类学"、"ISW" 这类精确术语查询不需要模型前向计算即可回答，
+也可与向量检索结果做融合（见 VectorStore.search_many 的 hybrid 模式）。
+
+索引随入库过程增量构建，以 gzip 压缩的 JSON 持久化在 chroma_db 目录下。
+"""
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+INDEX_VERSION = 1
+
+_LATIN_RE = re.compile(r'[a-z0-9]+')
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """中文字符二元组 + 英文/数字单词"""
+    text = text.lower()
+    tokens = _LATIN_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """基于BM25打分的倒排索引"""
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            path: 持久化文件路径（.json.gz），None 表示只在内存中
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+        """
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self.dirty = False
+        self._lock = threading.RLock()
+        # 文档 → 词项，用于删除时只访问相关的倒排表（不持久化，加载时由倒排表重建）
+        self._doc_terms: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """添加或覆盖文档"""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if doc_id in self.doc_lengths:
+                self._remove_locked(doc_id)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self._doc_terms[doc_id] = list(counts)
+            length = sum(counts.values())
+            self.doc_lengths[doc_id] = length
+            self.total_length += length
+            self.dirty = True
+
+    def add_many(self, doc_ids: Iterable[str], texts: Iterable[str]) -> None:
+        for doc_id, text in zip(doc_ids, texts):
+            self.add(doc_id, text)
+
+    def remove(self, doc_ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id in self.doc_lengths:
+                    self._remove_locked(doc_id)
+                    self.dirty = True
+
+    def _remove_locked(self, doc_id: str) -> None:
+        for term in self._doc_terms.pop(doc_id, ()):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self._doc_terms = {}
+            self.total_length = 0
+            self.dirty = True
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        BM25检索
+
+        Returns:
+            [(文档ID, 分数)]，按分数降序
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            doc_count = len(self.doc_lengths)
+            if doc_count == 0:
+                return []
+            avg_length = self.total_length / doc_count
+            scores: Dict[str, float] = {}
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    # ---- 持久化 ----
+
+    def save(self) -> None:
+        """原子写入磁盘（无变化时跳过）"""
+        if self.path is None or not self.dirty:
+            return
+        with self._lock:
+            data = {
+                "version": INDEX_VERSION,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def load(self) -> bool:
+        """从磁盘加载，文件不存在或版本不兼容时返回False"""
+        if self.path is None or not self.path.exists():
+            return False
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"词法索引读取失败 {self.path}: {e}")
+            return False
+        if data.get('version') != INDEX_VERSION:
+            return False
+        with self._lock:
+            self.postings = data['postings']
+            self.doc_lengths = data['doc_lengths']
+            self.total_length = sum(self.doc_lengths.values())
+            self._doc_terms = {}
+            for term, docs in self.postings.items():
+                for doc_id in docs:
+                    self._doc_terms.setdefault(doc_id, []).append(term)
+            self.dirty = False
+        return True
+
+    def delete_file(self) -> None:
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
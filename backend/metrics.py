@@ -0,0 +1,264 @@
+"""
+运行指标 - 分阶段耗时直方图、按路由统计的请求数/错误数，以 Prometheus 文本格式导出
+
+用法:
+    from metrics import REGISTRY, instrument_app, stage_timer
+
+    instrument_app(app, slow_request_ms=500)   # 注册 /metrics，统计每个请求
+    with stage_timer('encode'):                # 热路径中记录单个阶段的耗时
+        ...
+
+每次记录只是一次二分查找加几次整数累加（持有一把很短的锁），开销可以忽略。
+慢请求日志会列出该请求各阶段的耗时，便于判断时间花在了哪里。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """固定分桶直方图"""
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 → [各分桶计数..., 总和, 总数]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for label_values, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            plain = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{plain} {_format_value(float(series[-2]))}")
+            lines.append(f"{self.name}_count{plain} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表；除了直接记录的指标，还可以注册在导出时才计算的采集函数（缓存命中率、索引大小等）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict, float]]]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text, label_names)
+            return self._metrics[name]
+
+    def histogram(self, name: str, help_text: str, label_names: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, label_names, buckets)
+            return self._metrics[name]
+
+    def register_collector(self, collector: Callable) -> None:
+        """
+        注册采集函数，导出时调用
+
+        采集函数返回 [(指标名, 类型 gauge/counter, 说明, [(标签字典, 数值), ...]), ...]
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"指标采集失败: {e}")
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_names = tuple(labels)
+                    label_values = tuple(labels[key] for key in label_names)
+                    lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# 每个进程一个注册表（两个服务是独立进程，由 Prometheus 的 job 标签区分）
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Duration of hot-path stages in seconds", ("stage",)
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+REQUEST_ERRORS_TOTAL = REGISTRY.counter(
+    "http_request_errors_total", "HTTP requests that returned 5xx or raised", ("route",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request duration in seconds by route", ("route",)
+)
+SLOW_REQUESTS_TOTAL = REGISTRY.counter(
+    "http_slow_requests_total", "HTTP requests slower than the slow-request threshold", ("route",)
+)
+
+# 当前线程正在处理的请求的分阶段耗时（用于慢请求日志）
+_local = threading.local()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """记录一个阶段的耗时"""
+    STAGE_SECONDS.observe(seconds, stage)
+    stages = getattr(_local, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录代码块耗时的上下文管理器"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def instrument_app(app, slow_request_ms: float = 0, registry: Optional[MetricsRegistry] = None,
+                   metrics_path: str = '/metrics') -> None:
+    """
+    为 Flask 应用注册请求统计和 /metrics 端点
+
+    Args:
+        app: Flask 应用
+        slow_request_ms: 慢请求阈值（毫秒），超过时打印该请求的分阶段耗时；0 为关闭
+        registry: 指标注册表，默认为全局 REGISTRY
+        metrics_path: 指标端点路径
+    """
+    from flask import Response, request
+
+    registry = registry or REGISTRY
+
+    def route_label() -> str:
+        # 使用路由模板而不是实际路径，避免标签基数无限增长
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def record(status: int) -> None:
+        started = getattr(_local, 'started', None)
+        if started is None:
+            return
+        _local.started = None
+        elapsed = time.perf_counter() - started
+        route = route_label()
+        REQUESTS_TOTAL.inc(route, request.method, str(status))
+        REQUEST_SECONDS.observe(elapsed, route)
+        if status >= 500:
+            REQUEST_ERRORS_TOTAL.inc(route)
+        if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+            SLOW_REQUESTS_TOTAL.inc(route)
+            stages = getattr(_local, 'stages', None) or {}
+            breakdown = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in stages.items())
+            print(f"慢请求: {request.method} {request.path} {status} {elapsed * 1000:.1f}ms"
+                  + (f" [{breakdown}]" if breakdown else ""))
+
+    @app.before_request
+    def _start_request_timer():
+        _local.started = time.perf_counter()
+        _local.stages = {}
+
+    @app.after_request
+    def _record_request(response):
+        if request.path != metrics_path:
+            record(response.status_code)
+        else:
+            _local.started = None
+        return response
+
+    @app.teardown_request
+    def _record_failed_request(exc):
+        # 未被处理的异常不会经过 after_request
+        if exc is not None:
+            record(500)
+        _local.started = None
+        _local.stages = None
+
+    @app.route(metrics_path, methods=['GET'])
+    def metrics_endpoint():
+        return Response(registry.render(), mimetype=None, content_type=CONTENT_TYPE)
@@ -0,0 +1,89 @@
+"""
+按页流式分块 - 逐页读入PDF文本，边读边产出文本块，并记录每个文本块所在的页码范围
+
+整篇文档拼接成一个字符串后再分块，需要同时保留全文、分块中间结果和所有文本块；
+几百页的 ISW 手册会占用数倍于全文的内存，而且文本块丢失了页码。
+
+PageChunker 只保留一个缓冲区：页文本依次追加（页之间以换行连接，与 join_pages 相同），
+缓冲区超过 chunk_size * buffer_chunks 个字符时分块，产出除最后一块以外的文本块，
+最后一块（可能还没填满）连同它与前一块的重叠部分留在缓冲区中与后续页一起继续分块，
+因此跨页的文本块和重叠不受页边界影响。每页在缓冲区中的起始位置用于换算文本块的页码范围。
+"""
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Tuple
+
+# 缓冲区达到 chunk_size 的该倍数时分块一次；越大越接近整篇分块的结果，内存占用也越大
+STREAM_BUFFER_CHUNKS = 8
+
+
+class PageChunker:
+    """逐页流式分块，产出 (文本块, 起始页, 结束页)"""
+
+    def __init__(self, text_splitter, chunk_size: int, buffer_chunks: int = STREAM_BUFFER_CHUNKS):
+        """
+        Args:
+            text_splitter: 提供 split_text(text) -> List[str] 的分块器，文本块需为原文的子串
+            chunk_size: 分块大小（用于确定缓冲区大小）
+            buffer_chunks: 缓冲区大小为 chunk_size 的倍数
+        """
+        self.text_splitter = text_splitter
+        self.buffer_limit = max(chunk_size, 1) * max(buffer_chunks, 2)
+
+    def iter_chunks(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, int]]:
+        """
+        Args:
+            pages: 按页码顺序的 (页码, 页文本)，可以是生成器；页码原样写入结果
+
+        Yields:
+            (文本块, 起始页码, 结束页码)
+        """
+        parts: List[str] = []
+        length = 0
+        page_offsets: List[int] = []
+        page_numbers: List[int] = []
+        for page, text in pages:
+            if not text:
+                continue
+            if parts:
+                parts.append("\n")
+                length += 1
+            page_offsets.append(length)
+            page_numbers.append(page)
+            parts.append(text)
+            length += len(text)
+            if length >= self.buffer_limit:
+                buffer = "".join(parts)
+                carry_offset = yield from self._emit(buffer, page_offsets, page_numbers, final=False)
+                # 缓冲区只保留未产出的尾部，页起始位置随之平移
+                first = max(bisect_right(page_offsets, carry_offset) - 1, 0)
+                page_offsets = [0] + [offset - carry_offset for offset in page_offsets[first + 1:]]
+                page_numbers = page_numbers[first:]
+                parts = [buffer[carry_offset:]]
+                length = len(parts[0])
+        if parts:
+            yield from self._emit("".join(parts), page_offsets, page_numbers, final=True)
+
+    def _emit(self, buffer: str, page_offsets: List[int], page_numbers: List[int], final: bool):
+        """对缓冲区分块并产出；非最后一次时留下最后一块，返回它在缓冲区中的起始位置"""
+        chunks = self.text_splitter.split_text(buffer)
+        carry = None if final or not chunks else chunks.pop()
+        search_from = 0
+        for chunk in chunks:
+            start = buffer.find(chunk, search_from)
+            if start < 0:
+                # 分块器改写了文本（理论上不会发生），退回上一块的位置
+                start = search_from
+            end = start + max(len(chunk), 1) - 1
+            yield (chunk, self._page_at(start, page_offsets, page_numbers),
+                   self._page_at(end, page_offsets, page_numbers))
+            # 下一块可能与本块重叠，但起点一定在本块起点之后
+            search_from = start + 1
+        if carry is None:
+            return len(buffer)
+        # 留下的最后一块包含它与上一块的重叠部分，在后续分块中继续保持重叠
+        start = buffer.find(carry, search_from)
+        return start if start >= 0 else search_from
+
+    @staticmethod
+    def _page_at(offset: int, page_offsets: List[int], page_numbers: List[int]) -> int:
+        return page_numbers[max(bisect_right(page_offsets, offset) - 1, 0)]
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+密码哈希 - 加盐的迭代/内存困难 KDF，在有界线程池中计算
+
+存储格式：
+- pbkdf2_sha256$<迭代次数>$<盐>$<哈希>
+- scrypt$<n>$<r>$<p>$<盐>$<哈希>
+- 旧格式：无盐 SHA-256 十六进制串，登录成功时自动升级为当前配置的格式
+
+hashlib 的 pbkdf2_hmac / scrypt 计算时释放 GIL，放在线程池中不会阻塞其他请求线程。
+线程池的排队长度有上限：队列已满时立即抛出 HasherOverloaded（接口返回 429），
+排队加计算超过超时时间时抛出 HasherTimeout（接口返回 503），避免登录高峰把所有工作线程拖住。
+
+压测不同代价参数下的吞吐量，用于选择能承受峰值登录量的代价：
+    python password_hasher.py bench --algorithm pbkdf2_sha256 --cost 100000,200000,400000 --workers 4
+    python password_hasher.py bench --algorithm scrypt --cost 8192,16384,32768
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, Optional, Tuple
+
+from metrics import observe_stage
+
+ALGORITHMS = ('pbkdf2_sha256', 'scrypt')
+
+DEFAULT_PBKDF2_ITERATIONS = 260000
+DEFAULT_SCRYPT_N = 16384
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+class HasherOverloaded(Exception):
+    """哈希队列已满"""
+
+
+class HasherTimeout(Exception):
+    """排队加计算超时"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _is_legacy(stored: str) -> bool:
+    return '$' not in stored
+
+
+def _derive(password: str, salt: bytes, algorithm: str, params: Tuple[int, ...]) -> bytes:
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, params[0], dklen=HASH_BYTES)
+    n, r, p = params
+    # maxmem 需要覆盖 128 * n * r 字节的工作内存
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def _parse(stored: str) -> Tuple[str, Tuple[int, ...], bytes, bytes]:
+    """解析存储的哈希，返回 (算法, 参数, 盐, 哈希)"""
+    parts = stored.split('$')
+    if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        return parts[0], (int(parts[1]),), _b64decode(parts[2]), _b64decode(parts[3])
+    if parts[0] == 'scrypt' and len(parts) == 6:
+        return parts[0], (int(parts[1]), int(parts[2]), int(parts[3])), _b64decode(parts[4]), _b64decode(parts[5])
+    raise ValueError(f"无法识别的密码哈希格式: {parts[0]}")
+
+
+class PasswordHasher:
+    """可配置 KDF 的密码哈希器，计算在有界线程池中进行"""
+
+    def __init__(self, algorithm: str = 'pbkdf2_sha256', cost: int = None,
+                 max_workers: int = None, max_queue: int = 32, timeout: float = 5.0):
+        """
+        Args:
+            algorithm: pbkdf2_sha256 或 scrypt
+            cost: pbkdf2 的迭代次数 / scrypt 的 n（2 的幂），None 为默认值
+            max_workers: 哈希线程数，None 为 CPU 核心数
+            max_queue: 最多排队等待的哈希任务数（不含正在计算的），超过时拒绝
+            timeout: 单次哈希（排队 + 计算）的最长等待时间（秒）
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"不支持的密码哈希算法: {algorithm}，可选: {', '.join(ALGORITHMS)}")
+        self.algorithm = algorithm
+        self.params: Tuple[int, ...] = self._make_params(cost)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._dummy_hash: Optional[str] = None
+
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _make_params(self, cost: Optional[int]) -> Tuple[int, ...]:
+        if self.algorithm == 'pbkdf2_sha256':
+            return (cost or DEFAULT_PBKDF2_ITERATIONS,)
+        n = cost or DEFAULT_SCRYPT_N
+        if n < 2 or n & (n - 1):
+            raise ValueError(f"scrypt 的 n 必须是大于1的2的幂: {n}")
+        return (n, SCRYPT_R, SCRYPT_P)
+
+    # ---- 线程池 ----
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 线程池不能跨 fork 使用，子进程中重新创建
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='password-hash')
+                    self._pid = os.getpid()
+                    self._inflight = 0
+        return self._executor
+
+    def _run(self, func, *args):
+        """在线程池中执行，队列满时拒绝，超时时放弃等待"""
+        executor = self._get_executor()
+        with self._lock:
+            if self._inflight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HasherOverloaded()
+            self._inflight += 1
+
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            observe_stage('hash_queue_wait', started - submitted)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._inflight -= 1
+                    self.completed += 1
+
+        try:
+            future = executor.submit(task)
+        except RuntimeError:
+            with self._lock:
+                self._inflight -= 1
+            raise
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # 还在排队的任务直接取消；已经开始计算的任务无法中断，完成后结果被丢弃
+            if future.cancel():
+                with self._lock:
+                    self._inflight -= 1
+            with self._lock:
+                self.timeouts += 1
+            raise HasherTimeout()
+
+    # ---- 哈希与校验 ----
+
+    def _encode(self, password: str, params: Tuple[int, ...] = None) -> str:
+        params = params or self.params
+        salt = secrets.token_bytes(SALT_BYTES)
+        digest = _derive(password, salt, self.algorithm, params)
+        encoded_params = '$'.join(str(value) for value in params)
+        return f"{self.algorithm}${encoded_params}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def hash(self, password: str) -> str:
+        """计算密码哈希（当前配置的算法和代价）"""
+        return self._run(self._encode, password)
+
+    def hash_many(self, passwords, cost: int = None) -> list:
+        """
+        批量计算密码哈希（批量导入用），不受排队上限限制
+
+        同一时间最多提交 max_workers 个任务：线程池保持满载，登录/注册的哈希最多排在这几个任务之后，
+        不会被整批导入堵住。
+
+        Args:
+            cost: 覆盖代价参数（只用于必须在首次登录时修改的随机初始密码），None 为当前配置
+        """
+        params = self._make_params(cost) if cost else self.params
+        executor = self._get_executor()
+
+        def task(password):
+            try:
+                return self._encode(password, params)
+            finally:
+                with self._lock:
+                    self._inflight -= 1
+                    self.completed += 1
+
+        results = []
+        pending = deque()
+        for password in passwords:
+            if len(pending) >= self.max_workers:
+                results.append(pending.popleft().result())
+            with self._lock:
+                self._inflight += 1
+            pending.append(executor.submit(task, password))
+        while pending:
+            results.append(pending.popleft().result())
+        return results
+
+    def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+        """
+        校验密码
+
+        Args:
+            password: 明文密码
+            stored: 数据库中的哈希；用户不存在时传 None，仍然计算一次哈希，使响应时间与用户存在时一致
+
+        Returns:
+            (是否匹配, 是否需要用当前配置重新哈希)
+        """
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash(secrets.token_hex(8))
+            self._run(self._check, password, self._dummy_hash)
+            return False, False
+        if _is_legacy(stored):
+            # 旧的无盐 SHA-256，计算很快，直接在请求线程校验
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legacy, stored), True
+        matched = self._run(self._check, password, stored)
+        return matched, matched and self.needs_rehash(stored)
+
+    @staticmethod
+    def _check(password: str, stored: str) -> bool:
+        algorithm, params, salt, expected = _parse(stored)
+        return hmac.compare_digest(_derive(password, salt, algorithm, params), expected)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """存储的哈希是否与当前配置的算法/代价不同"""
+        if _is_legacy(stored):
+            return True
+        try:
+            algorithm, params, _, _ = _parse(stored)
+        except ValueError:
+            return True
+        return algorithm != self.algorithm or params != self.params
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "algorithm": self.algorithm,
+                "params": list(self.params),
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "inflight": self._inflight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts
+            }
+
+
+# ---- 压测 ----
+
+def bench(algorithm: str, costs, workers: int, duration: float) -> list:
+    """在每个代价参数下，用 workers 个线程持续哈希 duration 秒，统计吞吐量与单次耗时"""
+    results = []
+    for cost in costs:
+        hasher = PasswordHasher(algorithm, cost, max_workers=workers, max_queue=workers, timeout=60)
+        single_start = time.perf_counter()
+        hasher._encode('benchmark-password')
+        single_ms = (time.perf_counter() - single_start) * 1000
+
+        count = 0
+        count_lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def worker():
+            nonlocal count
+            local = 0
+            while time.perf_counter() < deadline:
+                hasher.hash('benchmark-password')
+                local += 1
+            with count_lock:
+                count += local
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results.append({
+            "algorithm": algorithm,
+            "cost": cost,
+            "single_hash_ms": round(single_ms, 1),
+            "hashes_per_second": round(count / elapsed, 1)
+        })
+        print(f"  {algorithm} cost={cost}: 单次 {single_ms:.1f}ms，"
+              f"{workers} 线程 {count / elapsed:.1f} 次/秒（即每秒可承受的登录数上限）")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="密码哈希工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="压测不同代价参数下的哈希吞吐量")
+    bench_parser.add_argument("--algorithm", default="pbkdf2_sha256", choices=ALGORITHMS)
+    bench_parser.add_argument("--cost", default=None,
+                              help="代价列表，逗号分隔（pbkdf2 为迭代次数，scrypt 为 n）")
+    bench_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="哈希线程数")
+    bench_parser.add_argument("--duration", type=float, default=3.0, help="每个代价参数的压测时长（秒）")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        if args.cost:
+            costs = [int(value) for value in args.cost.split(',') if value]
+        elif args.algorithm == 'pbkdf2_sha256':
+            costs = [100000, DEFAULT_PBKDF2_ITERATIONS, 600000]
+        else:
+            costs = [8192, DEFAULT_SCRYPT_N, 32768]
+        print(f"CPU 核心数: {os.cpu_count()}，哈希线程数: {args.workers}")
+        bench(args.algorithm, costs, args.workers, args.duration)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+逐页PDF文本提取 - 快速路径 + 按页回退
+
+auto 模式下每页先用 PyPDF2 提取（比 pdfplumber 快数倍），只有输出为空或看起来是乱码的页
+（替换字符、私用区字符、控制字符、Latin-1 乱码比例过高）才用 pdfplumber 重新提取该页，
+两者都有输出时保留质量更好的一份。每页记录使用的引擎和耗时。
+
+大文件可以按页码范围拆分，由 DocumentProcessor 分发到进程池并行提取（见 page_ranges）。
+iter_pages 每提取完一页就产出该页，配合 page_chunker 流式分块，不需要先拼接出整个文档的文本。
+
+对比新旧提取方式在知识库上的耗时和文本一致性：
+    python pdf_extractor.py compare
+    python pdf_extractor.py compare --directory ../知识库（仅按格式分类） --limit 20
+"""
+import argparse
+import itertools
+import sys
+import time
+import unicodedata
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import PyPDF2
+import pdfplumber
+
+PDF_ENGINES = ('auto', 'pypdf2', 'pdfplumber')
+
+# 去掉空白后少于该字符数的页视为提取失败（扫描页、PyPDF2 不支持的字体等），交给 pdfplumber
+MIN_PAGE_CHARS = 20
+
+# 可疑字符占比超过该值视为乱码
+GARBLED_RATIO = 0.05
+
+# 保留页边界的文本（如提取文本缓存）中的分页符；页文本中原有的分页符替换为换行
+PAGE_SEPARATOR = "\f"
+
+# 页数达到该值的PDF才按页码范围拆分并行提取，每个范围的页数
+PARALLEL_MIN_PAGES = 64
+PAGE_RANGE_SIZE = 32
+
+
+def looks_garbled(text: str) -> bool:
+    """文本是否为空或疑似乱码"""
+    content = ''.join(text.split())
+    if len(content) < MIN_PAGE_CHARS:
+        return True
+    suspicious = 0
+    latin1 = 0
+    for char in content:
+        if char == '�':
+            suspicious += 1
+        elif '\x80' <= char <= '\xff':
+            latin1 += 1
+        elif unicodedata.category(char) in ('Co', 'Cc', 'Cs', 'Cn'):
+            suspicious += 1
+    # 中文文档被错误解码时常表现为大量 Latin-1 补充字符（Ã、Â、ä 等）
+    return suspicious / len(content) > GARBLED_RATIO or latin1 / len(content) > 0.3
+
+
+def _quality(text: str) -> int:
+    """用于在两个引擎的结果中择优：可见字符数，乱码时记为0"""
+    return 0 if looks_garbled(text) else len(''.join(text.split()))
+
+
+def count_pages(pdf_path: str) -> int:
+    with open(pdf_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def page_ranges(page_count: int, range_size: int = PAGE_RANGE_SIZE) -> List[Tuple[int, int]]:
+    """把 [0, page_count) 拆分为若干 [start, end) 范围；页数不足 PARALLEL_MIN_PAGES 时不拆分"""
+    if page_count < PARALLEL_MIN_PAGES:
+        return [(0, page_count)]
+    return [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+
+
+def _retry_with_pdfplumber(pdf, record: Dict) -> None:
+    """用 pdfplumber 重新提取一页，质量更好时替换 PyPDF2 的结果"""
+    page_start = time.perf_counter()
+    try:
+        text = pdf.pages[record["page"]].extract_text() or ""
+    except Exception:
+        text = ""
+    record["seconds"] += time.perf_counter() - page_start
+    if record["engine"] == "pdfplumber" or _quality(text) > _quality(record["text"]):
+        record["text"] = text
+        record["engine"] = "pdfplumber"
+
+
+def _iter_pdfplumber_pages(pdf_path: str, start: int, end: Optional[int]) -> Iterator[Dict]:
+    with pdfplumber.open(pdf_path) as pdf:
+        stop = len(pdf.pages) if end is None else min(end, len(pdf.pages))
+        for index in range(start, stop):
+            record = {"page": index, "text": "", "engine": "pdfplumber", "seconds": 0.0}
+            _retry_with_pdfplumber(pdf, record)
+            yield record
+
+
+def iter_pages(pdf_path: str, start: int = 0, end: Optional[int] = None,
+               engine: str = 'auto') -> Iterator[Dict]:
+    """
+    逐页提取 [start, end) 范围内的文本，每提取完一页产出一页（不在内存中保留整个文档）
+
+    Args:
+        pdf_path: PDF路径
+        start, end: 页码范围（从0开始，end 为 None 表示到最后一页）
+        engine: auto（PyPDF2 + 按页回退 pdfplumber）/ pypdf2 / pdfplumber
+
+    Yields:
+        {"page": 页码, "text": 文本, "engine": 实际使用的引擎, "seconds": 耗时}
+    """
+    if engine not in PDF_ENGINES:
+        raise ValueError(f"不支持的PDF提取引擎: {engine}，可选: {', '.join(PDF_ENGINES)}")
+
+    if engine == 'pdfplumber':
+        yield from _iter_pdfplumber_pages(pdf_path, start, end)
+        return
+
+    with ExitStack() as stack:
+        try:
+            reader = PyPDF2.PdfReader(stack.enter_context(open(pdf_path, 'rb')))
+            stop = len(reader.pages) if end is None else min(end, len(reader.pages))
+        except Exception as e:
+            if engine == 'pypdf2':
+                raise
+            # PyPDF2 无法打开整个文件时全部交给 pdfplumber
+            print(f"PyPDF2解析失败，使用pdfplumber: {Path(pdf_path).name}: {e}")
+            reader = None
+        if reader is None:
+            yield from _iter_pdfplumber_pages(pdf_path, start, end)
+            return
+
+        # auto 模式下遇到第一个空页/乱码页时才打开 pdfplumber，之后复用
+        plumber = None
+        for index in range(start, stop):
+            page_start = time.perf_counter()
+            try:
+                text = reader.pages[index].extract_text() or ""
+            except Exception:
+                text = ""
+            record = {"page": index, "text": text, "engine": "pypdf2",
+                      "seconds": time.perf_counter() - page_start}
+            if engine == 'auto' and plumber is not False and looks_garbled(text):
+                if plumber is None:
+                    try:
+                        plumber = stack.enter_context(pdfplumber.open(pdf_path))
+                    except Exception as e:
+                        # 回退失败时保留 PyPDF2 的结果
+                        print(f"pdfplumber回退失败 {Path(pdf_path).name}: {e}")
+                        plumber = False
+                if plumber:
+                    _retry_with_pdfplumber(plumber, record)
+            yield record
+
+
+def extract_pages(pdf_path: str, start: int = 0, end: Optional[int] = None,
+                  engine: str = 'auto') -> List[Dict]:
+    """逐页提取 [start, end) 范围内的文本，返回每页记录列表（见 iter_pages）"""
+    return list(iter_pages(pdf_path, start, end, engine))
+
+
+def split_pages(text: str) -> Iterator[Tuple[int, str]]:
+    """把以 PAGE_SEPARATOR 分隔的整篇文本（含空页）逐页拆回 (页码, 页文本)"""
+    start = 0
+    for page in itertools.count():
+        end = text.find(PAGE_SEPARATOR, start)
+        if end < 0:
+            yield page, text[start:]
+            return
+        yield page, text[start:end]
+        start = end + 1
+
+
+def join_pages(pages: List[Dict]) -> str:
+    """按页码顺序拼接非空页"""
+    return "\n".join(record["text"] for record in sorted(pages, key=lambda r: r["page"])
+                     if record["text"]).strip()
+
+
+def extract_text(pdf_path: str, engine: str = 'auto') -> Tuple[str, List[Dict]]:
+    """提取整个PDF，返回 (文本, 每页记录)"""
+    pages = extract_pages(pdf_path, engine=engine)
+    return join_pages(pages), pages
+
+
+# ---- 新旧提取方式对比 ----
+
+def text_overlap(a: str, b: str) -> float:
+    """两段文本的可见字符多重集重合度（0~1），不受换行/空格差异影响"""
+    counts_a = Counter(''.join(a.split()))
+    counts_b = Counter(''.join(b.split()))
+    total = max(sum(counts_a.values()), sum(counts_b.values()))
+    if total == 0:
+        return 1.0
+    return sum((counts_a & counts_b).values()) / total
+
+
+def compare(directory: Path, limit: int = 0) -> Dict:
+    files = sorted(directory.rglob('*.pdf'))
+    if limit:
+        files = files[:limit]
+    totals = {"files": 0, "pages": 0, "fallback_pages": 0, "pdfplumber_seconds": 0.0, "auto_seconds": 0.0}
+    overlaps = []
+    for pdf_path in files:
+        try:
+            start = time.perf_counter()
+            baseline, _ = extract_text(str(pdf_path), 'pdfplumber')
+            baseline_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            text, pages = extract_text(str(pdf_path), 'auto')
+            auto_seconds = time.perf_counter() - start
+        except Exception as e:
+            print(f"  跳过 {pdf_path.name}: {e}")
+            continue
+        fallback = sum(1 for record in pages if record["engine"] == "pdfplumber")
+        overlap = text_overlap(baseline, text)
+        overlaps.append(overlap)
+        totals["files"] += 1
+        totals["pages"] += len(pages)
+        totals["fallback_pages"] += fallback
+        totals["pdfplumber_seconds"] += baseline_seconds
+        totals["auto_seconds"] += auto_seconds
+        print(f"  {pdf_path.name}: {len(pages)} 页（回退 {fallback}），"
+              f"pdfplumber {baseline_seconds:.2f}s → auto {auto_seconds:.2f}s，文本重合度 {overlap:.1%}")
+
+    if totals["files"]:
+        speedup = totals["pdfplumber_seconds"] / totals["auto_seconds"] if totals["auto_seconds"] else 0
+        print("\n" + "=" * 60)
+        print(f"{totals['files']} 个文件，{totals['pages']} 页，回退 pdfplumber {totals['fallback_pages']} 页")
+        print(f"pdfplumber {totals['pdfplumber_seconds']:.2f}s → auto {totals['auto_seconds']:.2f}s（{speedup:.2f}x）")
+        print(f"文本重合度: 平均 {sum(overlaps) / len(overlaps):.1%}，最低 {min(overlaps):.1%}")
+        print("=" * 60)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="逐页PDF文本提取")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compare_parser = subparsers.add_parser("compare", help="对比 pdfplumber 全量提取与 auto 模式的耗时和文本一致性")
+    compare_parser.add_argument("--directory", default=str(Path(__file__).parent.parent.parent / "知识库（仅按格式分类）"),
+                                help="PDF所在目录（递归）")
+    compare_parser.add_argument("--limit", type=int, default=0, help="最多对比的文件数（0为全部）")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        directory = Path(args.directory)
+        if not directory.exists():
+            print(f"错误: 目录不存在 {directory}")
+            return 1
+        compare(directory, args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+后台重建任务 - 重建在后台线程中执行，HTTP请求立即返回
+
+全量重建写入带版本号的影子集合，完成后原子切换（见 VectorStore.swap_collection），
+重建期间搜索继续使用旧索引，不会出现空结果。
+
+多个进程（serve.py 的工作进程、rebuild_knowledge_base.py）共用同一个索引目录，
+写入索引前先获取 IndexWriteLock（persist_directory 下的文件锁），同一时间只有一个进程重建或同步。
+"""
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class RebuildInProgress(Exception):
+    """已有重建任务在执行（job 为 None 表示其他进程正在重建）"""
+
+    def __init__(self, job: Optional["RebuildJob"] = None):
+        super().__init__(f"重建任务 {job.job_id} 正在执行" if job else "其他进程正在重建索引")
+        self.job = job
+
+
+class IndexWriteLock:
+    """
+    跨进程的索引写入锁（文件锁，进程退出时由操作系统自动释放）
+
+    同一个进程内的多个线程也互斥；不可重入。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """
+        Returns:
+            是否获得了锁（blocking 为 False 时锁被占用立即返回 False）
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            file = open(self.path, 'a+')
+        except OSError:
+            self._thread_lock.release()
+            raise
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            self._thread_lock.release()
+            return False
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        file, self._file = self._file, None
+        if file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            file.close()
+            self._thread_lock.release()
+
+    def __enter__(self) -> "IndexWriteLock":
+        self.acquire(blocking=True)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class RebuildJob:
+    """单次重建任务的状态与进度"""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, incremental: bool = False):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.incremental = incremental
+        self.state = self.PENDING
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.chunks_embedded = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # ---- 进度回调（由 IngestPipeline 在写入线程中调用）----
+
+    def set_total_files(self, total: int) -> None:
+        with self._lock:
+            self.files_total = total
+
+    def chunks_written(self, count: int) -> None:
+        with self._lock:
+            self.chunks_embedded += count
+
+    def file_done(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.files_done += 1
+            if error:
+                self.files_failed += 1
+
+    @property
+    def is_active(self) -> bool:
+        return self.state in (self.PENDING, self.RUNNING)
+
+    def eta_seconds(self) -> Optional[float]:
+        """按已完成文件的平均耗时估算剩余时间"""
+        if self.state != self.RUNNING or not self.files_done or not self.files_total:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = max(self.files_total - self.files_done, 0)
+        return round(elapsed / self.files_done * remaining, 1)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            end_time = self.finished_at or time.time()
+            return {
+                "job_id": self.job_id,
+                "state": self.state,
+                "incremental": self.incremental,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "files_failed": self.files_failed,
+                "chunks_embedded": self.chunks_embedded,
+                "elapsed_seconds": round(end_time - self.started_at, 1) if self.started_at else 0,
+                "eta_seconds": self.eta_seconds() if self.state == self.RUNNING else None,
+                "result": self.result,
+                "error": self.error
+            }
+
+
+class RebuildManager:
+    """保证同一时间只有一个重建任务，并保留最近一次任务的状态"""
+
+    def __init__(self, build_fn: Callable[[RebuildJob], Optional[Dict]],
+                 write_lock: Optional[IndexWriteLock] = None):
+        """
+        Args:
+            build_fn: 执行重建的函数，接收 RebuildJob 用于上报进度，返回结果统计
+            write_lock: 跨进程的索引写入锁，任务执行期间持有
+        """
+        self.build_fn = build_fn
+        self.write_lock = write_lock
+        self._lock = threading.Lock()
+        self._current: Optional[RebuildJob] = None
+
+    def _new_job(self, incremental: bool) -> RebuildJob:
+        with self._lock:
+            if self._current is not None and self._current.is_active:
+                raise RebuildInProgress(self._current)
+            if self.write_lock is not None and not self.write_lock.acquire():
+                raise RebuildInProgress()
+            job = RebuildJob(incremental=incremental)
+            self._current = job
+            return job
+
+    def start(self, incremental: bool = False) -> RebuildJob:
+        """启动后台重建，已有任务执行中（本进程或其他进程）时抛出 RebuildInProgress"""
+        job = self._new_job(incremental)
+
+        thread = threading.Thread(target=self._run, args=(job,), name=f"rebuild-{job.job_id}", daemon=True)
+        thread.start()
+        return job
+
+    def run_sync(self, incremental: bool = False) -> RebuildJob:
+        """在当前线程执行重建（用于启动时构建和命令行）"""
+        job = self._new_job(incremental)
+        self._run(job)
+        return job
+
+    def current(self) -> Optional[RebuildJob]:
+        """当前或最近一次任务"""
+        return self._current
+
+    def _run(self, job: RebuildJob) -> None:
+        job.state = RebuildJob.RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = self.build_fn(job)
+            job.state = RebuildJob.SUCCEEDED
+        except Exception as e:
+            print(f"重建任务失败: {e}")
+            job.error = str(e)
+            job.state = RebuildJob.FAILED
+        finally:
+            job.finished_at = time.time()
+            if self.write_lock is not None:
+                self.write_lock.release()
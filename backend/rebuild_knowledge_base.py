@@ -2,64 +2,189 @@
 """
 重建知识库索引脚本
 包含所有知识库文件和ISW手册
+
+用法:
+    python rebuild_knowledge_base.py                # 全量重建
+    python rebuild_knowledge_base.py --incremental  # 只同步新增/修改/删除的文件
+    python rebuild_knowledge_base.py --workers 8    # 8个进程并行解析文档
+    python rebuild_knowledge_base.py --no-text-cache  # 不使用提取文本缓存，全部重新解析
 """
+import argparse
 import os
 import sys
 from pathlib import Path
-from vector_store import VectorStore
+from vector_store import RETIRED_COLLECTION_TTL, VectorStore
 from document_processor import DocumentProcessor
+from index_manifest import IndexManifest, sync_knowledge_base
+from ingest_pipeline import IngestPipeline
+from embedding_backends import EMBEDDING_BACKENDS
+from index_backends import INDEX_BACKENDS
+from pdf_extractor import PDF_ENGINES
+from text_cache import TextCache
+from text_splitter import LENGTH_UNITS
+from chunk_dedup import ChunkDeduplicator
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+
 
-def rebuild_knowledge_base():
+def rebuild_knowledge_base(incremental=False, workers=1, embedding_backend='fp32', threads=None,
+                           embedding_cache_size=200000, index_backend='chroma', pdf_engine='auto',
+                           text_cache_dir='./chroma_db/text_cache', length_unit='chars',
+                           dedup_threshold=0.85):
     """重建知识库索引"""
     print("=" * 60)
-    print("开始重建知识库索引")
+    print("开始增量同步知识库索引" if incremental else "开始重建知识库索引")
     print("=" * 60)
-    
+
     # 初始化向量数据库
     print("\n[1/4] 初始化向量数据库...")
     vector_store = VectorStore(
         persist_directory="./chroma_db",
-        collection_name="teaching_knowledge_base"
+        collection_name="teaching_knowledge_base",
+        embedding_backend=embedding_backend,
+        num_threads=threads,
+        embedding_cache_size=embedding_cache_size,
+        index_backend=index_backend
     )
-    
-    # 清空现有数据
-    print("[2/4] 清空现有索引...")
-    vector_store.clear_collection()
-    
-    # 处理知识库文件
-    print("[3/4] 处理知识库文件...")
+
+    # 服务的工作进程可能同时在重建/同步，写入同一个索引目录前先获取跨进程写入锁
+    if not vector_store.write_lock.acquire():
+        print("错误: 其他进程正在重建或同步索引，请稍后再试")
+        return False
+    try:
+        return _build(vector_store, incremental, workers, pdf_engine, text_cache_dir, length_unit,
+                      dedup_threshold)
+    finally:
+        vector_store.write_lock.release()
+
+
+def _build(vector_store, incremental, workers, pdf_engine, text_cache_dir, length_unit, dedup_threshold):
+    """持有写入锁时执行增量同步或全量重建"""
     # 知识库文件夹在项目根目录中，而不是在public文件夹中
     knowledge_base_path = Path(__file__).parent.parent.parent / "知识库（仅按格式分类）"
-    
+
     if not knowledge_base_path.exists():
         print(f"错误: 知识库路径不存在 {knowledge_base_path}")
         return False
-    
-    processor = DocumentProcessor(chunk_size=800, chunk_overlap=150)
-    documents = processor.process_directory(str(knowledge_base_path))
-    
-    if documents:
-        print(f"处理了 {len(documents)} 个文档块")
-        print("[4/4] 向量化并保存到数据库...")
-        vector_store.add_documents(documents)
+
+    processor = DocumentProcessor(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, workers=workers,
+                                  pdf_engine=pdf_engine,
+                                  text_cache=TextCache(text_cache_dir) if text_cache_dir else None,
+                                  length_unit=length_unit)
+    manifest = IndexManifest.for_vector_store(
+        vector_store, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_unit=length_unit
+    )
+
+    if incremental:
+        if manifest.is_compatible():
+            print("[2/4] 对比文件清单...")
+            print("[3/4] 处理变化的文件...")
+            sync_stats = sync_knowledge_base(vector_store, processor, str(knowledge_base_path), manifest)
+            print("[4/4] 增量同步完成")
+            print(f"\n✓ 新增 {sync_stats['added']}，修改 {sync_stats['changed']}，"
+                  f"删除 {sync_stats['removed']} 个文件，耗时 {sync_stats['elapsed_seconds']} 秒")
+            print_stats(vector_store)
+            return True
+        print("文件清单不存在或分块参数已变化，执行全量重建")
+
+    # 处理知识库文件
+    print("[2/4] 扫描知识库文件...")
+    files = processor.list_files(str(knowledge_base_path))
+
+    if files:
+        print(f"发现 {len(files)} 个文件")
+        # 写入影子集合，完成后再切换；中途失败时原索引保持不变
+        print("[3/4] 流式解析、向量化并写入影子集合...")
+        shadow_name, shadow = vector_store.create_shadow_collection()
+        try:
+            deduplicator = ChunkDeduplicator(threshold=dedup_threshold) if dedup_threshold is not None else None
+            pipeline_stats = IngestPipeline(vector_store, collection=shadow, deduplicator=deduplicator).run(
+                processor.iter_processed_files(files)
+            )
+        except Exception:
+            vector_store.drop_shadow_collection(shadow_name)
+            raise
+
+        print("[4/4] 切换到新索引...")
+        vector_store.swap_collection(shadow_name, shadow)
+        # 运行中的服务可能仍在使用旧集合，不在这里删除：服务发现切换后删除，或在下次启动时删除
+        print(f"  旧集合将在 {RETIRED_COLLECTION_TTL} 秒后由运行中的知识库服务删除（服务未运行时在下次启动时删除）")
+        manifest.record_full_build(str(knowledge_base_path), pipeline_stats['file_chunks'],
+                                   pipeline_stats['duplicates_of'],
+                                   pipeline_stats['failed_files'])
         print("\n✓ 知识库索引构建完成！")
-        
-        # 显示统计信息
-        stats = vector_store.get_collection_stats()
-        print("\n" + "=" * 60)
-        print("知识库统计信息:")
-        print(f"  - 文档块总数: {stats['document_count']}")
-        print(f"  - 集合名称: {stats['collection_name']}")
-        print("=" * 60)
-        
+        if pipeline_stats['failed_files']:
+            print(f"  ({len(pipeline_stats['failed_files'])} 个文件处理失败)")
+        print(f"  {processor.format_extraction_stats()}")
+
+        print_stats(vector_store)
         return True
     else:
         print("错误: 未找到可处理的文档")
         return False
 
+
+def print_stats(vector_store):
+    """显示统计信息"""
+    stats = vector_store.get_collection_stats()
+    print("\n" + "=" * 60)
+    print("知识库统计信息:")
+    print(f"  - 文档块总数: {stats['document_count']}")
+    print(f"  - 集合名称: {stats['collection_name']}")
+    cache_stats = vector_store.get_cache_stats()['embedding_cache']
+    if cache_stats:
+        print(f"  - embedding缓存: 命中 {cache_stats['hits']}，未命中 {cache_stats['misses']}"
+              f"（命中率 {cache_stats['hit_rate']:.1%}），缓存 {cache_stats['size']} 个向量")
+    print("=" * 60)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="重建知识库索引")
+    parser.add_argument("--incremental", action="store_true",
+                        help="根据文件清单只处理新增/修改/删除的文件")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('KB_PARSE_WORKERS', 1)),
+                        help="并行解析文档的进程数（0为使用全部CPU核心，默认1）")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS,
+                        default=os.environ.get('KB_EMBEDDING_BACKEND', 'fp32'),
+                        help="embedding推理后端（int8为CPU动态量化，默认fp32）")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get('KB_EMBEDDING_THREADS', 0)),
+                        help="PyTorch计算线程数（0为默认）")
+    parser.add_argument("--embedding-cache-size", type=int,
+                        default=int(os.environ.get('KB_EMBEDDING_CACHE_SIZE', 200000)),
+                        help="磁盘embedding缓存最多保存的向量数（0为禁用）")
+    parser.add_argument("--index-backend", choices=INDEX_BACKENDS,
+                        default=os.environ.get('KB_INDEX_BACKEND', 'chroma'),
+                        help="向量索引后端（numpy为内存映射精确检索，默认chroma）")
+    parser.add_argument("--pdf-engine", choices=PDF_ENGINES,
+                        default=os.environ.get('KB_PDF_ENGINE', 'auto'),
+                        help="PDF提取引擎（auto为PyPDF2优先、空页/乱码页回退pdfplumber，默认auto）")
+    parser.add_argument("--text-cache-dir", default=os.environ.get('KB_TEXT_CACHE_DIR', './chroma_db/text_cache'),
+                        help="提取文本缓存目录（文件未变化时跳过解析）")
+    parser.add_argument("--no-text-cache", action="store_true", help="不读写提取文本缓存")
+    parser.add_argument("--chunk-length-unit", choices=LENGTH_UNITS,
+                        default=os.environ.get('KB_CHUNK_LENGTH_UNIT', 'chars'),
+                        help="分块长度单位（tokens 按 tiktoken token 数计算，默认 chars）")
+    parser.add_argument("--dedup-threshold", type=float,
+                        default=float(os.environ.get('KB_DEDUP_THRESHOLD', 0.85)),
+                        help="近似重复文本块的相似度阈值（>=1 只去除完全相同的文本块，默认0.85）")
+    parser.add_argument("--no-dedup", action="store_true",
+                        default=os.environ.get('KB_DEDUP', '1') == '0', help="全量重建时不去除重复文本块")
+    args = parser.parse_args()
+
     try:
-        success = rebuild_knowledge_base()
+        success = rebuild_knowledge_base(
+            incremental=args.incremental,
+            workers=args.workers,
+            embedding_backend=args.embedding_backend,
+            threads=args.threads or None,
+            embedding_cache_size=args.embedding_cache_size,
+            index_backend=args.index_backend,
+            pdf_engine=args.pdf_engine,
+            text_cache_dir=None if args.no_text_cache else args.text_cache_dir,
+            length_unit=args.chunk_length_unit,
+            dedup_threshold=None if args.no_dedup else args.dedup_threshold
+        )
         sys.exit(0 if success else 1)
     except Exception as e:
         print(f"\n错误: {e}")
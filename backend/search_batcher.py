@@ -0,0 +1,181 @@
+"""
+搜索请求合并器 - 动态微批处理
+
+并发到达的单条搜索请求在一个很短的时间窗口内（或达到最大批次数时）被合并，
+通过 VectorStore.search_many 一次encode、一次向量查询后再把结果分发给各个请求。
+在只有CPU的机器上可以显著提高吞吐量，且不需要修改API。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from metrics import observe_stage
+
+
+class _PendingSearch:
+    """等待合并的单条搜索请求"""
+
+    __slots__ = ('query', 'top_k', 'where', 'mode', 'enqueued_at', 'future')
+
+    def __init__(self, query: str, top_k: int, where: Optional[Dict], mode: str):
+        self.query = query
+        self.top_k = top_k
+        self.where = where
+        self.mode = mode
+        self.enqueued_at = time.perf_counter()
+        self.future = Future()
+
+
+class SearchBatcher:
+    """搜索请求合并器"""
+
+    def __init__(self, vector_store, window_ms: float = 5, max_batch_size: int = 16):
+        """
+        Args:
+            vector_store: VectorStore 实例
+            window_ms: 收到第一个请求后等待更多请求的时间窗口（毫秒）
+            max_batch_size: 单批最多合并的请求数，达到后立即执行
+        """
+        self.vector_store = vector_store
+        self.window_seconds = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._closed = False
+
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._cache_hits = 0
+        self._batches = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._recent_waits: deque = deque(maxlen=1000)
+        self._batch_sizes: Dict[int, int] = {}
+
+    def search(self, query: str, top_k: int = 3, where: Optional[Dict] = None,
+               mode: str = 'vector') -> Tuple[List[Dict], float]:
+        """
+        提交搜索并等待结果
+
+        Returns:
+            (结果列表, 排队等待毫秒数)
+        """
+        # 缓存命中直接返回，不进入合并窗口
+        cached = self.vector_store.get_cached_result(query, top_k, where, mode)
+        if cached is not None:
+            with self._stats_lock:
+                self._requests += 1
+                self._cache_hits += 1
+            return cached, 0.0
+
+        pending = _PendingSearch(query, top_k, where, mode)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("SearchBatcher 已关闭")
+            self._ensure_worker()
+            self._queue.append(pending)
+            self._condition.notify()
+        results, wait_ms = pending.future.result()
+        observe_stage('queue_wait', wait_ms / 1000)
+        return results, wait_ms
+
+    def close(self) -> None:
+        """停止后台线程"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        """合并效果与排队等待统计"""
+        with self._stats_lock:
+            batched = self._requests - self._cache_hits
+            waits = sorted(self._recent_waits)
+            return {
+                "window_ms": self.window_seconds * 1000,
+                "max_batch_size": self.max_batch_size,
+                "requests": self._requests,
+                "cache_hits": self._cache_hits,
+                "batches": self._batches,
+                "avg_batch_size": round(batched / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "queue_wait_ms": {
+                    "avg": round(self._total_wait_ms / batched, 3) if batched else 0.0,
+                    "p95": round(waits[int(len(waits) * 0.95) - 1], 3) if waits else 0.0,
+                    "max": round(self._max_wait_ms, 3)
+                }
+            }
+
+    # ---- 后台线程 ----
+
+    def _ensure_worker(self) -> None:
+        """按需启动后台线程（fork 后的子进程中会重新启动）"""
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        self._worker = threading.Thread(target=self._run, name="search-batcher", daemon=True)
+        self._worker.start()
+
+    def _next_batch(self) -> List[_PendingSearch]:
+        """等待第一个请求，然后在时间窗口内继续收集，直到窗口结束或达到最大批次数"""
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            if self._closed and not self._queue:
+                return []
+            deadline = time.perf_counter() + self.window_seconds
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self._closed:
+                    break
+                self._condition.wait(remaining)
+            batch_size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(batch_size)]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            started_at = time.perf_counter()
+
+            # where 条件或检索模式不同的请求无法共用一次向量查询，按条件分组
+            groups: Dict[Tuple[str, str], List[_PendingSearch]] = {}
+            for pending in batch:
+                key = (json.dumps(pending.where, sort_keys=True, ensure_ascii=False), pending.mode)
+                groups.setdefault(key, []).append(pending)
+
+            for group in groups.values():
+                try:
+                    results = self.vector_store.search_many(
+                        [pending.query for pending in group],
+                        top_k=[pending.top_k for pending in group],
+                        where=group[0].where,
+                        mode=group[0].mode
+                    )
+                except Exception as e:
+                    for pending in group:
+                        pending.future.set_exception(e)
+                    continue
+                for pending, result in zip(group, results):
+                    wait_ms = (started_at - pending.enqueued_at) * 1000
+                    pending.future.set_result((result, wait_ms))
+
+            self._record_batch(batch, started_at)
+
+    def _record_batch(self, batch: List[_PendingSearch], started_at: float) -> None:
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            for pending in batch:
+                wait_ms = (started_at - pending.enqueued_at) * 1000
+                self._total_wait_ms += wait_ms
+                self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+                self._recent_waits.append(wait_ms)
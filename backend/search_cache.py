@@ -0,0 +1,85 @@
+"""
+搜索缓存 - 线程安全的LRU缓存（支持容量和TTL淘汰）
+
+用于缓存查询向量和搜索结果，参见 VectorStore.search。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """带TTL的LRU缓存"""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            max_size: 最大条目数，<=0 表示禁用缓存
+            ttl_seconds: 条目存活时间（秒），None 表示不过期
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None, count_miss: bool = True) -> Any:
+        """
+        读取缓存，命中时移动到最近使用位置
+
+        Args:
+            count_miss: 未命中时是否计入统计（预检查后还会正式查询时传False，避免重复计数）
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += count_miss
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += count_miss
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """清空缓存（保留命中统计）"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        """命中率等统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,185 @@
+"""
+搜索响应裁剪 - 字段选择、片段截取、分页游标
+
+只展示标题和预览的页面不需要完整的文本块、文件路径和距离，top_k 较大时完整结果会让响应体积
+和 JSON 序列化耗时成倍增加。搜索请求可以：
+
+1. fields: 只返回指定字段，未选中的字段不计算也不序列化
+2. snippet_chars: content 只返回与查询最匹配的一段（按词法索引的切分方式在原文中定位查询词，
+   选出覆盖查询词最多的窗口，截断处加省略号），并返回 truncated 标记
+3. offset / cursor: 分页；游标记录下一页的起点和页大小，并绑定查询、模式和过滤条件
+
+响应的 gzip 压缩见 compression.py。
+"""
+import base64
+import hashlib
+import json
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from chunk_dedup import split_sources
+from lexical_index import tokenize
+
+ELLIPSIS = "…"
+
+# 截断位置落在英文单词中间时，最多向外移动这么多个字符寻找空白
+_WORD_BOUNDARY_SEARCH = 15
+
+
+def _similarity(result: Dict) -> float:
+    distance = result.get('distance', 0)
+    return max(0, 1 / (1 + abs(distance))) if distance is not None else 1.0
+
+
+# 结果字段 → 取值函数（按默认返回顺序）
+RESULT_FIELDS: Dict[str, Callable[[Dict], object]] = {
+    "content": lambda result: result['content'],
+    "source": lambda result: result['metadata']['source'],
+    "sources": lambda result: split_sources(result['metadata']),  # 去重后内容相同的全部来源文件
+    "file_path": lambda result: result['metadata'].get('file_path', ''),
+    "chunk_id": lambda result: result['metadata'].get('chunk_id', 0),
+    "page_start": lambda result: result['metadata'].get('page_start'),  # PDF页码（从1开始），DOCX为None
+    "page_end": lambda result: result['metadata'].get('page_end'),
+    "distance": lambda result: result.get('distance', 0),  # 原始距离，越小越相似
+    "similarity": _similarity,  # 距离转换为0-1分数
+    "score": lambda result: result.get('score'),  # lexical 为BM25分数，hybrid 为RRF融合分数
+}
+
+
+def parse_fields(value) -> Tuple[str, ...]:
+    """
+    解析 fields 参数（列表或逗号分隔的字符串），None 表示全部字段
+
+    Raises:
+        ValueError: 参数格式不对或包含未知字段
+    """
+    if value is None:
+        return tuple(RESULT_FIELDS)
+    if isinstance(value, str):
+        value = [name.strip() for name in value.split(',') if name.strip()]
+    if not isinstance(value, list) or not value or not all(isinstance(name, str) for name in value):
+        raise ValueError("fields参数必须是非空的字段名列表")
+    unknown = [name for name in value if name not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"未知字段: {', '.join(unknown)}，可选: {', '.join(RESULT_FIELDS)}")
+    # 去掉重复字段，保持请求中的顺序
+    return tuple(dict.fromkeys(value))
+
+
+class SnippetBuilder:
+    """截取文本块中与查询最匹配的片段（每个请求创建一次，查询只切分一次）"""
+
+    def __init__(self, query: str, max_chars: int):
+        self.max_chars = max_chars
+        self.terms = sorted(set(tokenize(query)), key=len, reverse=True)
+
+    def build(self, content: str) -> Tuple[str, bool]:
+        """
+        Returns:
+            (片段, 是否截断)
+        """
+        if len(content) <= self.max_chars:
+            return content, False
+        start = self._best_window(content)
+        end = min(start + self.max_chars, len(content))
+        start, end = self._snap_to_words(content, start, end)
+        snippet = content[start:end].strip()
+        return (ELLIPSIS if start > 0 else "") + snippet + (ELLIPSIS if end < len(content) else ""), True
+
+    def _best_window(self, content: str) -> int:
+        """覆盖不同查询词最多的窗口的起点；匹配的部分居中，没有匹配时取开头"""
+        lowered = content.lower()
+        if len(lowered) != len(content):
+            # 少数字符转小写后长度变化，位置无法对应，退回区分大小写
+            lowered = content
+        hits: List[Tuple[int, int, int]] = []  # (位置, 结束位置, 查询词序号)
+        for index, term in enumerate(self.terms):
+            position = lowered.find(term)
+            while position >= 0:
+                hits.append((position, position + len(term), index))
+                position = lowered.find(term, position + 1)
+        if not hits:
+            return 0
+        hits.sort()
+
+        # 双指针：窗口 [hits[left].位置, hits[right].结束位置] 不超过 max_chars，统计其中不同查询词的个数
+        counts: Dict[int, int] = {}
+        best_key = (0, 0)  # (不同查询词数, 命中次数)，相同时取靠前的窗口
+        span_start, span_end = hits[0][0], hits[0][1]
+        left = 0
+        for right, (_, hit_end, term) in enumerate(hits):
+            counts[term] = counts.get(term, 0) + 1
+            while hit_end - hits[left][0] > self.max_chars:
+                left_term = hits[left][2]
+                counts[left_term] -= 1
+                if not counts[left_term]:
+                    del counts[left_term]
+                left += 1
+            key = (len(counts), right - left + 1)
+            if key > best_key:
+                best_key = key
+                span_start, span_end = hits[left][0], hit_end
+
+        padding = (self.max_chars - (span_end - span_start)) // 2
+        start = max(span_start - padding, 0)
+        return max(min(start, len(content) - self.max_chars), 0)
+
+    @staticmethod
+    def _snap_to_words(content: str, start: int, end: int) -> Tuple[int, int]:
+        """截断位置在英文单词中间时收缩到单词边界"""
+        if 0 < start < len(content) and content[start - 1].isascii() and content[start - 1].isalnum():
+            boundary = content.find(' ', start, start + _WORD_BOUNDARY_SEARCH)
+            if boundary >= 0:
+                start = boundary + 1
+        if 0 < end < len(content) and content[end].isascii() and content[end].isalnum():
+            boundary = content.rfind(' ', max(end - _WORD_BOUNDARY_SEARCH, start), end)
+            if boundary >= 0:
+                end = boundary
+        return start, end
+
+
+def format_results(results: Sequence[Dict], fields: Sequence[str] = tuple(RESULT_FIELDS),
+                   snippet: Optional[SnippetBuilder] = None) -> List[Dict]:
+    """格式化搜索结果，只计算选中的字段"""
+    getters = [(name, RESULT_FIELDS[name]) for name in fields]
+    formatted = []
+    for result in results:
+        item = {name: getter(result) for name, getter in getters}
+        if snippet is not None and "content" in item:
+            item["content"], item["truncated"] = snippet.build(item["content"])
+        formatted.append(item)
+    return formatted
+
+
+# ---- 分页游标 ----
+
+def _query_fingerprint(query: str, mode: str, filters: Optional[Dict]) -> str:
+    key = json.dumps([query, mode, filters], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(offset: int, page_size: int, query: str, mode: str, filters: Optional[Dict]) -> str:
+    """下一页的游标（URL安全的base64）"""
+    payload = json.dumps({"o": offset, "k": page_size, "q": _query_fingerprint(query, mode, filters)},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, query: str, mode: str, filters: Optional[Dict]) -> Tuple[int, int]:
+    """
+    Returns:
+        (offset, 页大小)
+
+    Raises:
+        ValueError: 游标无效，或与本次查询、模式、过滤条件不一致
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        offset, page_size, fingerprint = int(payload['o']), int(payload['k']), payload['q']
+    except (ValueError, KeyError, TypeError, UnicodeEncodeError):
+        raise ValueError("cursor参数无效")
+    if fingerprint != _query_fingerprint(query, mode, filters):
+        raise ValueError("cursor与本次的query、mode、filters不一致")
+    if offset < 0 or page_size <= 0:
+        raise ValueError("cursor参数无效")
+    return offset, page_size
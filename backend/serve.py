@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+"""
+多进程生产服务 - 主进程加载一次模型和索引，fork 出多个工作进程共享（写时复制）
+
+python knowledge_service.py / auth_service.py 使用 Flask 开发服务器：单进程，一次慢的 encode
+会拖慢所有请求，并发请求再多也只能用到一个核心（GIL）；开多个独立进程则每个进程各加载一份模型。
+
+    python serve.py knowledge --workers 4 --threads 4
+    python serve.py auth --workers 2
+    python serve.py bench --url http://localhost:5001/api/knowledge/search --concurrency 16 --unique
+
+主进程:
+1. 导入服务模块并完成初始化（知识库服务：加载 embedding 模型、打开集合、预热；认证服务：初始化数据库）
+2. 绑定监听端口，gc.freeze() 后 fork 出 N 个工作进程。模型权重在 fork 前已经在内存中，
+   工作进程只读不写，物理内存中只有一份（gc.freeze 避免垃圾回收改写对象头导致内存页被复制）
+3. 监控工作进程：异常退出时重新 fork；SIGHUP 平滑重载；SIGTERM/SIGINT 平滑退出
+
+工作进程:
+- 共享同一个监听端口，由内核在正在 accept 的进程之间分配连接
+- 固定数量的请求线程 + 有界等待队列；队列满时直接返回 429（Retry-After），不再无限堆积
+- 所有请求线程都忙时稍等片刻再 accept，让空闲的工作进程优先接收新连接
+- PyTorch 计算线程数限制为 --torch-threads（默认 CPU 核心数 / 工作进程数），N 个进程不争抢核心
+
+索引更新（知识库服务）：重建和增量同步通过索引目录下的文件锁互斥，同一时间只有一个进程写入；
+写入完成后更新共享数据版本，每个工作进程每隔 --reload-poll 秒检查一次，发现变化后重新打开集合、清空结果缓存。
+
+平滑重载（kill -HUP <主进程>）：主进程重新打开当前集合，fork 新一代工作进程，
+再让旧工作进程停止接收连接、处理完进行中的请求后退出。代码或模型变化需要重启主进程。
+
+Windows 不支持 fork，退化为单进程（同样有线程上限和 429）。
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import queue
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+# 所有请求线程都忙时，accept 前最多等待的时间（秒），让空闲的工作进程先接收连接
+ACCEPT_YIELD_SECONDS = 0.01
+
+# 客户端连接的读写超时（秒），避免慢客户端长期占用请求线程
+CLIENT_TIMEOUT_SECONDS = 60
+
+# 工作进程启动后很快退出时，等待该时间再重新 fork，避免崩溃循环占满CPU
+RESPAWN_BACKOFF_SECONDS = 1.0
+
+BUSY_BODY = json.dumps({"error": "服务繁忙，请稍后重试"}, ensure_ascii=False).encode('utf-8')
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+# ---- 服务 ----
+
+class ServiceProfile:
+    """一个服务的预加载与 fork 后处理"""
+
+    name = ''
+    module_name = ''
+    env_prefix = ''
+    default_port = 0
+    uses_torch = False
+
+    def import_module(self):
+        return importlib.import_module(self.module_name)
+
+    def preload(self, module) -> None:
+        """主进程中 fork 之前执行（加载所有工作进程共享的状态）"""
+
+    def after_fork(self, module, args) -> None:
+        """工作进程中执行"""
+
+    def worker_started(self, module, args) -> None:
+        """开始处理请求前执行（fork 出的工作进程，以及不支持 fork 时的单进程）"""
+
+    def reload(self, module) -> bool:
+        """主进程中执行（SIGHUP 和每隔 --reload-poll 秒），重新打开数据；返回数据是否变化"""
+        return False
+
+    def busy(self, module) -> bool:
+        """工作进程退出前是否需要等待（如后台重建任务）"""
+        return False
+
+
+class KnowledgeProfile(ServiceProfile):
+    name = 'knowledge'
+    module_name = 'knowledge_service'
+    env_prefix = 'KB'
+    default_port = 5001
+    uses_torch = True
+
+    def import_module(self):
+        # 由主进程同步初始化，不在导入时启动后台初始化线程
+        os.environ['KB_AUTO_INIT'] = '0'
+        return super().import_module()
+
+    def preload(self, module) -> None:
+        # 主进程只用单线程执行预热 encode：OpenMP 线程池 fork 后在子进程中不可用（可能卡死），
+        # 工作进程在 after_fork 中再设置各自的线程数
+        module.EMBEDDING_THREADS = 1
+        # 索引为空时不在主进程中启动重建线程（fork 只复制调用线程）
+        module.init_vector_store(build_if_empty=False)
+
+    def after_fork(self, module, args) -> None:
+        if 'torch' in sys.modules:
+            sys.modules['torch'].set_num_threads(args.torch_threads)
+        module.vector_store.after_fork()
+
+    def worker_started(self, module, args) -> None:
+        # 每个工作进程自己检查数据版本，其他进程重建或增量同步后重新打开集合
+        if args.reload_poll > 0:
+            module.RELOAD_POLL = args.reload_poll
+            module.start_index_watcher()
+
+    def reload(self, module) -> bool:
+        # 主进程也保持打开最新的集合，新 fork 的工作进程直接继承
+        return module.vector_store.reload_collection()
+
+    def busy(self, module) -> bool:
+        job = module.rebuild_manager.current()
+        return job is not None and job.is_active
+
+
+class AuthProfile(ServiceProfile):
+    # 导入时已初始化数据库；连接池和密码哈希线程池按进程号检测 fork，工作进程中自动重建
+    name = 'auth'
+    module_name = 'auth_service'
+    env_prefix = 'AUTH'
+    default_port = 5000
+
+
+PROFILES = {profile.name: profile for profile in (KnowledgeProfile(), AuthProfile())}
+
+
+# ---- 工作进程内的服务器 ----
+
+class RequestHandler(WSGIRequestHandler):
+    # 每个连接只处理一个请求，keep-alive 连接不会长期占用请求线程
+    protocol_version = "HTTP/1.0"
+    timeout = CLIENT_TIMEOUT_SECONDS
+    access_log = False
+
+    def log_request(self, code="-", size="-") -> None:
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class BoundedWSGIServer(BaseWSGIServer):
+    """固定数量的请求线程 + 有界队列，队列满时返回429"""
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, app, host: str, port: int, threads: int, max_queue: int,
+                 listen_fd: Optional[int] = None, access_log: bool = False):
+        """
+        Args:
+            app: WSGI 应用
+            threads: 请求线程数
+            max_queue: 请求线程都忙时最多排队的连接数，超出时返回429
+            listen_fd: 主进程创建的监听套接字（None 时自行绑定 host:port）
+            access_log: 是否打印每个请求的访问日志
+        """
+        handler = type('BoundedRequestHandler', (RequestHandler,), {'access_log': access_log})
+        super().__init__(host, port, app, handler=handler, fd=listen_fd)
+        self.threads = max(threads, 1)
+        self.max_pending = self.threads + max(max_queue, 0)
+        self._queue: "queue.Queue[Optional[Tuple[socket.socket, tuple]]]" = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._stopping = threading.Event()
+        self.accepted = 0
+        self.rejected = 0
+
+    def serve(self) -> None:
+        """接收连接直到 stop() 被调用"""
+        for index in range(self.threads):
+            threading.Thread(target=self._request_loop, name=f"request-{index}", daemon=True).start()
+        # 多个工作进程在同一个套接字上等待，连接可能已被其他进程接收
+        self.socket.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while not self._stopping.is_set():
+                if not selector.select(timeout=0.5):
+                    continue
+                with self._idle:
+                    if self._pending >= self.threads:
+                        self._idle.wait(ACCEPT_YIELD_SECONDS)
+                try:
+                    conn, address = self.socket.accept()
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    if self._stopping.is_set():
+                        break
+                    raise
+                conn.setblocking(True)
+                with self._idle:
+                    accept = self._pending < self.max_pending
+                    if accept:
+                        self._pending += 1
+                        self.accepted += 1
+                    else:
+                        self.rejected += 1
+                if accept:
+                    self._queue.put((conn, address))
+                else:
+                    self._reject(conn)
+        finally:
+            selector.close()
+            # 只关闭本进程的副本，其他工作进程继续在该端口上接收连接
+            self.socket.close()
+
+    def stop(self) -> None:
+        """停止接收新连接（可在信号处理函数中调用）"""
+        self._stopping.set()
+
+    def drain(self, timeout: float) -> bool:
+        """等待已接收的请求处理完；返回是否在超时前全部完成"""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        for _ in range(self.threads):
+            self._queue.put(None)
+        return True
+
+    def _request_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            conn, address = item
+            try:
+                self.finish_request(conn, address)
+            except Exception:
+                self.handle_error(conn, address)
+            finally:
+                self.shutdown_request(conn)
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
+
+    @staticmethod
+    def _reject(conn: socket.socket) -> None:
+        try:
+            # 先读走请求（通常已在第一个数据包中），否则关闭时内核发送 RST，客户端读不到响应
+            conn.settimeout(0.1)
+            try:
+                conn.recv(65536)
+            except socket.timeout:
+                pass
+            conn.sendall(b"HTTP/1.0 429 Too Many Requests\r\n"
+                         b"Content-Type: application/json; charset=utf-8\r\n"
+                         b"Retry-After: 1\r\n"
+                         b"Connection: close\r\n"
+                         b"Content-Length: %d\r\n\r\n" % len(BUSY_BODY) + BUSY_BODY)
+            conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict:
+        with self._idle:
+            pending = self._pending
+        return {
+            "threads": self.threads,
+            "max_pending": self.max_pending,
+            "in_flight": min(pending, self.threads),
+            "queued": max(pending - self.threads, 0),
+            "accepted": self.accepted,
+            "rejected": self.rejected
+        }
+
+
+def memory_usage(pid: str = 'self') -> Dict[str, int]:
+    """进程内存（字节）：常驻、按共享进程数分摊、私有；只支持 Linux"""
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private', 'Private_Dirty': 'private'}
+    usage = {'rss': 0, 'pss': 0, 'private': 0}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in fields:
+                    usage[fields[key]] += int(value.split()[0]) * 1024
+    except OSError:
+        return {}
+    return usage
+
+
+def register_server_metrics(server: BoundedWSGIServer) -> None:
+    """把本工作进程的线程/队列/内存统计加入 /metrics（每次抓取只会落到其中一个工作进程）"""
+    from metrics import REGISTRY
+
+    def collect():
+        stats = server.stats()
+        labels = {"pid": str(os.getpid())}
+        families = [
+            ("server_requests_in_flight", "gauge", "Requests being handled by this worker",
+             [(labels, stats['in_flight'])]),
+            ("server_requests_queued", "gauge", "Accepted connections waiting for a request thread",
+             [(labels, stats['queued'])]),
+            ("server_rejected_total", "counter", "Connections rejected with 429 because the queue was full",
+             [(labels, stats['rejected'])]),
+        ]
+        memory = memory_usage()
+        if memory:
+            families.append(("process_memory_bytes", "gauge",
+                             "Worker memory: rss, pss (shared pages divided among sharers) and private",
+                             [(dict(labels, kind=kind), value) for kind, value in memory.items()]))
+        return families
+
+    REGISTRY.register_collector(collect)
+
+
+# ---- 主进程 ----
+
+def create_listener(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+class PreforkServer:
+    """预加载后 fork 工作进程，监控、重启和平滑重载"""
+
+    def __init__(self, profile: ServiceProfile, args):
+        self.profile = profile
+        self.args = args
+        self.module = None
+        self.listener: Optional[socket.socket] = None
+        self.workers: Dict[int, Tuple[int, float]] = {}  # 进程号 → (代数, 启动时间)
+        self.generation = 0
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def preload(self) -> None:
+        start = time.perf_counter()
+        self.module = self.profile.import_module()
+        self.profile.preload(self.module)
+        memory = memory_usage()
+        rss = f"，常驻内存 {memory['rss'] / 1024 / 1024:.0f} MB" if memory else ""
+        print(f"[serve] 预加载完成，耗时 {time.perf_counter() - start:.1f} 秒{rss}")
+
+    # ---- 工作进程 ----
+
+    def run_worker(self, listen_fd: Optional[int]) -> None:
+        """工作进程主体：处理请求直到收到 SIGTERM/SIGINT，然后处理完已接收的请求"""
+        args = self.args
+        if listen_fd is not None:
+            self.profile.after_fork(self.module, args)
+        self.profile.worker_started(self.module, args)
+        server = BoundedWSGIServer(self.module.app, args.host, args.port, args.threads, args.max_queue,
+                                   listen_fd=listen_fd, access_log=args.access_log)
+        register_server_metrics(server)
+
+        def stop(signum, frame):
+            server.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        server.serve()
+        if not server.drain(args.graceful_timeout):
+            print(f"[serve] 工作进程 {os.getpid()} 等待进行中的请求超时，强制退出")
+            return
+        if self.profile.busy(self.module):
+            # 后台重建写到一半退出会留下未完成的影子集合，等它完成（主进程退出时最多等 graceful_timeout）
+            print(f"[serve] 工作进程 {os.getpid()} 等待后台任务完成后退出")
+            while self.profile.busy(self.module):
+                time.sleep(0.5)
+
+    def spawn_worker(self) -> int:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self.run_worker(self.listener.fileno())
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                # 不执行从主进程继承的 atexit 清理（如关闭主进程的数据库客户端）
+                os._exit(code)
+        self.workers[pid] = (self.generation, time.monotonic())
+        return pid
+
+    def spawn_generation(self) -> None:
+        self.generation += 1
+        # 预加载产生的对象移出垃圾回收的扫描范围，工作进程的 GC 不会改写这些内存页
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.args.workers):
+            self.spawn_worker()
+        pids = [pid for pid, (generation, _) in self.workers.items() if generation == self.generation]
+        print(f"[serve] 第 {self.generation} 代工作进程: {', '.join(map(str, pids))}")
+
+    # ---- 主循环 ----
+
+    def run(self) -> None:
+        args = self.args
+        self.preload()
+        self.listener = create_listener(args.host, args.port, args.backlog)
+        torch_threads = f"，PyTorch 线程 {args.torch_threads}/进程" if self.profile.uses_torch else ""
+        print(f"[serve] {self.profile.name} 服务监听 http://{args.host}:{args.port}，"
+              f"{args.workers} 个工作进程 × {args.threads} 个请求线程，队列上限 {args.max_queue}{torch_threads}")
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        self.spawn_generation()
+        next_poll = time.monotonic() + args.reload_poll
+        while not self._stop_requested:
+            self.reap()
+            if self._reload_requested:
+                self._reload_requested = False
+                self.profile.reload(self.module)
+                self.reload()
+            elif args.reload_poll > 0 and time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + args.reload_poll
+                if self.profile.reload(self.module):
+                    print("[serve] 数据已更新，主进程已重新打开集合（工作进程各自重新加载）")
+            self.maintain()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def _on_stop(self, signum, frame) -> None:
+        self._stop_requested = True
+
+    def _on_reload(self, signum, frame) -> None:
+        self._reload_requested = True
+
+    def reload(self) -> None:
+        """fork 新一代工作进程，再通知旧工作进程处理完进行中的请求后退出"""
+        old = [pid for pid, (generation, _) in self.workers.items() if generation == self.generation]
+        self.spawn_generation()
+        for pid in old:
+            self._signal(pid, signal.SIGTERM)
+
+    def reap(self) -> None:
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            generation, _ = self.workers.pop(pid, (None, 0))
+            code = os.waitstatus_to_exitcode(status)
+            if generation == self.generation and not self._stop_requested:
+                print(f"[serve] 工作进程 {pid} 异常退出（{code}），重新启动")
+
+    def maintain(self) -> None:
+        """补足当前代的工作进程数（启动后很快退出的进程延迟重启）"""
+        current = [started for generation, started in self.workers.values() if generation == self.generation]
+        missing = self.args.workers - len(current)
+        if missing <= 0:
+            return
+        if current and time.monotonic() - max(current) < RESPAWN_BACKOFF_SECONDS:
+            return
+        for _ in range(missing):
+            self.spawn_worker()
+
+    def shutdown(self) -> None:
+        print(f"[serve] 正在停止 {len(self.workers)} 个工作进程...")
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            print(f"[serve] 工作进程 {pid} 未在 {self.args.graceful_timeout} 秒内退出，强制结束")
+            self._signal(pid, signal.SIGKILL)
+        self.listener.close()
+        print("[serve] 已停止")
+
+    @staticmethod
+    def _signal(pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def run_single(self) -> None:
+        """不支持 fork 的平台：单进程运行（仍有线程上限和429）"""
+        self.preload()
+        args = self.args
+        print(f"[serve] 当前平台不支持 fork，以单进程运行: http://{args.host}:{args.port}")
+        self.run_worker(None)
+
+
+# ---- 压测 ----
+
+def bench(url: str, concurrency: int, requests: int, query: str, timeout: float, unique: bool = False) -> Dict:
+    """并发发送搜索请求，统计 QPS、延迟分位数和 429 数量；unique 时每个请求的查询都不同（绕过缓存）"""
+    latencies = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def send(index):
+        text = f"{query} {index}" if unique else query
+        body = json.dumps({"query": text, "top_k": 5}, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = str(response.status)
+        except urllib.error.HTTPError as e:
+            status = str(e.code)
+        except OSError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == '200':
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(q):
+        return round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 1) if latencies else None
+
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "qps": round(statuses.get('200', 0) / elapsed, 1),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "statuses": statuses
+    }
+    print(f"并发 {concurrency}，{requests} 个请求: {result['qps']} QPS（成功），"
+          f"p50 {result['p50_ms']} ms，p95 {result['p95_ms']} ms，p99 {result['p99_ms']} ms")
+    print(f"  状态码: {', '.join(f'{k}×{v}' for k, v in sorted(statuses.items()))}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程生产服务（预加载 + fork）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for profile in PROFILES.values():
+        prefix = profile.env_prefix
+        service_parser = subparsers.add_parser(profile.name, help=f"启动 {profile.module_name}")
+        default_port = _env_int('PORT', profile.default_port) if profile.name == 'auth' else profile.default_port
+        service_parser.add_argument("--host", default=os.environ.get(f'{prefix}_HOST', '0.0.0.0'))
+        service_parser.add_argument("--port", type=int, default=_env_int(f'{prefix}_PORT', default_port))
+        service_parser.add_argument("--workers", type=int, default=_env_int(f'{prefix}_SERVE_WORKERS', 0),
+                                    help="工作进程数（0为CPU核心数）")
+        service_parser.add_argument("--threads", type=int, default=_env_int(f'{prefix}_SERVE_THREADS', 4),
+                                    help="每个工作进程的请求线程数")
+        service_parser.add_argument("--max-queue", type=int, default=_env_int(f'{prefix}_SERVE_MAX_QUEUE', 32),
+                                    help="每个工作进程在请求线程都忙时最多排队的连接数，超出时返回429")
+        service_parser.add_argument("--torch-threads", type=int,
+                                    default=_env_int(f'{prefix}_SERVE_TORCH_THREADS', 0),
+                                    help="每个工作进程的 PyTorch 计算线程数（0为CPU核心数/工作进程数）")
+        service_parser.add_argument("--graceful-timeout", type=float,
+                                    default=float(os.environ.get(f'{prefix}_SERVE_GRACEFUL_TIMEOUT', 30)),
+                                    help="平滑退出时等待进行中请求的最长时间（秒）")
+        service_parser.add_argument("--reload-poll", type=float,
+                                    default=float(os.environ.get(f'{prefix}_SERVE_RELOAD_POLL',
+                                                                 5 if profile.name == 'knowledge' else 0)),
+                                    help="检查数据是否更新（集合切换、增量同步）的间隔（秒），0为只在SIGHUP时重载")
+        service_parser.add_argument("--backlog", type=int, default=1024, help="监听队列长度")
+        service_parser.add_argument("--access-log", action="store_true", help="打印每个请求的访问日志")
+    bench_parser = subparsers.add_parser("bench", help="并发压测搜索接口")
+    bench_parser.add_argument("--url", default="http://localhost:5001/api/knowledge/search")
+    bench_parser.add_argument("--concurrency", type=int, default=16)
+    bench_parser.add_argument("--requests", type=int, default=1000)
+    bench_parser.add_argument("--query", default="教学目标")
+    bench_parser.add_argument("--timeout", type=float, default=30)
+    bench_parser.add_argument("--unique", action="store_true", help="每个请求使用不同的查询，绕过查询向量和结果缓存")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.url, args.concurrency, args.requests, args.query, args.timeout, args.unique)
+        return 0
+
+    cpus = os.cpu_count() or 1
+    args.workers = args.workers or cpus
+    args.torch_threads = args.torch_threads or max(cpus // args.workers, 1)
+    server = PreforkServer(PROFILES[args.command], args)
+    if hasattr(os, 'fork'):
+        server.run()
+    else:
+        server.run_single()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
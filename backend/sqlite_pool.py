@@ -0,0 +1,270 @@
+"""
+SQLite 连接池 - 有界的长连接池，使用时借出、用完归还
+
+- WAL 日志模式：读不阻塞写、写不阻塞读（默认的回滚日志会让读者排在写者后面）
+- synchronous=NORMAL：WAL 模式下只在检查点时 fsync，断电最多丢失最后几个事务，不会损坏数据库
+- busy_timeout：写锁被占用时等待而不是立刻报 "database is locked"
+- 连接长期存在，sqlite3 模块按 SQL 文本缓存预编译语句（cached_statements），
+  固定的 SQL 字符串在同一连接内只编译一次
+- 最多 max_connections 个连接：连接不绑定线程，Werkzeug 的 threaded 服务器每个请求一个新线程，
+  线程结束后连接回到池中供后续请求复用，打开的连接数（文件描述符）不随请求数增长；
+  连接全部借出时等待归还，超过 busy_timeout 抛出 sqlite3.OperationalError
+
+连接以自动提交模式打开（isolation_level=None）：只读查询不会留下未结束的读事务，
+写操作通过 transaction() 显式 BEGIN IMMEDIATE，一开始就拿到写锁，
+避免两个读事务同时升级为写事务时的死锁（这种情况 busy_timeout 无法化解）。
+
+用法:
+    pool = SQLitePool('users.db')
+    with pool.connection() as conn:      # 读
+        conn.execute('SELECT ...', params).fetchone()
+    with pool.transaction() as conn:     # 写，异常时回滚
+        conn.execute('INSERT ...', params)
+
+检查连接数是否有界（模拟每个请求一个线程）:
+    python sqlite_pool.py check --threads 300 --max-connections 8
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class SQLitePool:
+    """有界的 SQLite 连接池（同一线程内嵌套使用时复用已借出的连接）"""
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000, synchronous: str = 'NORMAL',
+                 wal: bool = True, cached_statements: int = 128, pooled: bool = True,
+                 max_connections: int = 8):
+        """
+        Args:
+            path: 数据库文件路径
+            busy_timeout_ms: 等待锁（以及等待空闲连接）的最长时间（毫秒）
+            synchronous: PRAGMA synchronous（OFF / NORMAL / FULL / EXTRA）
+            wal: 是否启用 WAL 日志模式（该设置写入数据库文件，对之后所有连接生效）
+            cached_statements: 每个连接缓存的预编译语句数
+            pooled: False 时每次使用都新建并关闭连接（旧行为，用于对比测试）
+            max_connections: 最多同时打开的连接数
+        """
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"不支持的 synchronous 模式: {synchronous}，可选: {', '.join(SYNCHRONOUS_MODES)}")
+        if max_connections < 1:
+            raise ValueError("max_connections 至少为1")
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.wal = wal
+        self.cached_statements = cached_statements
+        self.pooled = pooled
+        self.max_connections = max_connections
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._connections: List[sqlite3.Connection] = []  # 已打开的全部连接
+        self._idle: List[sqlite3.Connection] = []         # 空闲连接（后进先出，最近用过的连接缓存更热）
+        self._connecting = 0
+        self._opened = 0
+        self._waits = 0
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        if self.wal:
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        with self._lock:
+            self._opened += 1
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        """借出一个空闲连接；没有空闲连接且未达上限时新建，否则等待归还"""
+        # fork 出的子进程不能继续使用父进程的连接
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        deadline = time.monotonic() + self.busy_timeout_ms / 1000
+        with self._available:
+            while not self._idle and len(self._connections) + self._connecting >= self.max_connections:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"等待数据库连接超时（{self.max_connections} 个连接均在使用中）")
+                self._waits += 1
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._connecting += 1
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._available:
+                self._connecting -= 1
+                self._available.notify()
+            raise
+        with self._available:
+            self._connecting -= 1
+            self._connections.append(conn)
+        return conn
+
+    def _checkin(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            # 提交/回滚本身失败时，不把未结束的事务留给下一个使用者
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+        with self._available:
+            if conn in self._connections:
+                self._idle.append(conn)
+                self._available.notify()
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._available:
+            if conn in self._connections:
+                self._connections.remove(conn)
+            self._available.notify()
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _reset_after_fork(self) -> None:
+        # 不关闭继承来的连接（关闭会影响父进程持有的文件锁），直接丢弃
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._connections = []
+        self._idle = []
+        self._connecting = 0
+        self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接（自动提交模式，适合只读查询和单条写语句），退出时归还"""
+        if not self.pooled:
+            conn = self._connect()
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._pid == os.getpid():
+            # 嵌套使用：同一线程已借出连接（如在事务中调用的辅助函数）
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self):
+        """在 BEGIN IMMEDIATE 事务中执行，正常结束时提交，异常时回滚"""
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close_all(self) -> None:
+        """关闭所有连接（服务退出或测试清理时使用，调用时不应有借出的连接）"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._idle = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pooled": self.pooled,
+                "wal": self.wal,
+                "synchronous": self.synchronous,
+                "max_connections": self.max_connections,
+                "open_connections": len(self._connections),
+                "idle_connections": len(self._idle),
+                "connections_opened": self._opened,
+                "checkout_waits": self._waits
+            }
+
+
+def check_bounded(threads: int = 300, max_connections: int = 8) -> Dict:
+    """
+    回归检查：模拟 threaded 服务器每个请求一个新线程，打开的连接数不应超过 max_connections
+
+    Returns:
+        连接池统计（附加 passed）
+    """
+    with tempfile.TemporaryDirectory(prefix="sqlite_pool_check_") as directory:
+        pool = SQLitePool(os.path.join(directory, "check.db"), max_connections=max_connections)
+        with pool.transaction() as conn:
+            conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)')
+        errors = []
+
+        def request(index):
+            try:
+                with pool.transaction() as conn:
+                    conn.execute('INSERT INTO t (value) VALUES (?)', (str(index),))
+                with pool.connection() as conn:
+                    conn.execute('SELECT COUNT(*) FROM t').fetchone()
+            except sqlite3.Error as e:
+                errors.append(str(e))
+
+        workers = [threading.Thread(target=request, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with pool.connection() as conn:
+            rows = conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+        stats = pool.stats()
+        pool.close_all()
+    stats.update(threads=threads, rows=rows, errors=len(errors),
+                 passed=stats['connections_opened'] <= max_connections and rows == threads and not errors)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 连接池检查")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check_parser = subparsers.add_parser("check", help="每个请求一个线程时，连接数是否保持在上限内")
+    check_parser.add_argument("--threads", type=int, default=300)
+    check_parser.add_argument("--max-connections", type=int, default=8)
+    args = parser.parse_args()
+
+    stats = check_bounded(args.threads, args.max_connections)
+    print(f"{stats['threads']} 个线程，共打开 {stats['connections_opened']} 个连接（上限 {stats['max_connections']}），"
+          f"等待空闲连接 {stats['checkout_waits']} 次，写入 {stats['rows']} 行，错误 {stats['errors']}")
+    print("通过" if stats['passed'] else "失败: 连接数超过上限或有请求失败")
+    return 0 if stats['passed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
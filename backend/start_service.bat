@@ -30,8 +30,10 @@ echo.
 echo 服务地址: http://localhost:5001
 echo API文档:
 echo   - POST /api/knowledge/search  搜索知识库
+echo   - POST /api/knowledge/search/batch 批量搜索知识库
 echo   - GET  /api/knowledge/stats   获取统计信息
-echo   - POST /api/knowledge/rebuild 重建索引
+echo   - POST /api/knowledge/rebuild 后台重建索引
+echo   - GET  /api/knowledge/rebuild/status 重建任务状态
 echo.
 echo ========================================
 echo.
@@ -48,6 +48,27 @@ def test_search(query, top_k=3):
         print(f"错误: {response.text}")
     print()
 
+def test_search_batch(queries, top_k=3, mode="vector"):
+    """测试批量搜索接口"""
+    print("=" * 50)
+    print(f"测试批量搜索接口: {len(queries)} 个查询（{mode}）")
+    print("=" * 50)
+    
+    response = requests.post(
+        f"{BASE_URL}/api/knowledge/search/batch",
+        json={"queries": [{"query": q, "top_k": top_k} for q in queries], "mode": mode}
+    )
+    
+    print(f"状态码: {response.status_code}")
+    
+    if response.status_code == 200:
+        for item in response.json().get("results", []):
+            sources = [result['source'] for result in item['results']]
+            print(f"  {item['query']}: {item['count']} 条结果 {sources}")
+    else:
+        print(f"错误: {response.text}")
+    print()
+
 if __name__ == "__main__":
     # 测试统计信息
     test_stats()
@@ -57,3 +78,10 @@ if __name__ == "__main__":
     test_search("BOPPPS教学模式")
     test_search("布卢姆分类学")
     test_search("教学目标")
+    
+    # 测试批量搜索
+    test_search_batch(["课程设计", "BOPPPS教学模式", "布卢姆分类学", "教学目标"])
+    
+    # 测试精确术语的词法检索和混合检索
+    test_search_batch(["BOPPPS", "布卢姆分类学", "ISW"], mode="lexical")
+    test_search_batch(["BOPPPS", "布卢姆分类学", "ISW"], mode="hybrid")
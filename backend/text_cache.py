@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+提取文本缓存 - 文件未变化时跳过 PDF/DOCX 解析
+
+缓存按文件内容寻址：
+- index.json: 文件路径 → (大小, 修改时间, 内容SHA-256)；大小和修改时间未变时不重新计算哈希
+- blobs/<哈希前2位>/<哈希>_<提取方式>.txt.gz: gzip 压缩的提取文本，提取方式包含PDF引擎和缓存版本，
+  更换引擎或提取逻辑变化后不会误用旧文本；PDF文本以分页符分隔各页，命中后仍能按页分块并记录页码
+
+调整 chunk_size/chunk_overlap 做分块实验或全量重建时，未变化的文件直接读取缓存文本后分块，不再解析。
+文件被移动或复制时内容哈希不变，同样命中。
+
+缓存的查询和索引更新只在主进程中进行；多进程解析时由工作进程写入文本文件（原子替换，可并发写入）。
+
+命令行:
+    python text_cache.py stats
+    python text_cache.py prune                      # 删除已不存在文件的记录和不再被引用的文本
+    python text_cache.py prune --max-size-mb 500    # 超过容量时按最近使用时间淘汰
+    python text_cache.py warm --workers 4           # 预先解析知识库，填充缓存
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from index_manifest import compute_file_hash
+
+# 提取逻辑变化（如乱码判定规则调整）时递增，使旧缓存失效
+# v2: PDF文本保留分页符（含空页），用于按页流式分块并记录页码
+TEXT_CACHE_VERSION = 2
+
+INDEX_VERSION = 1
+
+
+class TextCache:
+    """按文件内容寻址的提取文本缓存"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.blob_directory = self.directory / "blobs"
+        self.index_path = self.directory / "index.json"
+        self._index: Optional[Dict[str, Dict]] = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ---- 路径索引 ----
+
+    @property
+    def index(self) -> Dict[str, Dict]:
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"文本缓存索引读取失败，将重新建立: {e}")
+            return {}
+        if data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('files', {})
+
+    def save(self) -> None:
+        """原子写入路径索引（无变化时跳过）"""
+        with self._lock:
+            if not self._dirty or self._index is None:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": INDEX_VERSION, "files": self._index}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+
+    def file_hash(self, file_path: str) -> str:
+        """文件内容哈希；大小和修改时间与索引一致时直接使用记录的哈希"""
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self.index.get(path)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                return entry['sha256']
+        file_hash = compute_file_hash(path)
+        with self._lock:
+            self.index[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash}
+            self._dirty = True
+        return file_hash
+
+    # ---- 文本 ----
+
+    @staticmethod
+    def make_key(file_hash: str, extractor: str) -> str:
+        return f"{file_hash}_{extractor}_v{TEXT_CACHE_VERSION}"
+
+    def _blob_path(self, key: str) -> Path:
+        return self.blob_directory / key[:2] / f"{key}.txt.gz"
+
+    def lookup(self, file_path: str, extractor: str) -> Tuple[str, Optional[str]]:
+        """
+        查询缓存
+
+        Args:
+            file_path: 源文件路径
+            extractor: 提取方式（如 pdf-auto、docx）
+
+        Returns:
+            (缓存键, 文本)，未命中时文本为None，之后用缓存键调用 put
+        """
+        key = self.make_key(self.file_hash(file_path), extractor)
+        blob_path = self._blob_path(key)
+        try:
+            with gzip.open(blob_path, 'rt', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return key, None
+        except (OSError, EOFError, UnicodeDecodeError) as e:
+            print(f"文本缓存损坏，重新解析: {blob_path.name}: {e}")
+            self.misses += 1
+            return key, None
+        # 修改时间作为最近使用时间，用于按容量淘汰
+        try:
+            os.utime(blob_path)
+        except OSError:
+            pass
+        self.hits += 1
+        return key, text
+
+    def put(self, key: str, text: str) -> None:
+        """写入提取文本（可在工作进程中调用）"""
+        with self.writer(key) as f:
+            f.write(text)
+
+    @contextmanager
+    def writer(self, key: str):
+        """
+        流式写入提取文本（可在工作进程中调用），不需要先在内存中拼出全文
+
+            with cache.writer(key) as f:
+                f.write(page_text)
+
+        正常退出时原子替换为正式文件，出现异常时丢弃已写入的部分
+        """
+        blob_path = self._blob_path(key)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob_path.with_name(f"{blob_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                yield f
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def discard(self, key: str) -> None:
+        """删除一份文本（如提取结果为空，不应缓存）"""
+        self._blob_path(key).unlink(missing_ok=True)
+
+    # ---- 维护 ----
+
+    def _blobs(self):
+        if not self.blob_directory.exists():
+            return []
+        return [path for path in self.blob_directory.glob('*/*.txt.gz')]
+
+    def stats(self) -> Dict:
+        blobs = self._blobs()
+        lookups = self.hits + self.misses
+        return {
+            "directory": str(self.directory),
+            "files": len(self.index),
+            "texts": len(blobs),
+            "compressed_bytes": sum(path.stat().st_size for path in blobs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def prune(self, max_bytes: int = 0) -> Dict:
+        """
+        清理缓存
+
+        1. 删除源文件已不存在的路径记录
+        2. 删除不再被任何路径引用的文本（源文件已修改或删除）及旧版本缓存
+        3. max_bytes > 0 时按最近使用时间淘汰，直到总大小不超过 max_bytes
+        """
+        removed_files = 0
+        with self._lock:
+            for path in list(self.index):
+                if not os.path.exists(path):
+                    del self.index[path]
+                    removed_files += 1
+            if removed_files:
+                self._dirty = True
+            live_hashes = {entry['sha256'] for entry in self.index.values()}
+        self.save()
+
+        removed_texts = 0
+        freed = 0
+        kept = []
+        version_suffix = f"_v{TEXT_CACHE_VERSION}.txt.gz"
+        for path in self._blobs():
+            file_hash = path.name.split('_', 1)[0]
+            size = path.stat().st_size
+            if file_hash not in live_hashes or not path.name.endswith(version_suffix):
+                path.unlink()
+                removed_texts += 1
+                freed += size
+            else:
+                kept.append((path.stat().st_mtime, size, path))
+
+        if max_bytes > 0:
+            total = sum(size for _, size, _ in kept)
+            for _, size, path in sorted(kept):
+                if total <= max_bytes:
+                    break
+                path.unlink()
+                total -= size
+                removed_texts += 1
+                freed += size
+
+        # 清理空的子目录
+        if self.blob_directory.exists():
+            for subdirectory in self.blob_directory.iterdir():
+                if subdirectory.is_dir() and not any(subdirectory.iterdir()):
+                    subdirectory.rmdir()
+        return {"removed_files": removed_files, "removed_texts": removed_texts, "freed_bytes": freed}
+
+
+def main():
+    default_directory = os.environ.get('KB_TEXT_CACHE_DIR', './chroma_db/text_cache')
+    parser = argparse.ArgumentParser(description="提取文本缓存管理")
+    parser.add_argument("--directory", default=default_directory, help="缓存目录")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="显示缓存统计")
+    prune_parser = subparsers.add_parser("prune", help="清理失效记录和文本")
+    prune_parser.add_argument("--max-size-mb", type=float, default=0, help="缓存容量上限（MB），0为不限制")
+    warm_parser = subparsers.add_parser("warm", help="解析知识库文件，预先填充缓存")
+    warm_parser.add_argument("--source", default=str(Path(__file__).parent.parent.parent / "知识库（仅按格式分类）"),
+                             help="知识库目录")
+    warm_parser.add_argument("--workers", type=int, default=int(os.environ.get('KB_PARSE_WORKERS', 1)),
+                             help="并行解析的进程数（0为全部CPU核心）")
+    warm_parser.add_argument("--pdf-engine", default=os.environ.get('KB_PDF_ENGINE', 'auto'),
+                             help="PDF提取引擎（需与重建时一致）")
+    args = parser.parse_args()
+
+    cache = TextCache(args.directory)
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"缓存目录: {stats['directory']}")
+        print(f"  记录的文件: {stats['files']}")
+        print(f"  缓存的文本: {stats['texts']}（压缩后 {stats['compressed_bytes'] / 1024 / 1024:.1f} MB）")
+    elif args.command == "prune":
+        result = cache.prune(int(args.max_size_mb * 1024 * 1024))
+        print(f"删除 {result['removed_files']} 条文件记录，{result['removed_texts']} 份文本，"
+              f"释放 {result['freed_bytes'] / 1024 / 1024:.1f} MB")
+    elif args.command == "warm":
+        from document_processor import DocumentProcessor
+
+        source = Path(args.source)
+        if not source.exists():
+            print(f"错误: 目录不存在 {source}")
+            return 1
+        processor = DocumentProcessor(workers=args.workers, pdf_engine=args.pdf_engine, text_cache=cache)
+        files = processor.list_files(str(source))
+        start = time.time()
+        failed = 0
+        for file_path, _, error in processor.iter_processed_files(files):
+            if error:
+                failed += 1
+                print(f"  解析失败: {Path(file_path).name}: {error}")
+        stats = cache.stats()
+        print(f"已处理 {len(files)} 个文件（失败 {failed}），缓存命中 {stats['hits']}，"
+              f"新解析 {stats['misses']}，耗时 {time.time() - start:.1f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
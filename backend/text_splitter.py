@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+递归字符分块器 - 替代 langchain 的 RecursiveCharacterTextSplitter
+
+算法与 langchain 0.1 的 RecursiveCharacterTextSplitter（keep_separator=True、strip_whitespace=True）一致：
+按分隔符列表依次尝试，用文本中出现的第一个分隔符切分（分隔符保留在后一段开头），
+短于 chunk_size 的片段合并为文本块，仍然过长的片段用后面的分隔符递归切分；
+相邻文本块之间保留不超过 chunk_overlap 的重叠。文本块都是原文的子串。
+
+与 langchain 相比：
+- 分隔符按字面量处理，用 str.split 代替正则；合并时用 deque 弹出重叠之外的片段，并缓存片段长度
+- 不需要导入 langchain（服务和重建脚本的启动时间、常驻内存都明显减少）
+- 长度可以按 tiktoken 的 token 数计算（length_unit='tokens'，需要安装 tiktoken）
+
+在知识库上对比与 langchain 的分块结果、分块速度和导入耗时：
+    python text_splitter.py bench
+    python text_splitter.py bench --directory ../知识库（仅按格式分类） --limit 20 --chunk-size 800
+"""
+import argparse
+import subprocess
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, List, Optional
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", "。", "！", "？", ".", "!", "?", " ", ""]
+
+LENGTH_UNITS = ('chars', 'tokens')
+
+# token 计数使用的 tiktoken 编码
+TOKEN_ENCODING = 'cl100k_base'
+
+
+def token_length_function(encoding_name: str = TOKEN_ENCODING) -> Callable[[str], int]:
+    """按 tiktoken token 数计算长度（需要安装 tiktoken）"""
+    try:
+        import tiktoken
+    except ImportError:
+        raise ImportError("按 token 分块需要安装 tiktoken: pip install tiktoken")
+    encoding = tiktoken.get_encoding(encoding_name)
+
+    def length(text: str) -> int:
+        return len(encoding.encode(text, disallowed_special=()))
+    return length
+
+
+class RecursiveTextSplitter:
+    """按分隔符列表递归切分并合并为带重叠的文本块"""
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 separators: Optional[List[str]] = None, length_unit: str = 'chars'):
+        """
+        Args:
+            chunk_size: 分块大小（字符数或 token 数）
+            chunk_overlap: 相邻文本块的最大重叠
+            separators: 分隔符列表（字面量），按优先级从高到低
+            length_unit: chars（字符数）/ tokens（tiktoken token 数）
+        """
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) 不能大于 chunk_size ({chunk_size})")
+        if length_unit not in LENGTH_UNITS:
+            raise ValueError(f"不支持的长度单位: {length_unit}，可选: {', '.join(LENGTH_UNITS)}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(DEFAULT_SEPARATORS if separators is None else separators)
+        self.length_unit = length_unit
+        self.length_function: Callable[[str], int] = len if length_unit == 'chars' else token_length_function()
+
+    def split_text(self, text: str) -> List[str]:
+        chunks: List[str] = []
+        self._split(text, self.separators, chunks)
+        return chunks
+
+    def _split(self, text: str, separators: List[str], chunks: List[str]) -> None:
+        # 使用文本中出现的第一个分隔符
+        separator = separators[-1] if separators else ""
+        remaining: List[str] = []
+        for index, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if candidate in text:
+                separator = candidate
+                remaining = separators[index + 1:]
+                break
+
+        if separator:
+            parts = text.split(separator)
+            # 分隔符保留在后一段的开头
+            splits = [parts[0]] + [separator + part for part in parts[1:]]
+        else:
+            splits = list(text)
+
+        length = self.length_function
+        good: List[str] = []
+        good_lengths: List[int] = []
+        for split in splits:
+            if not split:
+                continue
+            split_length = length(split)
+            if split_length < self.chunk_size:
+                good.append(split)
+                good_lengths.append(split_length)
+                continue
+            if good:
+                self._merge(good, good_lengths, chunks)
+                good, good_lengths = [], []
+            if remaining:
+                self._split(split, remaining, chunks)
+            else:
+                chunks.append(split)
+        if good:
+            self._merge(good, good_lengths, chunks)
+
+    def _merge(self, splits: List[str], lengths: List[int], chunks: List[str]) -> None:
+        """把短片段合并为不超过 chunk_size 的文本块，相邻文本块保留不超过 chunk_overlap 的重叠"""
+        # 分隔符保留在片段中，片段之间直接拼接
+        current = deque()
+        total = 0
+        for split, split_length in zip(splits, lengths):
+            if total + split_length > self.chunk_size and current:
+                self._append(current, chunks)
+                # 弹出开头的片段，直到剩余部分不超过重叠大小，且加上新片段后不超过分块大小
+                while total > self.chunk_overlap or (total + split_length > self.chunk_size and total > 0):
+                    total -= current.popleft()[1]
+            current.append((split, split_length))
+            total += split_length
+        self._append(current, chunks)
+
+    @staticmethod
+    def _append(current, chunks: List[str]) -> None:
+        chunk = "".join(split for split, _ in current).strip()
+        if chunk:
+            chunks.append(chunk)
+
+
+# ---- 与 langchain 对比 ----
+
+def _import_seconds(module: str) -> float:
+    """在新的解释器中导入模块的耗时（秒），模块不可用时返回 -1"""
+    code = (f"import time; start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=str(Path(__file__).parent))
+    if result.returncode != 0:
+        return -1.0
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def bench(directory: Path, limit: int, chunk_size: int, chunk_overlap: int, repeat: int) -> dict:
+    from pdf_extractor import extract_text
+
+    texts = []
+    for file_path in sorted(directory.rglob('*')):
+        if limit and len(texts) >= limit:
+            break
+        suffix = file_path.suffix.lower()
+        try:
+            if suffix == '.pdf':
+                texts.append(extract_text(str(file_path))[0])
+            elif suffix == '.docx':
+                from docx import Document
+                texts.append("\n".join(p.text for p in Document(str(file_path)).paragraphs if p.text.strip()))
+        except Exception as e:
+            print(f"  跳过 {file_path.name}: {e}")
+    total_chars = sum(len(text) for text in texts)
+    print(f"{len(texts)} 个文件，{total_chars} 个字符，chunk_size={chunk_size}，chunk_overlap={chunk_overlap}")
+
+    native = RecursiveTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    splitters = {"native": native}
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitters["langchain"] = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=DEFAULT_SEPARATORS
+        )
+    except ImportError:
+        print("未安装 langchain，只测量内置分块器")
+
+    results = {"files": len(texts), "chars": total_chars}
+    outputs = {}
+    for name, splitter in splitters.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs[name] = [splitter.split_text(text) for text in texts]
+            best = min(best, time.perf_counter() - start)
+        results[f"{name}_seconds"] = round(best, 4)
+        print(f"  {name}: {best * 1000:.1f} ms（{total_chars / best / 1e6:.1f} M字符/秒），"
+              f"{sum(len(chunks) for chunks in outputs[name])} 个文本块")
+
+    if "langchain" in outputs:
+        identical = sum(1 for a, b in zip(outputs["native"], outputs["langchain"]) if a == b)
+        results["identical_files"] = identical
+        print(f"  分块结果完全一致的文件: {identical}/{len(texts)}")
+        print(f"  分块速度: {results['langchain_seconds'] / results['native_seconds']:.2f}x")
+
+    for module in ("text_splitter", "langchain.text_splitter"):
+        seconds = _import_seconds(module)
+        results[f"import_{module}_seconds"] = round(seconds, 3)
+        print(f"  import {module}: " + (f"{seconds * 1000:.0f} ms" if seconds >= 0 else "不可用"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="递归字符分块器")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="与 langchain 对比分块结果、速度和导入耗时")
+    bench_parser.add_argument("--directory", default=str(Path(__file__).parent.parent.parent / "知识库（仅按格式分类）"),
+                              help="知识库目录（递归）")
+    bench_parser.add_argument("--limit", type=int, default=0, help="最多使用的文件数（0为全部）")
+    bench_parser.add_argument("--chunk-size", type=int, default=800)
+    bench_parser.add_argument("--chunk-overlap", type=int, default=150)
+    bench_parser.add_argument("--repeat", type=int, default=3, help="重复次数，取最快的一次")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        directory = Path(args.directory)
+        if not directory.exists():
+            print(f"错误: 目录不存在 {directory}")
+            return 1
+        bench(directory, args.limit, args.chunk_size, args.chunk_overlap, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Token 吊销列表 - 登出后 token 立即失效，校验时不访问数据库
+
+每个 token 带有唯一的 jti 声明。登出时把 (jti, 过期时间) 写入 SQLite 的 revoked_tokens 表，
+同时加入进程内的字典；@token_required 只做一次字典查找。
+
+- 启动时一次性批量加载所有未过期的记录
+- 多个工作进程共享同一个数据库：每隔 refresh_interval 秒按自增 id 增量拉取其他进程新写入的记录
+  （拉取在请求路径上顺带完成，同一时刻只有一个线程执行，其余线程直接使用现有字典）
+- token 过期后 jwt.decode 本身就会拒绝它，对应的吊销记录不再有用，定期从内存和数据库中清除
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlite_pool import SQLitePool
+
+# 清理过期记录的间隔（秒）
+PURGE_INTERVAL = 600
+
+SQL_CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS revoked_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        jti TEXT UNIQUE NOT NULL,
+        expires_at INTEGER NOT NULL
+    )
+'''
+SQL_CREATE_INDEX = 'CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens (expires_at)'
+SQL_INSERT = 'INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)'
+SQL_SELECT_SINCE = 'SELECT id, jti, expires_at FROM revoked_tokens WHERE id > ?'
+SQL_PURGE = 'DELETE FROM revoked_tokens WHERE expires_at <= ?'
+
+
+class TokenRevocationList:
+    """进程内的 token 吊销列表，持久化在 SQLite 中"""
+
+    def __init__(self, pool: SQLitePool, refresh_interval: float = 2.0):
+        """
+        Args:
+            pool: 数据库连接池
+            refresh_interval: 从数据库拉取其他进程吊销记录的间隔（秒），0 表示每次检查都拉取
+        """
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self._revoked: Dict[str, int] = {}   # jti → 过期时间（unix 秒）
+        self._last_id = 0
+        self._next_refresh = 0.0
+        self._next_purge = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def load(self) -> int:
+        """创建表并批量加载所有未过期的吊销记录，返回加载的条数"""
+        with self.pool.transaction() as conn:
+            conn.execute(SQL_CREATE_TABLE)
+            conn.execute(SQL_CREATE_INDEX)
+        with self._refresh_lock:
+            self._revoked = {}
+            self._last_id = 0
+            self._pull()
+            self._next_purge = time.monotonic() + PURGE_INTERVAL
+        return len(self._revoked)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """token 是否已被吊销（没有 jti 的旧 token 视为未吊销）"""
+        if time.monotonic() >= self._next_refresh:
+            self._maybe_refresh()
+        return jti is not None and jti in self._revoked
+
+    def revoke(self, jti: str, expires_at: int) -> None:
+        """吊销 token，expires_at 为 token 的 exp 声明"""
+        with self.pool.transaction() as conn:
+            conn.execute(SQL_INSERT, (jti, int(expires_at)))
+        with self._refresh_lock:
+            self._revoked[jti] = int(expires_at)
+
+    def _maybe_refresh(self) -> None:
+        # 已有线程在拉取时直接返回，不在请求路径上排队
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now < self._next_refresh:
+                return
+            self._pull()
+            if now >= self._next_purge:
+                self._purge_expired()
+                self._next_purge = now + PURGE_INTERVAL
+            self._next_refresh = time.monotonic() + self.refresh_interval
+        except Exception as e:
+            print(f"吊销列表刷新失败: {e}")
+            self._next_refresh = time.monotonic() + self.refresh_interval
+        finally:
+            self._refresh_lock.release()
+
+    def _pull(self) -> None:
+        """增量拉取 id 大于上次位置的记录（调用方持有 _refresh_lock）"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL_SELECT_SINCE, (self._last_id,)).fetchall()
+        if not rows:
+            return
+        self._last_id = max(row[0] for row in rows)
+        now = int(time.time())
+        # 构建新字典后整体替换，检查线程读到的总是完整的字典
+        revoked = dict(self._revoked)
+        revoked.update((jti, expires_at) for _, jti, expires_at in rows if expires_at > now)
+        self._revoked = revoked
+
+    def _purge_expired(self) -> int:
+        """从内存和数据库中删除已过期的记录，返回内存中删除的条数（调用方持有 _refresh_lock）"""
+        now = int(time.time())
+        with self.pool.transaction() as conn:
+            conn.execute(SQL_PURGE, (now,))
+        revoked = {jti: expires_at for jti, expires_at in self._revoked.items() if expires_at > now}
+        removed = len(self._revoked) - len(revoked)
+        self._revoked = revoked
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._revoked)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+批量导入用户 - 每学期按院系一次性开通教师账户
+
+输入 CSV（表头 username,email,password，password 列可省略）或 JSON（对象列表，或 {"users": [...]}）。
+
+1. 在内存中校验所有行（与 /auth/register 相同的规则），并检查文件内部的重复用户名/邮箱
+2. 用 IN 查询批量找出与已有账户冲突的用户名和邮箱
+3. 计算密码哈希（在有界的哈希线程池中并行）；未提供密码的行生成随机初始密码，在报告中返回
+4. 在一个事务中 executemany 插入，返回逐行报告
+
+文件中提供的密码按正常代价哈希（与 /auth/register 相同）。只有生成的随机初始密码使用较低的代价
+（AUTH_ONE_TIME_PASSWORD_COST）：这些账户标记为 must_change_password，首次登录时立即按正常代价重新哈希，
+并且必须先修改密码（POST /auth/password）才能使用其他接口。
+
+命令行:
+    python user_import.py teachers.csv
+    python user_import.py teachers.json --dry-run
+    python user_import.py teachers.csv --db users.db --report report.json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import secrets
+import sys
+import time
+from typing import Dict, List
+
+# SQLite 单条语句的参数个数上限（旧版本为 999）
+IN_QUERY_BATCH = 500
+
+GENERATED_PASSWORD_BYTES = 9
+
+
+class ImportFormatError(ValueError):
+    """导入文件格式错误"""
+
+
+def parse_users(data: str, fmt: str) -> List[Dict]:
+    """
+    解析导入文件
+
+    Args:
+        data: 文件内容
+        fmt: 'csv' 或 'json'
+
+    Returns:
+        [{username, email, password}]
+    """
+    if fmt == 'json':
+        try:
+            parsed = json.loads(data)
+        except ValueError as e:
+            raise ImportFormatError(f"JSON 解析失败: {e}")
+        if isinstance(parsed, dict):
+            parsed = parsed.get('users')
+        if not isinstance(parsed, list) or not all(isinstance(row, dict) for row in parsed):
+            raise ImportFormatError('JSON 应为用户对象列表，或 {"users": [...]}')
+        rows = parsed
+    elif fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(data.lstrip('﻿')))
+        if not reader.fieldnames or not {'username', 'email'} <= {name.strip() for name in reader.fieldnames}:
+            raise ImportFormatError("CSV 表头需包含 username 和 email 列")
+        rows = [{(key or '').strip(): value for key, value in row.items()} for row in reader]
+    else:
+        raise ImportFormatError(f"不支持的格式: {fmt}")
+
+    return [
+        {
+            'username': str(row.get('username') or '').strip(),
+            'email': str(row.get('email') or '').strip(),
+            'password': str(row.get('password') or '')
+        }
+        for row in rows
+    ]
+
+
+def _existing(conn, column: str, values: List[str]) -> set:
+    """批量查询已存在的用户名/邮箱"""
+    found = set()
+    for start in range(0, len(values), IN_QUERY_BATCH):
+        batch = values[start:start + IN_QUERY_BATCH]
+        placeholders = ','.join('?' * len(batch))
+        found.update(value for (value,) in conn.execute(
+            f'SELECT {column} FROM users WHERE {column} IN ({placeholders})', batch
+        ))
+    return found
+
+
+def _conflicts(conn, rows: List[Dict]) -> Dict[int, str]:
+    """返回 行号 → 冲突原因"""
+    taken_usernames = _existing(conn, 'username', [row['username'] for row in rows])
+    taken_emails = _existing(conn, 'email', [row['email'] for row in rows])
+    conflicts = {}
+    for row in rows:
+        if row['username'] in taken_usernames:
+            conflicts[row['row']] = '用户名已存在'
+        elif row['email'] in taken_emails:
+            conflicts[row['row']] = '邮箱已被注册'
+    return conflicts
+
+
+def import_users(pool, hasher, users: List[Dict], dry_run: bool = False, one_time_cost: int = None) -> Dict:
+    """
+    批量导入用户
+
+    Args:
+        pool: SQLitePool
+        hasher: PasswordHasher（与登录/注册共用，提供的密码按其正常代价哈希）
+        users: parse_users 的结果
+        dry_run: 只校验、检查冲突，不写入
+        one_time_cost: 生成的随机初始密码使用的哈希代价，None 为正常代价
+
+    Returns:
+        {"summary": {...}, "rows": [逐行结果]}
+    """
+    start = time.perf_counter()
+    report = [{'row': index + 1, 'username': user['username'], 'email': user['email']}
+              for index, user in enumerate(users)]
+
+    # 1. 内存校验（规则与 /auth/register 一致）+ 文件内重复
+    seen_usernames, seen_emails = set(), set()
+    candidates = []
+    for entry, user in zip(report, users):
+        if not user['username'] or not user['email']:
+            message = '用户名和邮箱都是必填项'
+        elif len(user['username']) < 3:
+            message = '用户名至少3个字符'
+        elif user['password'] and len(user['password']) < 6:
+            message = '密码至少6个字符'
+        elif user['username'] in seen_usernames:
+            message = '文件中用户名重复'
+        elif user['email'] in seen_emails:
+            message = '文件中邮箱重复'
+        else:
+            message = None
+        if message:
+            entry.update(status='invalid', message=message)
+            continue
+        seen_usernames.add(user['username'])
+        seen_emails.add(user['email'])
+        candidates.append(dict(user, row=entry['row']))
+
+    # 2. 与已有账户的冲突（只读查询，不占用写锁）
+    with pool.connection() as conn:
+        conflicts = _conflicts(conn, candidates)
+    to_insert = [row for row in candidates if row['row'] not in conflicts]
+
+    # 3. 密码哈希（在事务外完成）
+    generated = {}
+    if not dry_run and to_insert:
+        supplied = [row for row in to_insert if row['password']]
+        one_time = [row for row in to_insert if not row['password']]
+        for row in one_time:
+            row['password'] = generated[row['row']] = secrets.token_urlsafe(GENERATED_PASSWORD_BYTES)
+        hashes = dict(zip((row['row'] for row in supplied),
+                          hasher.hash_many([row['password'] for row in supplied])))
+        hashes.update(zip((row['row'] for row in one_time),
+                          hasher.hash_many([row['password'] for row in one_time], cost=one_time_cost)))
+
+        # 4. 一个事务内插入；持有写锁后再检查一次冲突，排除并发注册的账户
+        with pool.transaction() as conn:
+            late_conflicts = _conflicts(conn, to_insert)
+            conflicts.update(late_conflicts)
+            rows = [(row, hashes[row['row']]) for row in to_insert if row['row'] not in late_conflicts]
+            conn.executemany(
+                'INSERT INTO users (username, email, password_hash, must_change_password) VALUES (?, ?, ?, ?)',
+                [(row['username'], row['email'], password_hash, int(row['row'] in generated))
+                 for row, password_hash in rows]
+            )
+            to_insert = [row for row, _ in rows]
+            created_ids = {}
+            usernames = [row['username'] for row in to_insert]
+            for offset in range(0, len(usernames), IN_QUERY_BATCH):
+                batch = usernames[offset:offset + IN_QUERY_BATCH]
+                created_ids.update(conn.execute(
+                    f'SELECT username, id FROM users WHERE username IN ({",".join("?" * len(batch))})', batch
+                ))
+    else:
+        created_ids = {}
+
+    for row in to_insert:
+        entry = report[row['row'] - 1]
+        if dry_run:
+            entry.update(status='ok', message='校验通过')
+        else:
+            entry.update(status='created', id=created_ids.get(row['username']))
+            if row['row'] in generated:
+                entry['password'] = generated[row['row']]
+                entry['must_change_password'] = True
+    for row_number, message in conflicts.items():
+        report[row_number - 1].update(status='conflict', message=message)
+
+    counts = {}
+    for entry in report:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return {
+        'summary': {
+            'total': len(report),
+            'created': counts.get('created', 0),
+            'valid': counts.get('ok', 0),
+            'conflict': counts.get('conflict', 0),
+            'invalid': counts.get('invalid', 0),
+            'dry_run': dry_run,
+            'seconds': round(time.perf_counter() - start, 3)
+        },
+        'rows': report
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入用户（CSV / JSON）")
+    parser.add_argument("file", help="导入文件（.csv 或 .json）")
+    parser.add_argument("--format", choices=('csv', 'json'), help="文件格式，默认按扩展名判断")
+    parser.add_argument("--db", help="用户数据库路径（默认为 AUTH_DB_FILE 或 users.db）")
+    parser.add_argument("--dry-run", action="store_true", help="只校验和检查冲突，不写入")
+    parser.add_argument("--report", help="逐行报告输出路径（JSON）；包含生成的初始密码，请妥善保管")
+    args = parser.parse_args()
+
+    fmt = args.format or ('json' if args.file.lower().endswith('.json') else 'csv')
+    with open(args.file, 'r', encoding='utf-8-sig') as f:
+        data = f.read()
+    try:
+        users = parse_users(data, fmt)
+    except ImportFormatError as e:
+        print(f"错误: {e}")
+        return 1
+
+    if not args.dry_run and not args.report and any(not user['password'] for user in users):
+        print("错误: 部分行没有密码，将生成随机初始密码，请使用 --report 指定报告路径以保存这些密码")
+        return 1
+
+    if args.db:
+        os.environ['AUTH_DB_FILE'] = args.db
+    # 导入 auth_service 时会初始化数据库，并按环境变量配置连接池和哈希参数
+    import auth_service
+
+    result = import_users(auth_service.db_pool, auth_service.password_hasher, users, args.dry_run,
+                          one_time_cost=auth_service.ONE_TIME_PASSWORD_COST)
+    summary = result['summary']
+    print(f"共 {summary['total']} 行：新建 {summary['created']}，校验通过 {summary['valid']}，"
+          f"冲突 {summary['conflict']}，无效 {summary['invalid']}，耗时 {summary['seconds']} 秒")
+    for entry in result['rows']:
+        if entry['status'] in ('conflict', 'invalid'):
+            print(f"  第 {entry['row']} 行 {entry['username']}: {entry['message']}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"报告已写入 {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
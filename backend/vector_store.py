@@ -1,44 +1,253 @@
 """
-向量数据库管理 - 使用ChromaDB
+向量数据库管理 - 默认使用ChromaDB，也可切换为内存映射的NumPy精确检索（见 index_backends.py）
 """
+import json
 import os
-from typing import List, Dict, Optional
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Optional, Union
 
 # 设置Hugging Face镜像（必须在导入模型库之前）
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 
-import chromadb
-from sentence_transformers import SentenceTransformer
+# chromadb 和 sentence_transformers 导入很慢，在首次使用时才导入（见 _ensure_backend/_ensure_model）
+from embedding_backends import load_embedding_model
+from embedding_cache import EmbeddingCache
+from index_backends import IndexBackend, VectorIndex, create_index_backend
+from lexical_index import LexicalIndex
+from metrics import stage_timer
+from rebuild_job import IndexWriteLock
+from search_cache import LRUCache
+
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# 影子集合切换后，旧集合延迟删除的时间（秒），让进行中的查询完成
+RETIRED_COLLECTION_TTL = 60
+
+# 超过该时间（秒）仍未切换的影子集合视为上次重建中断遗留，启动时删除
+ORPHAN_SHADOW_AGE = 6 * 3600
+
+# persist_directory 下的跨进程索引写入锁文件（重建、增量同步、删除旧集合时持有）
+INDEX_WRITE_LOCK_FILE = 'index_write.lock'
+
+# 检索模式：vector 向量检索；lexical 词法倒排索引（BM25，不需要模型前向计算）；hybrid 两者RRF融合
+SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+
+# RRF 融合常数，以及 hybrid 模式每一路召回的候选数相对 top_k 的倍数
+RRF_K = 60
+HYBRID_CANDIDATE_FACTOR = 4
 
 
 class VectorStore:
     """向量数据库管理类"""
     
-    def __init__(self, persist_directory="./chroma_db", collection_name="knowledge_base"):
+    def __init__(self, persist_directory="./chroma_db", collection_name="knowledge_base",
+                 query_cache_size=1024, query_cache_ttl=3600,
+                 result_cache_size=512, result_cache_ttl=300,
+                 model_name=EMBEDDING_MODEL_NAME, embedding_backend='fp32', num_threads=None,
+                 embedding_cache_size=200000, index_backend='chroma', lazy=True):
         """
         初始化向量数据库
         
         Args:
             persist_directory: 数据库持久化目录
             collection_name: 集合名称
+            query_cache_size: 查询向量缓存条目数（0为禁用）
+            query_cache_ttl: 查询向量缓存存活时间（秒）
+            result_cache_size: 搜索结果缓存条目数（0为禁用）
+            result_cache_ttl: 搜索结果缓存存活时间（秒）
+            model_name: embedding模型名称
+            embedding_backend: 推理后端，'fp32'（默认）或 'int8'（CPU动态量化，见 embedding_backends.py）
+            num_threads: PyTorch 计算线程数，None 为默认值
+            embedding_cache_size: 磁盘embedding缓存最多保存的向量数（0为禁用，见 embedding_cache.py）
+            index_backend: 向量索引后端，'chroma'（默认）或 'numpy'（内存映射精确检索）
+            lazy: 为True时模型和数据库客户端在首次使用时才加载；为False时立即加载
         """
         self.persist_directory = persist_directory
         self.collection_name = collection_name
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.num_threads = num_threads
+        self.index_backend = index_backend
         
-        # 初始化ChromaDB客户端（使用新接口 PersistentClient）
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        # 查询向量只与模型和查询文本有关；搜索结果还与集合内容有关，
+        # 集合每次写入/删除/清空都会递增版本号，使旧结果自然失效
+        self.query_embedding_cache = LRUCache(query_cache_size, query_cache_ttl)
+        self.result_cache = LRUCache(result_cache_size, result_cache_ttl)
+        self.collection_version = 0
+        self._version_lock = threading.Lock()
         
-        # 加载中文embedding模型
-        print("加载embedding模型...")
-        self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        print("模型加载完成")
+        # 共享数据版本：任何进程切换集合或增量同步后更新版本文件，其他进程轮询发现后重新打开集合
+        self.data_version = 0
+        self.write_lock = IndexWriteLock(os.path.join(persist_directory, INDEX_WRITE_LOCK_FILE))
         
-        # 获取或创建集合（新版API）
-        self.collection = self.client.get_or_create_collection(
-            name=collection_name,
-            metadata={"description": "教学知识库"}
-        )
-        print(f"集合已就绪: {collection_name}")
+        # 文本块向量的磁盘缓存（按内容寻址，跨重建复用），首次入库时打开
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = None
+        
+        # 延迟加载的重量级对象
+        self._load_lock = threading.RLock()
+        self._backend: Optional[IndexBackend] = None
+        self._embedding_model = None
+        self._collection = None
+        self.active_collection_name = None
+        self.warmed_up = False
+        
+        # 每个集合对应一个词法索引（集合名 → LexicalIndex），持久化在 persist_directory 下
+        self._lexical_indexes: Dict[str, LexicalIndex] = {}
+        self._lexical_lock = threading.Lock()
+        
+        # 启动耗时分解（秒）：import、模型加载、打开集合、预热
+        self.startup_timings: Dict[str, float] = {}
+        
+        if not lazy:
+            self.load()
+    
+    # ---- 延迟加载 ----
+    
+    @property
+    def backend(self) -> IndexBackend:
+        """向量索引后端（首次访问时创建）"""
+        if self._backend is None:
+            self._ensure_backend()
+        return self._backend
+    
+    @property
+    def embedding_model(self):
+        """embedding模型（首次访问时加载）"""
+        if self._embedding_model is None:
+            self._ensure_model()
+        return self._embedding_model
+    
+    @embedding_model.setter
+    def embedding_model(self, model):
+        self._embedding_model = model
+    
+    @property
+    def collection(self) -> VectorIndex:
+        """当前生效的集合（首次访问时打开）"""
+        if self._collection is None:
+            self._ensure_collection()
+        return self._collection
+    
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+    
+    @property
+    def is_ready(self) -> bool:
+        """模型已加载且集合已打开"""
+        return self._embedding_model is not None and self._collection is not None
+    
+    def load(self, warmup: bool = False) -> Dict[str, float]:
+        """
+        立即加载模型、打开集合，可选预热一次encode
+        
+        Returns:
+            启动耗时分解
+        """
+        self._ensure_model()
+        self._ensure_collection()
+        if warmup:
+            self.warmup()
+        timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_timings.items())
+        print(f"向量数据库启动耗时: {timings}")
+        return dict(self.startup_timings)
+    
+    def warmup(self, text: str = "教学目标") -> None:
+        """执行一次encode，让首个真实查询不必承担模型初始化开销"""
+        start = time.perf_counter()
+        self.embedding_model.encode([text])
+        self.startup_timings['warmup'] = round(time.perf_counter() - start, 3)
+        self.warmed_up = True
+    
+    def _ensure_backend(self) -> None:
+        with self._load_lock:
+            if self._backend is not None:
+                return
+            # chroma 后端在这里导入 chromadb，耗时计入 backend_open
+            start = time.perf_counter()
+            self._backend = create_index_backend(self.index_backend, self.persist_directory)
+            self.startup_timings['backend_open'] = round(time.perf_counter() - start, 3)
+    
+    def _ensure_model(self) -> None:
+        with self._load_lock:
+            if self._embedding_model is not None:
+                return
+            start = time.perf_counter()
+            import sentence_transformers  # 单独统计导入耗时，模型在 load_embedding_model 中创建
+            self.startup_timings['import_sentence_transformers'] = round(time.perf_counter() - start, 3)
+            
+            # 加载中文embedding模型
+            print(f"加载embedding模型（{self.embedding_backend}）...")
+            start = time.perf_counter()
+            self._embedding_model = load_embedding_model(
+                self.model_name, backend=self.embedding_backend, num_threads=self.num_threads
+            )
+            self.startup_timings['model_load'] = round(time.perf_counter() - start, 3)
+            print("模型加载完成")
+    
+    def _ensure_collection(self, drop_orphans: bool = True) -> None:
+        with self._load_lock:
+            if self._collection is not None:
+                return
+            backend = self.backend
+            start = time.perf_counter()
+            # 获取或创建集合
+            # 后台重建会写入带版本号的影子集合再切换，当前生效的集合名记录在指针文件中
+            self.data_version = self._read_data_version()
+            self.active_collection_name = self._read_active_pointer() or self.collection_name
+            self._collection = backend.open(self.active_collection_name)
+            if drop_orphans:
+                self._drop_orphan_shadows()
+                self.drop_retired_collections()
+            self.startup_timings['collection_open'] = round(time.perf_counter() - start, 3)
+            print(f"集合已就绪: {self.active_collection_name}")
+    
+    # ---- 多进程（见 serve.py） ----
+    
+    def after_fork(self) -> None:
+        """
+        在 fork 出的工作进程中调用：重建锁，chroma 后端重新打开客户端
+        
+        模型权重与父进程共享（写时复制）；chroma 客户端持有 SQLite 连接和后台线程，不能跨进程使用。
+        不删除孤立集合：其他工作进程可能仍在使用旧集合，切换下来的旧集合超时后由 drop_retired_collections 删除。
+        """
+        self._load_lock = threading.RLock()
+        self._version_lock = threading.Lock()
+        self._lexical_lock = threading.Lock()
+        self.write_lock = IndexWriteLock(self.write_lock.path)
+        if self.index_backend == 'chroma':
+            self._backend = None
+            self._collection = None
+        self._ensure_collection(drop_orphans=False)
+        # 主进程打开集合后其他进程可能已经切换或同步
+        self.reload_collection()
+    
+    def reload_collection(self) -> bool:
+        """
+        重新读取集合指针和数据版本；其他进程（重建脚本或另一个工作进程）切换了集合或增量同步后，
+        重新打开集合和词法索引，并使本进程的缓存失效
+        
+        Returns:
+            是否重新打开了集合
+        """
+        name = self._read_active_pointer() or self.collection_name
+        if (self._collection is not None and name == self.active_collection_name
+                and self._read_data_version() == self.data_version):
+            return False
+        with self._version_lock:
+            if self.index_backend == 'chroma':
+                # chroma 客户端缓存了集合列表，重新创建才能看到其他进程新建的集合
+                self._backend = None
+            with self._lexical_lock:
+                self._lexical_indexes.pop(self.active_collection_name, None)
+                self._lexical_indexes.pop(name, None)
+            self._collection = None
+            self._ensure_collection(drop_orphans=False)
+        self.invalidate_caches()
+        return True
     
     def add_documents(self, documents: List[Dict]) -> None:
         """
@@ -57,80 +266,525 @@ class VectorStore:
         metadatas = [doc["metadata"] for doc in documents]
         
         # 生成唯一ID
-        ids = [f"{doc['metadata']['source']}_{doc['metadata']['chunk_id']}" 
-               for doc in documents]
+        ids = [self.make_id(doc['metadata']) for doc in documents]
         
         # 生成embeddings（批量处理）
         batch_size = 32
         for i in range(0, len(texts), batch_size):
             batch_texts = texts[i:i+batch_size]
-            batch_ids = ids[i:i+batch_size]
-            batch_metadatas = metadatas[i:i+batch_size]
             
-            embeddings = self.embedding_model.encode(batch_texts).tolist()
-            
-            # 添加到数据库
-            self.collection.add(
-                embeddings=embeddings,
-                documents=batch_texts,
-                metadatas=batch_metadatas,
-                ids=batch_ids
-            )
+            embeddings = self.embed_texts(batch_texts)
+            self.write_embeddings(ids[i:i+batch_size], embeddings, batch_texts, metadatas[i:i+batch_size])
             
             print(f"已处理 {min(i+batch_size, len(texts))}/{len(texts)} 个文档")
         
-        # PersistentClient 会自动持久化，无需显式调用 persist()
+        self.flush()
         print("向量数据库更新完成")
     
-    def search(self, query: str, top_k: int = 3) -> List[Dict]:
+    @staticmethod
+    def make_id(metadata: Dict) -> str:
+        """文档块唯一ID: {source}_{chunk_id}"""
+        return f"{metadata['source']}_{metadata['chunk_id']}"
+    
+    @property
+    def embedding_cache(self) -> Optional[EmbeddingCache]:
+        """文本块向量的磁盘缓存（禁用时为None）"""
+        if self._embedding_cache is None and self.embedding_cache_size > 0:
+            with self._load_lock:
+                if self._embedding_cache is None:
+                    self._embedding_cache = EmbeddingCache(
+                        os.path.join(self.persist_directory, "embedding_cache"),
+                        model_key=f"{self.model_name}:{self.embedding_backend}",
+                        max_entries=self.embedding_cache_size
+                    )
+        return self._embedding_cache
+    
+    def reopen_embedding_cache(self) -> None:
+        """
+        写入前（已持有 write_lock）丢弃内存中的槽位索引，下次使用时从磁盘重新打开：
+        其他进程可能已经写入了缓存文件
+        """
+        with self._load_lock:
+            self._embedding_cache = None
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文本向量，内容相同的文本块直接复用磁盘缓存中的向量"""
+        cache = self.embedding_cache
+        if cache is None:
+            with stage_timer('ingest_encode'):
+                return self.embedding_model.encode(texts).tolist()
+        
+        embeddings = cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            with stage_timer('ingest_encode'):
+                encoded = self.embedding_model.encode(missing_texts)
+            cache.put_many(missing_texts, encoded)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        return [embedding.tolist() for embedding in embeddings]
+    
+    def write_embeddings(self, ids: List[str], embeddings: List[List[float]],
+                         texts: List[str], metadatas: List[Dict], collection=None) -> None:
+        """
+        写入已向量化的文档块（upsert: 增量同步时文件内容变化会复用相同ID）
+        
+        Args:
+            collection: 目标集合，默认为当前生效的集合；重建时传入影子集合
+        """
+        target = collection if collection is not None else self.collection
+        lexical_index = self.get_lexical_index(target)
+        target.add(ids, embeddings, texts, metadatas)
+        lexical_index.add_many(ids, texts)
+        if target is self.collection:
+            self.invalidate_caches()
+    
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict], collection=None) -> None:
+        """
+        替换文档块的元数据（如去重后补充来源）
+        
+        Args:
+            collection: 目标集合，默认为当前生效的集合
+        """
+        target = collection if collection is not None else self.collection
+        target.update_metadatas(ids, metadatas)
+        if target is self.collection:
+            self.invalidate_caches()
+    
+    def delete_documents(self, ids: List[str]) -> None:
+        """
+        按ID删除文档块
+        
+        Args:
+            ids: 文档块ID列表，格式为 {source}_{chunk_id}
+        """
+        if not ids:
+            return
+        
+        batch_size = 500
+        for i in range(0, len(ids), batch_size):
+            self.collection.delete(ids[i:i+batch_size])
+        self.get_lexical_index(self.collection).remove(ids)
+        self.flush()
+        self.invalidate_caches()
+        print(f"已删除 {len(ids)} 个文档块")
+    
+    def search(self, query: str, top_k: int = 3, where: Optional[Dict] = None,
+               mode: str = 'vector') -> List[Dict]:
         """
         搜索相关文档
         
         Args:
             query: 查询文本
             top_k: 返回top k个结果
+            where: 元数据过滤条件（ChromaDB where 语法），例如 {"source": "xxx.pdf"}
+            mode: 检索模式，'vector'（默认）、'lexical' 或 'hybrid'
             
         Returns:
             相关文档列表
         """
-        # 生成查询向量
-        query_embedding = self.embedding_model.encode([query]).tolist()
+        return self.search_many([query], top_k=top_k, where=where, mode=mode)[0]
+    
+    def search_many(self, queries: List[str], top_k: Union[int, List[int]] = 3,
+                    where: Optional[Dict] = None, mode: str = 'vector') -> List[List[Dict]]:
+        """
+        批量搜索：未命中缓存的查询只做一次批量encode和一次多向量query
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 统一的top k，或与queries等长的列表
+            where: 元数据过滤条件，对所有查询生效
+            mode: 检索模式，'vector'、'lexical'（只查倒排索引，不做encode）或 'hybrid'（RRF融合）
+            
+        Returns:
+            与queries顺序一致的结果列表
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索模式: {mode}，可选: {', '.join(SEARCH_MODES)}")
+        top_ks = top_k if isinstance(top_k, list) else [top_k] * len(queries)
+        if len(top_ks) != len(queries):
+            raise ValueError("top_k列表长度必须与queries一致")
+        
+        version = self.collection_version
+        cache_keys = [self._result_cache_key(query, k, where, version, mode)
+                      for query, k in zip(queries, top_ks)]
         
-        # 搜索
-        results = self.collection.query(
-            query_embeddings=query_embedding,
-            n_results=top_k
+        results: List[Optional[List[Dict]]] = [self.result_cache.get(key) for key in cache_keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        
+        if missing:
+            # 同一批查询使用同一个集合及其词法索引（避免查询期间恰好发生切换）
+            collection = self.collection
+            missing_queries = [queries[i] for i in missing]
+            missing_top_ks = [top_ks[i] for i in missing]
+            if mode == 'vector':
+                found = self._vector_search(collection, missing_queries, max(missing_top_ks), where)
+            elif mode == 'lexical':
+                found = [self._lexical_search(collection, query, k, where)
+                         for query, k in zip(missing_queries, missing_top_ks)]
+            else:
+                found = self._hybrid_search(collection, missing_queries, missing_top_ks, where)
+            
+            for i, documents in zip(missing, found):
+                documents = documents[:top_ks[i]]
+                # 版本号在查询期间发生变化时不缓存（结果可能来自旧数据）
+                if version == self.collection_version:
+                    self.result_cache.put(cache_keys[i], documents)
+                results[i] = documents
+        
+        return [list(documents) for documents in results]
+    
+    def _vector_search(self, collection, queries: List[str], n_results: int,
+                       where: Optional[Dict]) -> List[List[Dict]]:
+        """一次批量encode + 一次多向量query"""
+        query_embeddings = self.embed_queries(queries)
+        with stage_timer('index_query'):
+            return collection.search(query_embeddings, n_results, where)
+    
+    def _lexical_search(self, collection, query: str, top_k: int,
+                        where: Optional[Dict]) -> List[Dict]:
+        """BM25检索，按ID从集合取回文本和元数据"""
+        # 有过滤条件时多取一些候选，过滤后再截断
+        pool = top_k if not where else max(top_k * 20, 200)
+        with stage_timer('lexical_search'):
+            ranked = self.get_lexical_index(collection).search(query, pool)
+        if not ranked:
+            return []
+        documents = self._fetch_documents(collection, [doc_id for doc_id, _ in ranked], where)
+        results = []
+        for doc_id, score in ranked:
+            if doc_id in documents:
+                results.append(dict(documents[doc_id], score=score))
+                if len(results) >= top_k:
+                    break
+        return results
+    
+    def _hybrid_search(self, collection, queries: List[str], top_ks: List[int],
+                       where: Optional[Dict]) -> List[List[Dict]]:
+        """向量与BM25各取候选，按RRF（倒数排名融合）合并"""
+        vector_rows = self._vector_search(
+            collection, queries, max(top_ks) * HYBRID_CANDIDATE_FACTOR, where
         )
+        results = []
+        for query, k, vector_docs in zip(queries, top_ks, vector_rows):
+            lexical_docs = self._lexical_search(collection, query, k * HYBRID_CANDIDATE_FACTOR, where)
+            fused: Dict[str, Dict] = {}
+            for ranking in (vector_docs, lexical_docs):
+                for rank, doc in enumerate(ranking):
+                    entry = fused.setdefault(doc['id'], dict(doc, score=0.0))
+                    if doc.get('distance') is not None:
+                        entry['distance'] = doc['distance']
+                    entry['score'] += 1.0 / (RRF_K + rank + 1)
+            ranked = sorted(fused.values(), key=lambda doc: -doc['score'])
+            results.append(ranked[:k])
+        return results
+    
+    def _fetch_documents(self, collection, ids: List[str], where: Optional[Dict]) -> Dict[str, Dict]:
+        """按ID批量取回文档（可附加元数据过滤）"""
+        with stage_timer('fetch_documents'):
+            return {doc['id']: dict(doc, distance=None) for doc in collection.get(ids=ids, where=where)}
+    
+    def get_cached_result(self, query: str, top_k: int = 3, where: Optional[Dict] = None,
+                          mode: str = 'vector') -> Optional[List[Dict]]:
+        """只查结果缓存，未命中返回None（不触发encode和向量查询）"""
+        cached = self.result_cache.get(
+            self._result_cache_key(query, top_k, where, self.collection_version, mode), count_miss=False
+        )
+        return list(cached) if cached is not None else None
+    
+    @staticmethod
+    def _result_cache_key(query: str, top_k: int, where: Optional[Dict], version: int,
+                          mode: str = 'vector') -> tuple:
+        return (query, top_k, json.dumps(where, sort_keys=True, ensure_ascii=False), version, mode)
+    
+    # ---- 词法索引 ----
+    
+    def _lexical_index_path(self, collection_name: str) -> Path:
+        return self.state_directory / f"{collection_name}_lexical.json.gz"
+    
+    def get_lexical_index(self, collection=None) -> LexicalIndex:
+        """
+        获取集合对应的词法索引；首次使用时从磁盘加载，文件不存在时由集合内容重建
         
-        # 格式化结果
-        documents = []
-        if results['documents'] and results['documents'][0]:
-            for i in range(len(results['documents'][0])):
-                documents.append({
-                    "content": results['documents'][0][i],
-                    "metadata": results['metadatas'][0][i],
-                    "distance": results['distances'][0][i] if 'distances' in results else None
-                })
+        Args:
+            collection: 集合对象，默认为当前生效的集合
+        """
+        collection = collection if collection is not None else self.collection
+        with self._lexical_lock:
+            index = self._lexical_indexes.get(collection.name)
+            if index is not None:
+                return index
+            index = LexicalIndex(self._lexical_index_path(collection.name))
+            if not index.load():
+                self._rebuild_lexical_index(collection, index)
+            self._lexical_indexes[collection.name] = index
+            return index
+    
+    def _rebuild_lexical_index(self, collection, index: LexicalIndex, page_size: int = 1000) -> None:
+        """分页读取集合中的全部文本块，重建词法索引"""
+        total = collection.count()
+        if total:
+            print(f"重建词法索引 {collection.name}（{total} 个文本块）...")
+        for offset in range(0, total, page_size):
+            page = collection.get(limit=page_size, offset=offset)
+            index.add_many([doc['id'] for doc in page], [doc['content'] or "" for doc in page])
+        index.dirty = True
+        index.save()
+    
+    def flush_lexical_index(self, collection=None) -> None:
+        """
+        把词法索引写入磁盘（入库完成后调用）
+        
+        Args:
+            collection: 集合对象，默认为当前生效的集合
+        """
+        self.get_lexical_index(collection).save()
+    
+    def flush(self, collection=None) -> None:
+        """
+        入库完成后把集合（NumPy后端）、词法索引和embedding缓存写入磁盘
         
-        return documents
+        Args:
+            collection: 集合对象，默认为当前生效的集合
+        """
+        (collection if collection is not None else self.collection).flush()
+        self.flush_lexical_index(collection)
+        if self._embedding_cache is not None:
+            self._embedding_cache.flush()
+    
+    def embed_query(self, query: str) -> List[float]:
+        """生成查询向量（带LRU缓存）"""
+        return self.embed_queries([query])[0]
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """批量生成查询向量，未命中缓存的查询合并为一次encode"""
+        embeddings = [self.query_embedding_cache.get(query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            with stage_timer('encode'):
+                encoded = self.embedding_model.encode([queries[i] for i in missing]).tolist()
+            for i, embedding in zip(missing, encoded):
+                self.query_embedding_cache.put(queries[i], embedding)
+                embeddings[i] = embedding
+        return embeddings
+    
+    def invalidate_caches(self) -> None:
+        """集合内容变化后使搜索结果缓存失效"""
+        with self._version_lock:
+            self.collection_version += 1
+        self.result_cache.clear()
+    
+    def get_cache_stats(self) -> Dict:
+        """缓存命中率等统计信息"""
+        return {
+            "collection_version": self.collection_version,
+            "query_embedding_cache": self.query_embedding_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+            "embedding_cache": self._embedding_cache.stats() if self._embedding_cache is not None else None
+        }
     
     def get_collection_stats(self) -> Dict:
         """获取集合统计信息"""
         count = self.collection.count()
         return {
             "collection_name": self.collection_name,
+            "active_collection": self.active_collection_name,
             "document_count": count,
+            "index_backend": self.index_backend,
             "persist_directory": self.persist_directory
         }
     
+    # ---- 影子集合与原子切换 ----
+    
+    def create_shadow_collection(self):
+        """
+        创建带版本号的影子集合，用于后台全量重建
+        
+        Returns:
+            (集合名称, 集合对象)
+        """
+        name = f"{self.collection_name}_v{int(time.time() * 1000)}"
+        collection = self.backend.create(name)
+        print(f"已创建影子集合: {name}")
+        return name, collection
+    
+    def swap_collection(self, name: str, collection) -> None:
+        """原子切换到新集合；旧集合延迟删除，进行中的查询仍可完成"""
+        self._ensure_collection()
+        self.flush(collection)
+        with self._version_lock:
+            old_name = self.active_collection_name
+            self.collection = collection
+            self.active_collection_name = name
+            self._write_active_pointer(name)
+            self.bump_data_version()
+        self.invalidate_caches()
+        print(f"已切换到集合: {name}")
+        
+        if old_name != name:
+            # 旧集合记录在状态文件中：重建脚本切换后随即退出、计时器来不及执行时，
+            # 由服务轮询（见 knowledge_service.watch_index）或下次启动时删除
+            self._retire_collection(old_name)
+            timer = threading.Timer(RETIRED_COLLECTION_TTL, self.drop_retired_collections)
+            timer.daemon = True
+            timer.start()
+    
+    def drop_shadow_collection(self, name: str) -> None:
+        """重建失败时删除未切换的影子集合"""
+        self._ensure_collection()
+        if name != self.active_collection_name:
+            self._drop_collection(name)
+    
+    def _drop_collection(self, name: str) -> None:
+        try:
+            self.backend.drop(name)
+            print(f"已删除旧集合: {name}")
+        except Exception as e:
+            print(f"删除集合失败 {name}: {e}")
+        with self._lexical_lock:
+            self._lexical_indexes.pop(name, None)
+        try:
+            self._lexical_index_path(name).unlink()
+        except OSError:
+            pass
+    
+    @property
+    def _retired_path(self) -> Path:
+        return self.state_directory / f"{self.collection_name}_retired.json"
+    
+    def _read_retired(self) -> Dict[str, float]:
+        try:
+            with open(self._retired_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_retired(self, retired: Dict[str, float]) -> None:
+        path = self._retired_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(retired, f)
+        os.replace(tmp_path, path)
+    
+    def _retire_collection(self, name: str) -> None:
+        """记录被切换下来的旧集合及切换时间"""
+        retired = self._read_retired()
+        retired[name] = time.time()
+        self._write_retired(retired)
+    
+    def drop_retired_collections(self, min_age: float = RETIRED_COLLECTION_TTL) -> List[str]:
+        """
+        删除切换下来已超过 min_age 秒的旧集合（给仍在使用旧集合的进程留出重新读取指针的时间）
+        
+        其他进程正在写入索引时跳过，下次再删除
+        
+        Returns:
+            已删除的集合名
+        """
+        if not self._read_retired() or not self.write_lock.acquire():
+            return []
+        try:
+            return self._drop_retired_locked(min_age)
+        finally:
+            self.write_lock.release()
+    
+    def _drop_retired_locked(self, min_age: float) -> List[str]:
+        retired = self._read_retired()
+        active = self._read_active_pointer() or self.collection_name
+        existing = set(self.backend.list_names())
+        now = time.time()
+        dropped = []
+        for name, retired_at in list(retired.items()):
+            if name != active and now - retired_at < min_age:
+                continue
+            if name != active and name in existing:
+                self._drop_collection(name)
+                dropped.append(name)
+            del retired[name]
+        self._write_retired(retired)
+        return dropped
+    
+    def _drop_orphan_shadows(self) -> None:
+        """删除上次进程退出前未切换或未来得及删除的旧集合/影子集合"""
+        prefix = f"{self.collection_name}_v"
+        now_ms = time.time() * 1000
+        for name in self.backend.list_names():
+            if name == self.active_collection_name:
+                continue
+            if name == self.collection_name:
+                self._drop_collection(name)
+            elif name.startswith(prefix) and name[len(prefix):].isdigit():
+                # 最近创建的影子集合可能正被其他进程写入，暂不删除
+                if now_ms - int(name[len(prefix):]) > ORPHAN_SHADOW_AGE * 1000:
+                    self._drop_collection(name)
+    
+    @property
+    def state_directory(self) -> Path:
+        """
+        集合指针、词法索引、文件清单所在目录
+        
+        chroma 后端为 persist_directory（与旧版本兼容），numpy 后端为其下的 numpy_index/，
+        两种后端的索引可以并存，切换后端不会误用对方的状态文件
+        """
+        if self.index_backend == 'chroma':
+            return Path(self.persist_directory)
+        return Path(self.persist_directory) / f"{self.index_backend}_index"
+    
+    @property
+    def _active_pointer_path(self) -> Path:
+        return self.state_directory / f"{self.collection_name}_active.json"
+    
+    def _read_active_pointer(self) -> Optional[str]:
+        try:
+            with open(self._active_pointer_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('collection')
+        except (OSError, ValueError):
+            return None
+    
+    @property
+    def _data_version_path(self) -> Path:
+        return self.state_directory / f"{self.collection_name}_version.json"
+    
+    def _read_data_version(self) -> int:
+        try:
+            with open(self._data_version_path, 'r', encoding='utf-8') as f:
+                return int(json.load(f).get('version', 0))
+        except (OSError, ValueError, AttributeError):
+            return 0
+    
+    def bump_data_version(self) -> None:
+        """
+        集合切换或增量同步写入完成后调用（已持有 write_lock）：更新共享数据版本，
+        其他进程在 reload_collection 中发现版本变化后重新打开集合
+        """
+        path = self._data_version_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        version = max(time.time_ns(), self._read_data_version() + 1)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": version}, f)
+        os.replace(tmp_path, path)
+        self.data_version = version
+    
+    def _write_active_pointer(self, name: str) -> None:
+        """原子写入当前生效集合名"""
+        path = self._active_pointer_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"collection": name}, f)
+        os.replace(tmp_path, path)
+    
     def clear_collection(self) -> None:
         """清空集合"""
-        self.client.delete_collection(name=self.collection_name)
-        self.collection = self.client.create_collection(
-            name=self.collection_name,
-            metadata={"description": "教学知识库"}
-        )
-        print(f"集合 {self.collection_name} 已清空")
+        self.collection.clear()
+        lexical_index = self.get_lexical_index(self.collection)
+        lexical_index.clear()
+        lexical_index.save()
+        self.invalidate_caches()
+        print(f"集合 {self.active_collection_name} 已清空")
 
 
 if __name__ == "__main__":
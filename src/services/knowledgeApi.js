@@ -34,13 +34,15 @@ export const knowledgeService = {
    * @param {Object} params - 搜索参数
    * @param {string} params.query - 搜索关键词
    * @param {number} params.topK - 返回结果数量，默认3
+   * @param {string} [params.mode] - 检索模式：vector / lexical（精确术语）/ hybrid
    * @returns {Promise<Array>} 搜索结果列表
    */
-  search: async ({ query, topK = 3 }) => {
+  search: async ({ query, topK = 3, mode }) => {
     try {
       const response = await knowledgeClient.post('/api/knowledge/search', {
         query,
         top_k: topK,
+        mode,
       });
       return response.results || [];
     } catch (error) {
@@ -49,6 +51,26 @@ export const knowledgeService = {
     }
   },
 
+  /**
+   * 批量搜索知识库（多个查询合并为一次请求）
+   * @param {Array<{query: string, topK?: number}>} queries - 查询列表
+   * @param {Object} [options]
+   * @param {string} [options.mode] - 检索模式：vector / lexical / hybrid
+   * @returns {Promise<Array<Array>>} 与 queries 顺序一致的结果列表
+   */
+  searchBatch: async (queries, { mode } = {}) => {
+    try {
+      const response = await knowledgeClient.post('/api/knowledge/search/batch', {
+        queries: queries.map(({ query, topK = 3 }) => ({ query, top_k: topK })),
+        mode,
+      });
+      return (response.results || []).map((item) => item.results || []);
+    } catch (error) {
+      console.error('知识库批量搜索失败:', error);
+      throw error;
+    }
+  },
+
   /**
    * 获取知识库统计信息
    * @returns {Promise<Object>} 统计信息
@@ -64,12 +86,14 @@ export const knowledgeService = {
   },
 
   /**
-   * 重建知识库索引
-   * @returns {Promise<Object>} 重建结果
+   * 启动后台重建知识库索引（立即返回任务信息，进度通过 getRebuildStatus 查询）
+   * @param {Object} [options]
+   * @param {boolean} [options.incremental=false] - 只同步变化的文件
+   * @returns {Promise<Object>} 包含 job 的响应
    */
-  rebuildIndex: async () => {
+  rebuildIndex: async ({ incremental = false } = {}) => {
     try {
-      const response = await knowledgeClient.post('/api/knowledge/rebuild');
+      const response = await knowledgeClient.post('/api/knowledge/rebuild', { incremental });
       return response;
     } catch (error) {
       console.error('重建知识库失败:', error);
@@ -77,6 +101,20 @@ export const knowledgeService = {
     }
   },
 
+  /**
+   * 查询重建任务状态
+   * @returns {Promise<Object|null>} 任务状态（state、files_done、chunks_embedded、eta_seconds 等）
+   */
+  getRebuildStatus: async () => {
+    try {
+      const response = await knowledgeClient.get('/api/knowledge/rebuild/status');
+      return response.job || null;
+    } catch (error) {
+      console.error('获取重建状态失败:', error);
+      throw error;
+    }
+  },
+
   /**
    * 健康检查
    * @returns {Promise<boolean>} 服务是否可用